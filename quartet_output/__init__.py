@@ -14,3 +14,4 @@
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 # -*- coding: utf-8
 __version__ = '3.2.3'
+default_app_config = 'quartet_output.apps.QuartetOutputConfig'
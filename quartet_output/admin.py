@@ -19,10 +19,16 @@ from quartet_output import models
 class EndPointAdmin(admin.ModelAdmin):
     list_display = ('name', 'urn')
 
+
+class CriteriaEndPointInline(admin.TabularInline):
+    model = models.CriteriaEndPoint
+    extra = 0
+
 class CriteriaAdmin(admin.ModelAdmin):
     list_display = (
-        'name', 'end_point'
+        'name', 'end_point', 'priority'
     )
+    inlines = (CriteriaEndPointInline,)
 
 class AuthenticationAdmin(admin.ModelAdmin):
     list_display = (
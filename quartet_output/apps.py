@@ -15,8 +15,17 @@
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class QuartetOutputConfig(AppConfig):
     name = 'quartet_output'
     verbose_name = 'QU4RTET Output'
+
+    def ready(self):
+        # connects the signals that keep the criteria cache current
+        from quartet_output import criteria  # noqa: F401
+        if getattr(settings, 'QUARTET_OUTPUT_SHARED_TEMPLATE_ENVIRONMENT',
+                   True):
+            from quartet_output.templating import install_default_environment
+            install_default_environment()
@@ -0,0 +1,255 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+Micro-batching of outbound messages.  Instead of creating an output task
+for every message, the `CreateOutputTaskStep` can add its messages to a
+batch for the output criteria and output rule.  The messages of a batch
+are merged into one EPCIS document and sent as one output task when
+the batch reaches its size limit or when the oldest message has waited
+for the batch window.
+
+A batch is flushed by the step that fills it, by a celery task that is
+scheduled when the first message of a batch arrives and by the
+`flush_output_batches` command, which also recovers batches whose flush
+was interrupted.
+
+Messages are claimed for a flush with a conditional update of their
+batch, so concurrent flushes never send a message twice.
+
+The merged task is created by `delivery.create_output_task` with the
+highest priority of its messages and the Payload Key Threshold of the
+step that batched them.  A message that is itself at least as large as
+the threshold is kept in `quartet_output.payloads` rather than in the
+database while it waits.
+"""
+import json
+import re
+from datetime import timedelta
+from logging import getLogger
+
+from django.db.models import Count, Min
+from django.utils import timezone
+from quartet_capture import models
+
+from quartet_output import delivery, payloads
+from quartet_output.models import EPCISOutputCriteria, OutputBatch, \
+    OutputBatchItem
+
+logger = getLogger(__name__)
+
+BATCHED_PARAMETER = 'Batched Messages'
+
+_EVENT_LIST_START = re.compile(r'<(?:[\w.-]+:)?EventList\s*>')
+_EVENT_LIST_END = re.compile(r'</(?:[\w.-]+:)?EventList\s*>')
+
+
+def get_event_list(document: str):
+    """
+    :return: The (start, end) positions of the contents of the document's
+        event list or None if it is not an EPCIS XML document.
+    """
+    start = _EVENT_LIST_START.search(document)
+    if start is None:
+        return None
+    end = _EVENT_LIST_END.search(document, start.end())
+    if end is None:
+        return None
+    return start.end(), end.start()
+
+
+def is_json(document: str) -> bool:
+    return document.lstrip()[:1] == '{'
+
+
+def can_merge(document: str) -> bool:
+    """
+    :return: True if the document is an EPCIS XML document with an
+        event list or an EPCIS JSON document with an events list.
+    """
+    if is_json(document):
+        try:
+            return isinstance(json.loads(document).get('events'), list)
+        except ValueError:
+            return False
+    return get_event_list(document) is not None
+
+
+def merge_documents(documents: list) -> str:
+    """
+    Appends the events of every document to the events of the first one.
+    The header and everything else outside of the event list are taken
+    from the first document.
+    :param documents: EPCIS XML or EPCIS JSON documents; see `can_merge`.
+    :return: The merged document.
+    """
+    if len(documents) == 1:
+        return documents[0]
+    if is_json(documents[0]):
+        merged = json.loads(documents[0])
+        for document in documents[1:]:
+            merged['events'].extend(json.loads(document)['events'])
+        return json.dumps(merged)
+    start, end = get_event_list(documents[0])
+    events = [documents[0][start:end]]
+    for document in documents[1:]:
+        event_start, event_end = get_event_list(document)
+        events.append(document[event_start:event_end])
+    return documents[0][:start] + ''.join(events) + documents[0][end:]
+
+
+def get_pending(criteria_id: int, output_rule: str):
+    return OutputBatchItem.objects.filter(
+        criteria_id=criteria_id, output_rule=output_rule, batch=None)
+
+
+def add_message(output_criteria: EPCISOutputCriteria, output_rule: str,
+                data: str, window: float, size: int = 0,
+                delivery_engine: bool = False, priority: int = 0,
+                payload_threshold: int = 0) -> list:
+    """
+    Adds a message to the batch for the criteria and output rule and
+    flushes the batch if it is full or its window has passed.
+    :param window: The number of seconds the message may wait for others.
+    :param size: The number of messages that fills a batch or 0.
+    :param delivery_engine: Whether the merged task is left for the
+        delivery engine instead of being sent to celery.
+    :param priority: The priority of the message.
+    :param payload_threshold: The size from which the message and the
+        merged message are stored as payloads, or 0.
+    :return: The names of the tasks created if the batch was flushed.
+    """
+    now = timezone.now()
+    payload_key = ''
+    if payload_threshold > 0 and len(data) >= payload_threshold:
+        payload_key, data = payloads.store(data), ''
+    item = OutputBatchItem.objects.create(
+        criteria=output_criteria, output_rule=output_rule, data=data,
+        payload_key=payload_key, payload_threshold=payload_threshold,
+        priority=priority, delivery_engine=delivery_engine,
+        batch_size=size, flush_at=now + timedelta(seconds=window))
+    pending = get_pending(output_criteria.pk, output_rule).aggregate(
+        count=Count('pk'), due=Min('flush_at'))
+    if pending['due'] is None:
+        # a concurrent flush has sent the message already
+        return []
+    if (size and pending['count'] >= size) or pending['due'] <= now:
+        return flush(output_criteria.pk, output_rule)
+    # the message with the earliest deadline schedules the flush, so a
+    # flush is scheduled however the inserts of concurrent messages
+    # interleave; flushing an empty batch does nothing
+    if item.flush_at <= pending['due']:
+        schedule_flush(output_criteria.pk, output_rule, window)
+    return []
+
+
+def schedule_flush(criteria_id: int, output_rule: str, delay: float):
+    from quartet_output.tasks import flush_output_batch
+    try:
+        flush_output_batch.apply_async(
+            kwargs={'criteria_id': criteria_id, 'output_rule': output_rule},
+            countdown=max(0, delay))
+    except Exception:
+        logger.exception('Could not schedule the flush of the output batch '
+                         'for criteria %s; it will be flushed by the next '
+                         'message or the flush_output_batches command.',
+                         criteria_id)
+
+
+def flush(criteria_id: int, output_rule: str) -> list:
+    """
+    Sends the waiting messages for the criteria and output rule as merged
+    output tasks of at most the batch size messages each.
+    :return: The names of the tasks created.
+    """
+    task_names = []
+    while True:
+        pending = get_pending(criteria_id, output_rule)
+        size = pending.values_list('batch_size', flat=True).first()
+        if size is None:
+            break
+        item_ids = list(pending.values_list('pk', flat=True)[:size or None])
+        batch = OutputBatch.objects.create(criteria_id=criteria_id,
+                                           output_rule=output_rule)
+        # another flush may have claimed some of the messages already
+        if OutputBatchItem.objects.filter(
+            pk__in=item_ids, batch=None
+        ).update(batch=batch):
+            task_names.append(send_batch(batch))
+        else:
+            batch.delete()
+    return task_names
+
+
+def read_message(item: OutputBatchItem) -> str:
+    if not item.payload_key:
+        return item.data
+    with payloads.open_payload(item.payload_key) as payload:
+        return payload.read().decode('utf-8')
+
+
+def send_batch(batch: OutputBatch) -> str:
+    """
+    Creates the output task for a claimed batch and deletes the batch.
+    :return: The name of the task.
+    """
+    items = list(batch.items.all())
+    data = merge_documents([read_message(item) for item in items])
+    task_parameters = [
+        models.TaskParameter(
+            name=delivery.CRITERIA_PARAMETER,
+            value=batch.criteria.name,
+            description='The name of the EPCIS Output Criteria to use '
+                        'during task processing.'
+        ),
+        models.TaskParameter(
+            name=BATCHED_PARAMETER,
+            value=str(len(items)),
+            description='The number of messages merged into this task.'
+        ),
+    ]
+    task = delivery.create_output_task(
+        data, batch.output_rule, task_parameters,
+        max(item.priority for item in items),
+        max(item.payload_threshold for item in items),
+        items[0].delivery_engine
+    )
+    logger.debug('Merged %s messages into task %s.', len(items), task.name)
+    batch.delete()
+    return task.name
+
+
+def flush_due(recover_after: float = 300) -> list:
+    """
+    Flushes every batch whose window has passed and resends the batches
+    whose flush was interrupted.
+    :param recover_after: Seconds after which a claimed batch that still
+        exists is considered interrupted.
+    :return: The names of the tasks created.
+    """
+    now = timezone.now()
+    task_names = []
+    for batch in OutputBatch.objects.filter(
+        created__lte=now - timedelta(seconds=recover_after)
+    ).select_related('criteria'):
+        if batch.items.exists():
+            task_names.append(send_batch(batch))
+        else:
+            batch.delete()
+    keys = OutputBatchItem.objects.filter(
+        batch=None, flush_at__lte=now
+    ).values_list('criteria_id', 'output_rule').distinct()
+    for criteria_id, output_rule in list(keys):
+        task_names.extend(flush(criteria_id, output_rule))
+    return task_names
@@ -0,0 +1,143 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+A process wide cache of `EPCISOutputCriteria` records.  Criteria are
+loaded with their end point, authentication info and additional end
+points (with their own authentication info) in one go and kept by name
+and primary key, so steps that look up the same criteria for every task
+do not query the database once the cache is warm.
+
+Saving or deleting a criteria, end point or authentication info clears
+the cache in the process that made the change.  Entries are also
+reloaded after QUARTET_OUTPUT_CRITERIA_CACHE_TTL seconds (default 60) so
+that changes made by other processes are picked up; set it to 0 to turn
+the cache off.
+"""
+import copy
+import time
+from threading import Lock
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from quartet_output.models import AuthenticationInfo, CriteriaEndPoint, \
+    EndPoint, EPCISOutputCriteria
+
+_cache = None
+_cache_lock = Lock()
+
+
+class CriteriaCache:
+    """
+    Holds criteria by name and primary key.
+    :param ttl: The number of seconds an entry is used before it is
+        loaded again.
+    """
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._by_name = {}
+        self._by_pk = {}
+        self._lock = Lock()
+
+    def load(self, **lookup) -> EPCISOutputCriteria:
+        return EPCISOutputCriteria.objects.select_related(
+            'end_point', 'authentication_info'
+        ).prefetch_related(Prefetch(
+            'criteria_end_points',
+            queryset=CriteriaEndPoint.objects.select_related(
+                'end_point', 'authentication_info')
+        )).get(**lookup)
+
+    def get(self, name: str = None, pk: int = None) -> EPCISOutputCriteria:
+        """
+        Returns the criteria with the name or primary key.  Each call
+        returns its own copy of the criteria; the related records are
+        shared and should not be changed.
+        :raises EPCISOutputCriteria.DoesNotExist: If there is no such
+            criteria.
+        """
+        index, key = (self._by_pk, pk) if name is None else \
+            (self._by_name, name)
+        now = time.monotonic()
+        with self._lock:
+            criteria, loaded = index.get(key, (None, 0))
+        if criteria is None or now - loaded >= self.ttl:
+            with self._lock:
+                self.misses += 1
+            criteria = self.load(pk=pk) if name is None else \
+                self.load(name=name)
+            if self.ttl > 0:
+                with self._lock:
+                    self._by_name[criteria.name] = criteria, now
+                    self._by_pk[criteria.pk] = criteria, now
+        else:
+            with self._lock:
+                self.hits += 1
+        return copy.copy(criteria)
+
+    def clear(self):
+        with self._lock:
+            self._by_name.clear()
+            self._by_pk.clear()
+
+    def __len__(self):
+        return len(self._by_pk)
+
+
+def get_cache() -> CriteriaCache:
+    """
+    :return: The process wide criteria cache.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CriteriaCache(getattr(
+                    settings, 'QUARTET_OUTPUT_CRITERIA_CACHE_TTL', 60))
+    return _cache
+
+
+def get_criteria(name: str = None, pk: int = None) -> EPCISOutputCriteria:
+    """
+    :return: The criteria with the name or primary key from the process
+        wide cache.
+    """
+    return get_cache().get(name=name, pk=pk)
+
+
+def reset_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+@receiver(post_save, sender=EPCISOutputCriteria)
+@receiver(post_delete, sender=EPCISOutputCriteria)
+@receiver(post_save, sender=EndPoint)
+@receiver(post_delete, sender=EndPoint)
+@receiver(post_save, sender=AuthenticationInfo)
+@receiver(post_delete, sender=AuthenticationInfo)
+@receiver(post_save, sender=CriteriaEndPoint)
+@receiver(post_delete, sender=CriteriaEndPoint)
+@receiver(m2m_changed,
+          sender=EPCISOutputCriteria.additional_end_points.through)
+def clear_cache(**kwargs):
+    if _cache is not None:
+        _cache.clear()
@@ -0,0 +1,747 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+A concurrent delivery engine for output tasks.  Instead of handing each
+output task to a celery worker, which sends one message at a time, the
+engine claims queued output tasks from the database and runs many of
+them at once.  An asyncio event loop schedules the tasks while the
+output rules themselves (and the blocking transport mixins they use) run
+on a thread pool.  The number of tasks sent to any single `EndPoint` at
+one time is limited and task results are written back in batches.
+
+Tasks are only picked up by the engine if they were created with the
+`Delivery Engine` task parameter, see `create_task` and the
+`CreateOutputTaskStep`.
+
+A claimed task is RUNNING with a lease: its status_changed time is
+renewed while the engine holds it, and a RUNNING task whose lease has
+not been renewed for QUARTET_OUTPUT_DELIVERY_LEASE seconds (default 600),
+for example because its engine was killed, is put back in QUEUED by
+`requeue_stale_tasks`.
+
+Queued tasks are not claimed in plain FIFO order.  Tasks with a higher
+`Priority` task parameter are claimed first and, within a priority, the
+engine takes the oldest task of each `EndPoint` in turn so that a large
+backlog for one partner does not hold up the messages for the others.
+The engine only claims as many tasks for an endpoint as it has free
+slots under its endpoint concurrency, so the tasks of a slow partner
+never take the places of tasks for other partners.
+`get_queue_depths` reports the queued tasks per endpoint.
+
+Output tasks that are not left for the engine are queued with
+`queue_task`, which sends them to the `execute_output_task` celery task
+rather than quartet_capture's `execute_queued_task` so that a deferred
+task goes back to QUEUED instead of being marked FAILED.  Celery has no
+round-robin between endpoints, but a task's priority is passed on as the
+celery message priority (see `get_celery_priority`), which the broker
+only honours if its queues are set up for priorities.
+"""
+import abc
+import asyncio
+import io
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, Count, FloatField, IntegerField, Max, \
+    Min, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+from quartet_capture import models
+from quartet_capture.defaults import get_storage
+from quartet_capture.errors import RuleNotFound
+
+from quartet_output import criteria, payloads, scheduling
+from quartet_output.errors import TaskDeferredError
+from quartet_output.models import EPCISOutputCriteria
+from quartet_output.transport import mail
+from quartet_output.transport.mail import MailMixin
+from quartet_output.transport import registry
+
+logger = getLogger(__name__)
+
+ENGINE_PARAMETER = 'Delivery Engine'
+CRITERIA_PARAMETER = 'EPCIS Output Criteria'
+# one per end point of a criteria with additional end points, or for a
+# single end point whose data was spooled; the values are DELIVERED,
+# FAILED, DEFERRED or SPOOLED (in the dead-letter spool)
+DELIVERY_STATUS_PARAMETER = 'Delivery Status %s'
+# the number of failed sends to an end point that have been retried
+DELIVERY_ATTEMPTS_PARAMETER = 'Delivery Attempts %s'
+DELIVERED = 'DELIVERED'
+FAILED = 'FAILED'
+DEFERRED = 'DEFERRED'
+SPOOLED = 'SPOOLED'
+PRIORITY_PARAMETER = 'Priority'
+
+
+def set_delivery_status(task_name: str, end_point, status: str):
+    """
+    Records the outcome of sending a task's data to one end point.
+    """
+    models.TaskParameter.objects.update_or_create(
+        task_id=task_name,
+        name=DELIVERY_STATUS_PARAMETER % end_point.pk,
+        defaults={'value': status,
+                  'description': 'The delivery status of end point '
+                                 '%s.' % end_point.name}
+    )
+
+
+def get_priority_parameter(priority: int):
+    """
+    :return: An unsaved `Priority` task parameter or None for the default
+        priority of 0.
+    """
+    if priority:
+        return models.TaskParameter(
+            name=PRIORITY_PARAMETER, value=str(priority),
+            description='Tasks with a higher priority are sent first.')
+
+
+def get_celery_priority(priority: int):
+    """
+    Maps the priority of an output task onto celery's message priority.
+    Priorities are clamped to between 0 and
+    QUARTET_OUTPUT_CELERY_MAX_PRIORITY (9 by default).  RabbitMQ sends
+    messages with a higher priority first, if the queue was declared with
+    x-max-priority; the Redis transport sends lower numbers first, which
+    QUARTET_OUTPUT_CELERY_PRIORITY_REVERSED = True accounts for.
+    :return: The celery priority or None for the default priority of 0.
+    """
+    if not priority:
+        return None
+    maximum = getattr(settings, 'QUARTET_OUTPUT_CELERY_MAX_PRIORITY', 9)
+    priority = min(max(priority, 0), maximum)
+    if getattr(settings, 'QUARTET_OUTPUT_CELERY_PRIORITY_REVERSED', False):
+        return maximum - priority
+    return priority
+
+
+def annotate_tasks(queryset):
+    """
+    Adds the `criteria_name` and `priority` task parameters to a task
+    queryset.
+    """
+    def parameter(name):
+        return Subquery(models.TaskParameter.objects.filter(
+            task=OuterRef('pk'), name=name).values('value')[:1])
+
+    return queryset.annotate(
+        criteria_name=parameter(CRITERIA_PARAMETER),
+        priority=Coalesce(Cast(parameter(PRIORITY_PARAMETER),
+                               IntegerField()), 0)
+    )
+
+
+def get_end_point_ids(criteria_names) -> dict:
+    """
+    :return: A dictionary of criteria names to the id of their end point.
+    """
+    return dict(EPCISOutputCriteria.objects.filter(
+        name__in=set(criteria_names) - {None}
+    ).values_list('name', 'end_point_id'))
+
+
+def get_queue_depths(rule_names: list = None) -> list:
+    """
+    Counts the queued output tasks per endpoint.
+    :param rule_names: Only count the tasks of these rules.
+    :return: A list of dictionaries with the `end_point` id (None for
+        tasks without a known criteria), the number of `queued` tasks, how
+        many of them are `deferred`, the highest `priority` and the time
+        the `oldest` task was queued, ordered by the number of tasks.
+    """
+    queryset = models.Task.objects.filter(
+        status='QUEUED', taskparameter__name=CRITERIA_PARAMETER)
+    if rule_names:
+        queryset = queryset.filter(rule__name__in=rule_names)
+    rows = list(annotate_tasks(queryset).values('criteria_name').annotate(
+        queued=Count('pk'),
+        deferred=Count('pk', filter=Q(
+            name__in=scheduling.get_deferred_names(ready=False))),
+        max_priority=Max('priority'),
+        oldest=Min('status_changed')
+    ))
+    end_points = get_end_point_ids(row['criteria_name'] for row in rows)
+    depths = {}
+    for row in rows:
+        end_point_id = end_points.get(row['criteria_name'])
+        depth = depths.setdefault(end_point_id, {
+            'end_point': end_point_id, 'queued': 0, 'deferred': 0,
+            'priority': row['max_priority'], 'oldest': row['oldest']})
+        depth['queued'] += row['queued']
+        depth['deferred'] += row['deferred']
+        depth['priority'] = max(depth['priority'], row['max_priority'])
+        depth['oldest'] = min(depth['oldest'], row['oldest'])
+    return sorted(depths.values(), key=lambda depth: -depth['queued'])
+
+
+def create_task(data, rule_name: str, task_type: str = 'Output',
+                task_parameters: list = None,
+                engine: bool = True) -> models.Task:
+    """
+    Creates a queued task for the delivery engine.  This works like
+    `quartet_capture.tasks.create_and_queue_task` but the task is not
+    sent to celery.
+    :param data: The data for the task; a string, bytes or a file-like
+        object.
+    :param rule_name: The name of the rule that will process the data.
+    :param task_type: The type of task.
+    :param task_parameters: Any unsaved `TaskParameter` instances to
+        associate with the task.
+    :param engine: False to create the task without the Delivery Engine
+        task parameter; see `queue_task`.
+    :return: The task.
+    """
+    try:
+        rule = models.Rule.objects.get(name=rule_name)
+    except models.Rule.DoesNotExist:
+        raise RuleNotFound(
+            'The Rule with name %s could not be found.  Please check your '
+            'configuration and ensure a Rule with that name exists.' %
+            rule_name
+        )
+    task = models.Task(rule=rule, type=task_type)
+    task.save()
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if isinstance(data, bytes):
+        data = io.BytesIO(data)
+    task.location = get_storage().save(
+        name='{0}.dat'.format(task.name), content=data)
+    task.status = 'QUEUED'
+    task.save()
+    task_parameters = list(task_parameters or [])
+    if engine:
+        task_parameters.append(models.TaskParameter(
+            name=ENGINE_PARAMETER, value='True',
+            description='Created for the delivery engine.'))
+    for task_parameter in task_parameters:
+        task_parameter.task = task
+        task_parameter.save()
+    return task
+
+
+def queue_task(data, rule_name: str, task_type: str = 'Output',
+               task_parameters: list = None, run_immediately: bool = False,
+               priority: int = 0) -> models.Task:
+    """
+    Creates an output task and sends it to the `execute_output_task`
+    celery task or, if run_immediately is True, runs it right away.  A
+    task that is deferred is left in QUEUED either way.
+    :param run_immediately: Run the task in this process.
+    :param priority: The priority of the task; see `get_celery_priority`.
+    :return: The task.
+    :raises Exception: Whatever made a task that was run immediately fail.
+    """
+    from quartet_output.tasks import execute_output_task
+    task = create_task(data, rule_name, task_type, task_parameters,
+                       engine=False)
+    if run_immediately:
+        task.status = 'RUNNING'
+        task.save()
+        try:
+            execute_task(task, raise_exception=True)
+        finally:
+            task.save()
+    else:
+        execute_output_task.apply_async(
+            kwargs={'task_name': task.name},
+            priority=get_celery_priority(priority))
+    return task
+
+
+def create_output_task(data, rule_name: str, task_parameters: list,
+                       priority: int = 0, payload_threshold: int = 0,
+                       engine: bool = False,
+                       run_immediately: bool = False) -> models.Task:
+    """
+    Creates an output task the way the `CreateOutputTaskStep` does and
+    either queues it with `queue_task` or leaves it for the delivery
+    engine.
+    :param task_parameters: The unsaved parameters of the new task.
+    :param priority: The priority of the task.
+    :param payload_threshold: Data at least this large is stored in
+        `quartet_output.payloads` and only its key is passed to the task.
+        0 never stores it.
+    :param engine: Leave the task for the delivery engine.
+    :param run_immediately: See `queue_task`.
+    :return: The task.
+    """
+    priority_parameter = get_priority_parameter(priority)
+    if priority_parameter:
+        task_parameters = task_parameters + [priority_parameter]
+    if payload_threshold > 0 and isinstance(data, (str, bytes)) and \
+            len(data) >= payload_threshold:
+        task_parameters = task_parameters + [models.TaskParameter(
+            name=payloads.PAYLOAD_PARAMETER,
+            value=payloads.store(data),
+            description='The storage key of the data to send.'
+        )]
+        data = b''
+    if engine:
+        return create_task(data, rule_name, 'Output', task_parameters)
+    return queue_task(data, rule_name, 'Output', task_parameters,
+                      run_immediately, priority)
+
+
+def get_lease() -> float:
+    return getattr(settings, 'QUARTET_OUTPUT_DELIVERY_LEASE', 600)
+
+
+def renew_lease(task_names: list):
+    """
+    Extends the lease of the claimed tasks.
+    """
+    if task_names:
+        models.Task.objects.filter(
+            name__in=task_names, status='RUNNING'
+        ).update(status_changed=timezone.now())
+
+
+def requeue_stale_tasks(lease: float = None) -> int:
+    """
+    Puts delivery engine tasks whose lease has expired back in QUEUED.
+    :param lease: The lease in seconds; QUARTET_OUTPUT_DELIVERY_LEASE by
+        default.
+    :return: The number of tasks queued again.
+    """
+    now = timezone.now()
+    stale = models.Task.objects.filter(
+        status='RUNNING', taskparameter__name=ENGINE_PARAMETER,
+        status_changed__lt=now - timedelta(
+            seconds=get_lease() if lease is None else lease)
+    ).values_list('name', flat=True)
+    count = models.Task.objects.filter(name__in=list(stale)).update(
+        status='QUEUED', status_changed=now)
+    if count:
+        logger.warning('Queued %s delivery tasks again whose lease had '
+                       'expired.', count)
+    return count
+
+
+def execute_task(db_task: models.Task,
+                 raise_exception: bool = False) -> models.Task:
+    """
+    Runs the rule of a claimed task the same way
+    `quartet_capture.tasks.execute_queued_task` does, resuming deferred
+    rules, but leaves saving the resulting status to the caller.
+    :param db_task: A task that has been claimed by the engine.
+    :param raise_exception: Raise the error that made the task fail.
+    :return: The task with its status and timings set.
+    """
+    start = time.time()
+    try:
+        rule = scheduling.ResumableRule(db_task.rule, db_task)
+        rule.execute(rule.read_data())
+        db_task.status = 'FINISHED'
+    except TaskDeferredError as e:
+        logger.info('Task %s was deferred for %.2f seconds.', db_task.name,
+                    e.delay)
+        db_task.status = 'QUEUED'
+    except SoftTimeLimitExceeded:
+        logger.exception('Task %s exceeded its time limit and will be '
+                         'queued again.', db_task.name)
+        db_task.status = 'QUEUED'
+    except Exception:
+        logger.exception('Could not execute task with name %s',
+                         db_task.name)
+        db_task.status = 'FAILED'
+        if raise_exception:
+            raise
+    finally:
+        db_task.execution_time = time.time() - start
+        close_old_connections()
+    return db_task
+
+
+class DeliveryEngine:
+    """
+    Claims and runs queued output tasks concurrently.
+    :param concurrency: The maximum number of tasks running at once.
+    :param endpoint_concurrency: The maximum number of tasks running at
+        once for any single `EndPoint`.
+    :param batch_size: The number of finished tasks to collect before
+        writing their status back to the database.
+    :param poll_interval: Seconds to wait between checks for new tasks.
+    :param rule_names: Only run tasks for these rules.
+    :param lease: Seconds after which a claimed task that has not been
+        renewed is queued again; QUARTET_OUTPUT_DELIVERY_LEASE by default.
+    """
+
+    def __init__(self, concurrency: int = 32, endpoint_concurrency: int = 4,
+                 batch_size: int = 100, poll_interval: float = 1.0,
+                 rule_names: list = None, lease: float = None):
+        self.concurrency = concurrency
+        self.endpoint_concurrency = endpoint_concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.rule_names = rule_names
+        self.lease = get_lease() if lease is None else lease
+        self.processed = 0
+        self._results = []
+        # the names of the claimed tasks whose results are not written yet
+        self._claimed = set()
+        self._renewed = None
+        # the number of running tasks per endpoint id; tasks are only
+        # claimed for endpoints below endpoint_concurrency
+        self._in_flight = Counter()
+        self._executor = ThreadPoolExecutor(concurrency)
+        # database bookkeeping gets its own thread so it never waits
+        # behind slow deliveries
+        self._db_executor = ThreadPoolExecutor(1)
+
+    def get_queryset(self):
+        queryset = models.Task.objects.filter(
+            status='QUEUED', taskparameter__name=ENGINE_PARAMETER
+        ).exclude(name__in=scheduling.get_deferred_names(ready=False))
+        if self.rule_names:
+            queryset = queryset.filter(rule__name__in=self.rule_names)
+        return queryset
+
+    def get_candidates(self, limit: int, in_flight: dict = None) -> list:
+        """
+        Picks up to `limit` queued tasks by priority and then round-robin
+        across endpoints: the oldest task of every endpoint comes before
+        the second oldest of any endpoint.
+        :param in_flight: If given, the number of tasks running for each
+            endpoint id; endpoints are then only given as many tasks as
+            they have free slots under `endpoint_concurrency`.
+        :return: A list of (task, endpoint id) tuples.
+        """
+        queryset = annotate_tasks(self.get_queryset())
+        criteria_names = set(queryset.order_by().values_list(
+            'criteria_name', flat=True).distinct())
+        end_points = get_end_point_ids(criteria_names)
+        groups = defaultdict(list)
+        for criteria_name in criteria_names:
+            groups[end_points.get(criteria_name)].append(criteria_name)
+        candidates = []
+        for end_point_id, names in groups.items():
+            free = limit
+            if in_flight is not None:
+                busy = in_flight.get(end_point_id, 0)
+                free = min(limit, self.endpoint_concurrency - busy)
+                if free <= 0:
+                    continue
+            condition = Q(criteria_name__in=[
+                name for name in names if name is not None])
+            if None in names:
+                condition |= Q(criteria_name__isnull=True)
+            turn = defaultdict(int)
+            for task in queryset.filter(condition).select_related(
+                'rule'
+            ).order_by('-priority', 'status_changed')[:free]:
+                candidates.append((-task.priority, turn[task.priority],
+                                   task.status_changed, task, end_point_id))
+                turn[task.priority] += 1
+        candidates.sort(key=lambda candidate: candidate[:3])
+        return [candidate[3:] for candidate in candidates[:limit]]
+
+    def claim_tasks(self, limit: int, in_flight: dict = None) -> list:
+        """
+        Marks up to `limit` queued tasks, chosen by `get_candidates`, as
+        RUNNING.  A task is only claimed if it is still queued so several
+        engines can share a database.
+        :param in_flight: See `get_candidates`.
+        :return: A list of (task, endpoint id) tuples.
+        """
+        claimed = []
+        now = timezone.now()
+        for task, end_point_id in self.get_candidates(limit, in_flight):
+            if models.Task.objects.filter(
+                name=task.name, status='QUEUED'
+            ).update(status='RUNNING', status_changed=now):
+                task.status = 'RUNNING'
+                claimed.append((task, end_point_id))
+        close_old_connections()
+        return claimed
+
+    def write_results(self, results: list):
+        """
+        Saves the status and timings of finished tasks.
+        :param results: The tasks returned by `execute_task`.
+        """
+        if results:
+            now = timezone.now()
+            by_status = defaultdict(list)
+            for task in results:
+                task.status_changed = now
+                by_status[task.status].append(task)
+            for status, tasks in by_status.items():
+                models.Task.objects.filter(
+                    name__in=[task.name for task in tasks]
+                ).update(status=status, status_changed=now,
+                         execution_time=Case(
+                             *[When(name=task.name,
+                                    then=Value(task.execution_time))
+                               for task in tasks],
+                             output_field=FloatField()))
+            self.processed += len(results)
+            logger.debug('Wrote the results of %s tasks.', len(results))
+        close_old_connections()
+
+    async def flush(self):
+        results, self._results = self._results, []
+        await asyncio.get_event_loop().run_in_executor(
+            self._db_executor, self.write_results, results)
+        self._claimed.difference_update(task.name for task in results)
+
+    def maintain_leases(self, task_names: list):
+        """
+        Renews the lease of the engine's claimed tasks and queues the
+        tasks of engines that have stopped again.
+        """
+        renew_lease(task_names)
+        requeue_stale_tasks(self.lease)
+        close_old_connections()
+
+    async def deliver(self, task: models.Task, end_point_id):
+        loop = asyncio.get_event_loop()
+        try:
+            result = await loop.run_in_executor(self._executor,
+                                                execute_task, task)
+        finally:
+            self._in_flight[end_point_id] -= 1
+        self._results.append(result)
+        if len(self._results) >= self.batch_size:
+            await self.flush()
+
+    async def run(self, once: bool = False):
+        """
+        Runs queued tasks until stopped.
+        :param once: Return once there are no more queued tasks.
+        """
+        loop = asyncio.get_event_loop()
+        pending = set()
+        try:
+            while True:
+                if self._renewed is None or \
+                        time.monotonic() - self._renewed >= self.lease / 4:
+                    self._renewed = time.monotonic()
+                    await loop.run_in_executor(
+                        self._db_executor, self.maintain_leases,
+                        list(self._claimed))
+                if len(pending) < self.concurrency:
+                    claimed = await loop.run_in_executor(
+                        self._db_executor, self.claim_tasks,
+                        self.concurrency - len(pending),
+                        dict(self._in_flight))
+                    for task, end_point_id in claimed:
+                        self._claimed.add(task.name)
+                        self._in_flight[end_point_id] += 1
+                        pending.add(asyncio.ensure_future(
+                            self.deliver(task, end_point_id)))
+                if not pending:
+                    await self.flush()
+                    if once:
+                        break
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                done, pending = await asyncio.wait(
+                    pending, timeout=self.poll_interval,
+                    return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        finally:
+            if pending:
+                await asyncio.wait(pending)
+            await self.flush()
+
+    def start(self, once: bool = False) -> int:
+        """
+        Runs the engine on a new event loop.
+        :return: The number of tasks processed.
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.run(once))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            self._executor.shutdown()
+            self._db_executor.shutdown()
+        return self.processed
+
+
+class BatchDelivery(abc.ABC):
+    """
+    Base class for delivering the queued output tasks of transport rules
+    in batches rather than running the rules one task at a time.
+    Subclasses implement `deliver_tasks`.  The tasks of criteria with
+    additional end points are run through their rules instead so they
+    reach every end point.
+    :param rule_names: The names of the transport rules whose tasks are
+        delivered.
+    :param batch_size: The maximum number of tasks claimed per batch.
+    """
+
+    def __init__(self, rule_names: list, batch_size: int = 500):
+        self.batch_size = batch_size
+        self.engine = DeliveryEngine(rule_names=rule_names)
+        self._step_parameters = {}
+
+    def get_step_parameter(self, rule, name: str, default=None):
+        """
+        :return: The value of the named step parameter of the rule's steps
+            or the default.
+        """
+        key = (rule.pk, name)
+        if key not in self._step_parameters:
+            self._step_parameters[key] = models.StepParameter.objects.filter(
+                step__rule=rule, name=name
+            ).values_list('value', flat=True).first()
+        return self._step_parameters[key] or default
+
+    def read_data(self, task: models.Task) -> bytes:
+        payload_key = models.TaskParameter.objects.filter(
+            task=task, name=payloads.PAYLOAD_PARAMETER
+        ).values_list('value', flat=True).first()
+        if payload_key:
+            with payloads.open_payload(payload_key) as payload:
+                return payload.read()
+        with get_storage().open(
+                name='{0}.dat'.format(task.name)) as message_file:
+            return message_file.read()
+
+    @abc.abstractmethod
+    def deliver_tasks(self, tasks: list,
+                      output_criteria: EPCISOutputCriteria):
+        """
+        Delivers the data of the tasks to the criteria's endpoint and sets
+        the status of each task.
+        """
+
+    def deliver_batch(self) -> int:
+        """
+        Claims up to `batch_size` tasks and delivers them.
+        :return: The number of tasks claimed.
+        """
+        claimed = [task for task, end_point_id in
+                   self.engine.claim_tasks(self.batch_size)]
+        criteria_names = dict(models.TaskParameter.objects.filter(
+            task__in=claimed, name=CRITERIA_PARAMETER
+        ).values_list('task_id', 'value'))
+        groups = defaultdict(list)
+        for task in claimed:
+            groups[criteria_names.get(task.name)].append(task)
+        for criteria_name, tasks in groups.items():
+            renew_lease([task.name for task in tasks])
+            start = time.time()
+            try:
+                output_criteria = criteria.get_criteria(name=criteria_name)
+                if len(output_criteria.get_end_points()) > 1:
+                    # the transport step of the rule fans the data out to
+                    # every end point, each with its own credentials
+                    for task in tasks:
+                        execute_task(task)
+                else:
+                    self.deliver_tasks(tasks, output_criteria)
+            except Exception:
+                logger.exception('Could not deliver the batch for output '
+                                 'criteria %s.', criteria_name)
+                for task in tasks:
+                    task.status = 'FAILED'
+            for task in tasks:
+                task.execution_time = time.time() - start
+            self.engine.write_results(tasks)
+        return len(claimed)
+
+    def start(self) -> int:
+        """
+        Delivers batches until no queued tasks are left.
+        :return: The number of tasks processed.
+        """
+        requeue_stale_tasks(self.engine.lease)
+        while self.deliver_batch():
+            pass
+        return self.engine.processed
+
+
+class SftpBatchDelivery(BatchDelivery):
+    """
+    Uploads the queued output tasks of SFTP transport rules in batches.
+    All of the files for an output criteria are sent over one pooled SSH
+    connection on several SFTP channels; see
+    `SftpTransportMixin.sftp_put_files`.  The registered sftp transport is
+    used, so paramiko is only imported when a batch is sent.
+    :param rule_names: The names of the SFTP transport rules whose tasks
+        are uploaded.
+    :param channels: The number of SFTP channels per connection.
+    :param batch_size: The maximum number of tasks claimed per batch.
+    """
+
+    def __init__(self, rule_names: list, channels: int = 4,
+                 batch_size: int = 500):
+        super().__init__(rule_names, batch_size)
+        self.channels = channels
+        self.transport = registry.get_transport('sftp')
+
+    def deliver_tasks(self, tasks: list,
+                      output_criteria: EPCISOutputCriteria):
+        files = {}
+        for task in tasks:
+            files['{0}.{1}'.format(
+                task.name,
+                self.get_step_parameter(task.rule, 'file-extension', 'xml')
+            )] = (task, self.read_data(task))
+        results = self.transport.sftp_put_files(
+            [(name, data) for name, (task, data) in files.items()],
+            output_criteria, self.channels)
+        for name, (task, data) in files.items():
+            error = results.get(name)
+            task.status = 'FAILED' if error else 'FINISHED'
+            if error:
+                models.TaskMessage.objects.create(
+                    task=task, level='ERROR',
+                    message='Could not upload %s: %s' % (name, error))
+
+
+class MailBatchDelivery(BatchDelivery, MailMixin):
+    """
+    Sends the queued output tasks of mailto transport rules in batches
+    over the shared mail connection; see `mail.send_message_batch`.
+    :param rule_names: The names of the mailto transport rules whose tasks
+        are sent.
+    :param batch_size: The maximum number of tasks claimed per batch.
+    """
+
+    def deliver_tasks(self, tasks: list,
+                      output_criteria: EPCISOutputCriteria):
+        emails = [
+            self.create_email(
+                self.read_data(task), task.name, output_criteria,
+                self.get_step_parameter(task.rule, 'file-extension', 'txt'),
+                self.get_step_parameter(task.rule, 'content-type',
+                                        'text/plain'),
+                int(self.get_step_parameter(
+                    task.rule, 'gzip-attachment-threshold', 0))
+            )
+            for task in tasks
+        ]
+        results = mail.send_message_batch(emails)
+        for task, error in zip(tasks, results):
+            task.status = 'FAILED' if error else 'FINISHED'
+            if error:
+                models.TaskMessage.objects.create(
+                    task=task, level='ERROR',
+                    message='Could not send the email: %s' % error)
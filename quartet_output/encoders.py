@@ -0,0 +1,249 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+A template-free EPCIS JSON serializer for EPCPyYes events.  The output
+has the same structure and key order as the EPCPyYes `render_json()`
+functions but is produced by reading the event attributes directly and
+writing each event to a byte buffer as it is encoded.  If `orjson` is
+installed it is used for encoding; otherwise the output of this module is
+byte-for-byte identical to `render_json()`.
+"""
+import io
+import json
+from datetime import datetime
+
+from EPCPyYes.core.v1_2 import events, json_encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson:
+    dumps = orjson.dumps
+    ITEM_SEPARATOR = b','
+    KEY_SEPARATOR = b':'
+else:
+    _encoder = json.JSONEncoder()
+
+    def dumps(obj) -> bytes:
+        return _encoder.encode(obj).encode()
+
+    ITEM_SEPARATOR = b', '
+    KEY_SEPARATOR = b': '
+
+
+def get_date(value):
+    return value.isoformat().replace(' ', 'Z') \
+        if isinstance(value, datetime) else value
+
+
+def get_error_declaration(error_declaration):
+    if error_declaration:
+        return {
+            'declarationTime': error_declaration.declaration_time,
+            'reason': error_declaration.reason,
+            'correctiveEventIDs': list(
+                error_declaration.corrective_event_ids),
+        }
+
+
+def get_quantity_list(quantity_list):
+    if quantity_list:
+        return [{'epcClass': item.epc_class, 'quantity': item.quantity,
+                 'uom': item.uom} for item in quantity_list]
+    return {}
+
+
+def get_source_list(source_list):
+    if source_list:
+        return {item.type: item.source for item in source_list}
+    return {}
+
+
+def get_destination_list(destination_list):
+    if destination_list:
+        return {item.type: item.destination for item in destination_list}
+    return {}
+
+
+def get_business_transaction_list(business_transaction_list):
+    if business_transaction_list:
+        return {str(bt.biz_transaction): str(bt.type)
+                for bt in business_transaction_list}
+    return {}
+
+
+def get_ilmd_list(ilmd):
+    if ilmd:
+        return {str(item.name): item.value for item in ilmd}
+    return {}
+
+
+def _encode_base(event, event_id):
+    return {
+        'id': event_id,
+        'eventID': event.event_id,
+        'eventTime': event.event_time,
+        'eventTimezoneOffset': event.event_timezone_offset,
+        'recordTime': get_date(event.record_time)
+        if event.record_time else None,
+        'errorDeclaration': get_error_declaration(event.error_declaration),
+    }
+
+
+def _encode_business(event, event_id):
+    ret = _encode_base(event, event_id)
+    ret['action'] = event.action
+    ret['disposition'] = event.disposition
+    ret['bizStep'] = event.biz_step
+    ret['readPoint'] = event.read_point
+    ret['bizLocation'] = event.biz_location
+    ret['sourceList'] = get_source_list(event.source_list)
+    ret['destinationList'] = get_destination_list(event.destination_list)
+    ret['bizTransactionList'] = get_business_transaction_list(
+        event.business_transaction_list)
+    return ret
+
+
+def encode_object_event(event: events.ObjectEvent) -> dict:
+    ret = _encode_business(event, str(event.id))
+    ret['epcList'] = list(event.epc_list)
+    ret['ilmd'] = get_ilmd_list(event.ilmd)
+    ret['quantityList'] = get_quantity_list(event.quantity_list)
+    return {'objectEvent': ret}
+
+
+def encode_aggregation_event(event: events.AggregationEvent) -> dict:
+    ret = _encode_business(event, event.id)
+    ret['parentID'] = event.parent_id
+    ret['childEPCs'] = list(event.child_epcs)
+    ret['childQuantityList'] = get_quantity_list(event.child_quantity_list)
+    return {'aggregationEvent': ret}
+
+
+def encode_transaction_event(event: events.TransactionEvent) -> dict:
+    ret = _encode_business(event, event.id)
+    ret['parentID'] = event.parent_id
+    ret['epcList'] = list(event.epc_list)
+    ret['quantityList'] = get_quantity_list(event.quantity_list)
+    return {'transactionEvent': ret}
+
+
+def encode_transformation_event(event: events.TransformationEvent) -> dict:
+    ret = _encode_base(event, event.id)
+    ret['inputEPCList'] = list(event.input_epc_list)
+    ret['inputQuantityList'] = get_quantity_list(event.input_quantity_list)
+    ret['outputEPCList'] = list(event.output_epc_list)
+    ret['outputQuantityList'] = get_quantity_list(
+        event.output_quantity_list)
+    ret['transformationID'] = event.transformation_id
+    ret['bizStep'] = str(event.biz_step)
+    ret['bizLocation'] = event.biz_location
+    ret['disposition'] = str(event.disposition)
+    ret['readPoint'] = event.read_point
+    ret['bizTransactionList'] = get_business_transaction_list(
+        event.business_transaction_list)
+    ret['sourceList'] = get_source_list(event.source_list)
+    ret['destinationList'] = get_destination_list(event.destination_list)
+    ret['ilmd'] = get_ilmd_list(event.ilmd)
+    return {'transformationEvent': ret}
+
+
+EVENT_ENCODERS = {
+    json_encoders.ObjectEventEncoder: encode_object_event,
+    json_encoders.AggregationEventEncoder: encode_aggregation_event,
+    json_encoders.TransactionEventEncoder: encode_transaction_event,
+    json_encoders.TransformationEventEncoder: encode_transformation_event,
+}
+
+DOCUMENT_ENCODERS = (
+    ('object_events', encode_object_event),
+    ('aggregation_events', encode_aggregation_event),
+    ('transaction_events', encode_transaction_event),
+    ('transformation_events', encode_transformation_event),
+)
+
+
+def encode_event(event) -> dict:
+    """
+    Returns the EPCIS JSON dictionary for an EPCPyYes template event.  If
+    the event has been given a custom encoder, that encoder is used.
+    :param event: An EPCPyYes template event.
+    :return: A dictionary.
+    """
+    encode = EVENT_ENCODERS.get(type(event.encoder))
+    if encode:
+        return encode(event)
+    return event.encoder.default(event)
+
+
+def render_event(event) -> bytes:
+    """
+    :param event: An EPCPyYes template event.
+    :return: The event encoded as EPCIS JSON bytes.
+    """
+    return dumps(encode_event(event))
+
+
+def write_document(document: events.EPCISDocument, buffer,
+                   event_fragments=None):
+    """
+    Writes an EPCPyYes document to a binary buffer as EPCIS JSON.
+    :param document: The document to write.
+    :param buffer: Any binary file-like object.
+    :param event_fragments: An optional iterable of already rendered
+        `template_events` (as bytes).  If omitted the template events are
+        encoded as they are written.
+    """
+    buffer.write(b'{')
+    if document.header:
+        buffer.write(b'"header"' + KEY_SEPARATOR)
+        buffer.write(dumps(
+            json_encoders.StandardBusinessDocumentHeaderEncoder().default(
+                document.header)))
+        buffer.write(ITEM_SEPARATOR)
+    buffer.write(b'"events"' + KEY_SEPARATOR + b'[')
+    first = True
+    for attribute, encode in DOCUMENT_ENCODERS:
+        for event in getattr(document, attribute):
+            if not first:
+                buffer.write(ITEM_SEPARATOR)
+            buffer.write(dumps(encode(event)))
+            first = False
+    if event_fragments is None:
+        event_fragments = (render_event(event) for event in
+                           getattr(document, 'template_events', []))
+    for fragment in event_fragments:
+        if not first:
+            buffer.write(ITEM_SEPARATOR)
+        buffer.write(fragment)
+        first = False
+    buffer.write(b']' + ITEM_SEPARATOR + b'"createdDate"' + KEY_SEPARATOR)
+    buffer.write(dumps(get_date(document.created_date)
+                       if document.created_date else None))
+    buffer.write(b'}')
+
+
+def render_json(document: events.EPCISDocument) -> str:
+    """
+    A drop in replacement for the EPCPyYes document `render_json()`
+    function.
+    :param document: The document to render.
+    :return: The EPCIS JSON string.
+    """
+    buffer = io.BytesIO()
+    write_document(document, buffer)
+    return buffer.getvalue().decode()
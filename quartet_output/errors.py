@@ -45,3 +45,57 @@ class ProtocolNotSupportedError(BaseOutputError):
     Thrown if the Rule Context does not contain an expected context variable.
     '''
     pass
+
+
+class ConnectionPoolTimeout(BaseOutputError):
+    '''
+    Thrown if a connection could not be taken from a transport connection
+    pool before the pool's timeout expired.
+    '''
+    pass
+
+
+class ContentEncodingNotSupportedError(BaseOutputError):
+    '''
+    Thrown if a transport step is configured with a content-encoding that
+    it can not compress payloads with.
+    '''
+    pass
+
+
+class TaskDeferredError(BaseOutputError):
+    '''
+    Thrown to stop a rule whose task has been scheduled to run again
+    later.  This is not a failure: the `ResumableRule` and the task
+    runners in `quartet_output.delivery` and `quartet_output.tasks` put
+    the task back in the QUEUED state.
+    '''
+    def __init__(self, message: str, delay: float,
+                 task_name: str = None) -> None:
+        super().__init__(message)
+        self.delay = delay
+        self.task_name = task_name
+
+
+class EndPointThrottledError(TaskDeferredError):
+    '''
+    Thrown if an endpoint's rate or concurrency limit has been reached.
+    '''
+    pass
+
+
+class CircuitOpenError(TaskDeferredError):
+    '''
+    Thrown instead of sending a message to an endpoint whose circuit
+    breaker is open after too many consecutive failures.  The delay is
+    the time until the breaker lets a probe through.
+    '''
+    pass
+
+
+class SendRetryError(TaskDeferredError):
+    '''
+    Thrown if a failed send will be retried once the task's backoff delay
+    has passed.
+    '''
+    pass
@@ -0,0 +1,62 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.utils.translation import gettext as _
+from django.core.management.base import BaseCommand
+from jinja2 import TemplateError
+from quartet_capture.models import StepParameter
+from quartet_templates.models import Template
+from quartet_output.templating import get_environment, \
+    list_epcpyyes_templates, quartet_template_name
+
+
+class Command(BaseCommand):
+    help = _(
+        'Compiles the EPCPyYes default templates and any QU4RTET Templates '
+        'referenced by output steps into the on-disk bytecode cache so that '
+        'newly started workers do not have to compile them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='all',
+            help=_('Compile every QU4RTET Template, not just the ones '
+                   'referenced by a step Template parameter.')
+        )
+
+    def handle(self, *args, **options):
+        env = get_environment()
+        if not env.bytecode_cache:
+            self.stderr.write(_('The bytecode cache is disabled via the '
+                                'QUARTET_OUTPUT_BYTECODE_CACHE setting.'))
+        names = list_epcpyyes_templates()
+        if options['all']:
+            template_names = Template.objects.values_list('name', flat=True)
+        else:
+            template_names = StepParameter.objects.filter(
+                name='Template'
+            ).values_list('value', flat=True).distinct()
+        names += [quartet_template_name(name) for name in template_names]
+        compiled = 0
+        for name in names:
+            try:
+                env.get_template(name)
+                compiled += 1
+            except TemplateError as error:
+                self.stderr.write(
+                    _('Could not compile template %s: %s') % (name, error))
+        self.stdout.write(_('Compiled %s of %s templates.') %
+                          (compiled, len(names)))
@@ -0,0 +1,94 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.utils.translation import gettext as _
+from django.core.management.base import BaseCommand, CommandError
+from quartet_output.delivery import DeliveryEngine, MailBatchDelivery, \
+    SftpBatchDelivery
+
+
+class Command(BaseCommand):
+    help = _(
+        'Runs the queued output tasks that were created for the delivery '
+        'engine, many at a time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=32,
+            help=_('The maximum number of tasks to run at once.')
+        )
+        parser.add_argument(
+            '--endpoint-concurrency', type=int, default=4,
+            help=_('The maximum number of tasks to run at once for a '
+                   'single endpoint.')
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help=_('The number of task results to write back at once.')
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help=_('The number of seconds to wait between checks for new '
+                   'tasks.')
+        )
+        parser.add_argument(
+            '--rule', action='append', dest='rules',
+            help=_('Only run tasks for this rule.  May be repeated.')
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help=_('Exit once there are no more queued tasks.')
+        )
+        parser.add_argument(
+            '--sftp-batch', action='store_true',
+            help=_('Upload the tasks of the SFTP transport rules given with '
+                   '--rule in batches over shared connections and exit.')
+        )
+        parser.add_argument(
+            '--mail-batch', action='store_true',
+            help=_('Send the tasks of the mailto transport rules given with '
+                   '--rule in batches over one mail connection and exit.')
+        )
+        parser.add_argument(
+            '--sftp-channels', type=int, default=4,
+            help=_('The number of SFTP channels to upload a batch on.')
+        )
+
+    def handle(self, *args, **options):
+        if options['sftp_batch'] or options['mail_batch']:
+            if not options['rules']:
+                raise CommandError(_('--sftp-batch and --mail-batch require '
+                                     'at least one --rule.'))
+            if options['sftp_batch']:
+                batch = SftpBatchDelivery(
+                    options['rules'],
+                    channels=options['sftp_channels'],
+                    batch_size=options['batch_size']
+                )
+            else:
+                batch = MailBatchDelivery(
+                    options['rules'], batch_size=options['batch_size'])
+            processed = batch.start()
+            self.stdout.write(_('Processed %s output tasks.') % processed)
+            return
+        engine = DeliveryEngine(
+            concurrency=options['concurrency'],
+            endpoint_concurrency=options['endpoint_concurrency'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            rule_names=options['rules'],
+        )
+        processed = engine.start(once=options['once'])
+        self.stdout.write(_('Processed %s output tasks.') % processed)
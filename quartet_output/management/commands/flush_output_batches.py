@@ -0,0 +1,49 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import time
+
+from django.utils.translation import gettext as _
+from django.core.management.base import BaseCommand
+from quartet_output import batching
+
+
+class Command(BaseCommand):
+    help = _(
+        'Sends the output batches whose batch window has passed as merged '
+        'output tasks and resends batches whose flush was interrupted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval', type=float, default=0,
+            help=_('Keep running and check for due batches every this '
+                   'many seconds.  By default the command exits after one '
+                   'check.')
+        )
+        parser.add_argument(
+            '--recover-after', type=float, default=300,
+            help=_('The number of seconds after which a batch that is '
+                   'still being flushed is considered interrupted.')
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            task_names = batching.flush_due(options['recover_after'])
+            if task_names or not options['poll_interval']:
+                self.stdout.write(_('Created %s output tasks.') %
+                                  len(task_names))
+            if not options['poll_interval']:
+                break
+            time.sleep(options['poll_interval'])
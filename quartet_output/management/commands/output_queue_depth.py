@@ -0,0 +1,46 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.utils import timezone
+from django.utils.translation import gettext as _
+from django.core.management.base import BaseCommand
+from quartet_output import delivery
+from quartet_output.models import EndPoint
+
+
+class Command(BaseCommand):
+    help = _(
+        'Lists the number of queued output tasks for each endpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rule', action='append', dest='rules',
+            help=_('Only count tasks for this rule.  May be repeated.')
+        )
+
+    def handle(self, *args, **options):
+        depths = delivery.get_queue_depths(options['rules'])
+        names = dict(EndPoint.objects.filter(
+            pk__in=[depth['end_point'] for depth in depths]
+        ).values_list('pk', 'name'))
+        now = timezone.now()
+        self.stdout.write('%-40s %8s %8s %8s %10s' % (
+            _('End Point'), _('Queued'), _('Deferred'), _('Priority'),
+            _('Oldest (s)')))
+        for depth in depths:
+            self.stdout.write('%-40s %8s %8s %8s %10.0f' % (
+                names.get(depth['end_point'], _('(unknown)')),
+                depth['queued'], depth['deferred'], depth['priority'],
+                (now - depth['oldest']).total_seconds()))
@@ -0,0 +1,35 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.utils.translation import gettext as _
+from django.core.management.base import BaseCommand
+from quartet_output import payloads
+
+
+class Command(BaseCommand):
+    help = _(
+        'Deletes the stored output payloads that are no longer referred to '
+        'by an unfinished task.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=float, default=86400,
+            help=_('Only delete payloads that were last stored more than '
+                   'this many seconds ago.  Default is 86400 (one day).')
+        )
+
+    def handle(self, *args, **options):
+        deleted = payloads.purge(options['older_than'])
+        self.stdout.write(_('Deleted %s payloads.') % deleted)
@@ -0,0 +1,81 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.utils.translation import gettext as _
+from django.core.management.base import BaseCommand, CommandError
+from quartet_output.models import EndPoint
+from quartet_output.spool import get_spool, Replay
+
+
+class Command(BaseCommand):
+    help = _(
+        'Sends the messages in the dead-letter spool again.  Messages that '
+        'still can not be delivered are kept in the spool.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--end-point', action='append', dest='end_points',
+            help=_('Only replay the messages for the endpoint with this '
+                   'name.  May be repeated.')
+        )
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help=_('The number of messages to send at once.')
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=100,
+            help=_('The number of messages to send between progress '
+                   'reports and saved checkpoints.')
+        )
+        parser.add_argument(
+            '--list', action='store_true',
+            help=_('Only show the number of spooled messages per endpoint.')
+        )
+
+    def handle(self, *args, **options):
+        spool = get_spool()
+        if spool is None:
+            raise CommandError(_('QUARTET_OUTPUT_DEAD_LETTER_DIR is not '
+                                 'set.'))
+        end_point_ids = spool.get_end_point_ids()
+        if options['end_points']:
+            end_point_ids = list(EndPoint.objects.filter(
+                name__in=options['end_points'], pk__in=end_point_ids
+            ).values_list('pk', flat=True))
+        if options['list']:
+            names = dict(EndPoint.objects.filter(
+                pk__in=end_point_ids).values_list('pk', 'name'))
+            for end_point_id in end_point_ids:
+                self.stdout.write('%s: %s' % (
+                    names.get(end_point_id, end_point_id),
+                    spool.count(end_point_id)))
+            return
+        if not end_point_ids:
+            self.stdout.write(_('There are no spooled messages to replay.'))
+            return
+        replay = Replay(spool, workers=options['workers'],
+                        chunk_size=options['chunk_size'],
+                        progress=self.report)
+        delivered, failed = replay.replay(end_point_ids)
+        self.stdout.write(_('Delivered %s messages; %s are still spooled.') %
+                          (delivered, failed))
+
+    def report(self, end_point, delivered, failed, total, elapsed):
+        done = delivered + failed
+        self.stdout.write('%s: %s/%s (%.0f%%) delivered %s failed %s, '
+                          '%.1f messages/s' % (
+                              end_point, done, total,
+                              100.0 * done / max(total, 1), delivered,
+                              failed, done / max(elapsed, 0.001)))
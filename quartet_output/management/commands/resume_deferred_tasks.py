@@ -0,0 +1,49 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.utils.translation import gettext as _
+from django.core.management.base import BaseCommand
+from quartet_capture import models
+from quartet_output import delivery, scheduling
+from quartet_output.models import EndPointSlot
+
+
+class Command(BaseCommand):
+    help = _(
+        'Sends the queued tasks that were deferred by an endpoint rate or '
+        'concurrency limit, and whose deferral has passed, back to celery.  '
+        'Deferred tasks are normally queued again automatically; use this '
+        'if the message broker was unavailable at the time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset-concurrency', action='store_true',
+            help=_('Free the concurrency slots of every endpoint, for '
+                   'example after workers were killed while sending, '
+                   'rather than waiting for their leases to run out.')
+        )
+
+    def handle(self, *args, **options):
+        if options['reset_concurrency']:
+            EndPointSlot.objects.update(holder='', expires=0)
+        task_names = list(models.Task.objects.filter(
+            status='QUEUED',
+            name__in=scheduling.get_deferred_names(ready=True)
+        ).exclude(
+            taskparameter__name=delivery.ENGINE_PARAMETER
+        ).values_list('name', flat=True))
+        for task_name in task_names:
+            scheduling.requeue(task_name)
+        self.stdout.write(_('Queued %s deferred tasks.') % len(task_names))
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_output', '0005_auto_20200824_1624'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='endpoint',
+            name='burst',
+            field=models.PositiveIntegerField(blank=True, help_text='The number of messages that may be sent at once before the rate limit applies.  Defaults to the rate limit.', null=True, verbose_name='Burst'),
+        ),
+        migrations.AddField(
+            model_name='endpoint',
+            name='max_concurrency',
+            field=models.PositiveIntegerField(blank=True, help_text='The maximum number of messages that may be sent to the endpoint at the same time.  Leave empty for no limit.', null=True, verbose_name='Maximum Concurrency'),
+        ),
+        migrations.AddField(
+            model_name='endpoint',
+            name='rate_limit',
+            field=models.FloatField(blank=True, help_text='The maximum number of messages per second that may be sent to the endpoint.  Leave empty for no limit.', null=True, verbose_name='Rate Limit'),
+        ),
+        migrations.CreateModel(
+            name='EndPointThrottle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tokens', models.FloatField(default=0, help_text='The number of messages that may be sent right now.', verbose_name='Tokens')),
+                ('updated', models.FloatField(default=0, help_text='The time the tokens were last counted in seconds since the epoch.', verbose_name='Updated')),
+                ('in_flight', models.PositiveIntegerField(default=0, help_text='The number of messages being sent right now.', verbose_name='In Flight')),
+                ('version', models.PositiveIntegerField(default=0, help_text='Incremented on every change to the token count.', verbose_name='Version')),
+                ('end_point', models.OneToOneField(help_text='The throttled endpoint.', on_delete=django.db.models.deletion.CASCADE, related_name='throttle', to='quartet_output.endpoint', verbose_name='End Point')),
+            ],
+            options={
+                'verbose_name': 'End Point Throttle',
+                'verbose_name_plural': 'End Point Throttles',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_output', '0006_endpoint_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='epcisoutputcriteria',
+            name='additional_end_points',
+            field=models.ManyToManyField(blank=True, help_text='Other endpoints the same output data is delivered to along with the End Point.', related_name='additional_criteria', to='quartet_output.endpoint', verbose_name='Additional End Points'),
+        ),
+    ]
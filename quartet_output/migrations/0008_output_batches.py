@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_output', '0007_criteria_end_points'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutputBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('output_rule', models.CharField(help_text='The rule that will process the merged message.', max_length=100, verbose_name='Output Rule')),
+                ('created', models.DateTimeField(auto_now_add=True, help_text='When the messages were claimed for the batch.', verbose_name='Created')),
+                ('criteria', models.ForeignKey(help_text='The criteria the messages are sent with.', on_delete=django.db.models.deletion.CASCADE, to='quartet_output.epcisoutputcriteria', verbose_name='EPCIS Output Criteria')),
+            ],
+            options={
+                'verbose_name': 'Output Batch',
+                'verbose_name_plural': 'Output Batches',
+            },
+        ),
+        migrations.CreateModel(
+            name='OutputBatchItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('output_rule', models.CharField(help_text='The rule that will process the merged message.', max_length=100, verbose_name='Output Rule')),
+                ('data', models.TextField(help_text='The rendered EPCIS message.', verbose_name='Data')),
+                ('delivery_engine', models.BooleanField(default=False, help_text='Whether the merged task is left for the delivery engine instead of being sent to celery.', verbose_name='Delivery Engine')),
+                ('created', models.DateTimeField(auto_now_add=True, help_text='When the message was added.', verbose_name='Created')),
+                ('batch_size', models.PositiveIntegerField(default=0, help_text='The maximum number of messages merged into one message or 0 for no limit.', verbose_name='Batch Size')),
+                ('flush_at', models.DateTimeField(db_index=True, help_text='The time by which the message should be sent.', verbose_name='Flush At')),
+                ('batch', models.ForeignKey(blank=True, help_text='The batch the message was claimed for.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='quartet_output.outputbatch', verbose_name='Batch')),
+                ('criteria', models.ForeignKey(help_text='The criteria the message is sent with.', on_delete=django.db.models.deletion.CASCADE, to='quartet_output.epcisoutputcriteria', verbose_name='EPCIS Output Criteria')),
+            ],
+            options={
+                'verbose_name': 'Output Batch Item',
+                'verbose_name_plural': 'Output Batch Items',
+                'ordering': ['created', 'pk'],
+            },
+        ),
+    ]
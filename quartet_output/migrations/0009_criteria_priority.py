@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_output', '0008_output_batches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='epcisoutputcriteria',
+            name='priority',
+            field=models.IntegerField(default=0, help_text='Output tasks with a higher priority are sent first by the delivery engine.  Defaults to 0.', verbose_name='Priority'),
+        ),
+    ]
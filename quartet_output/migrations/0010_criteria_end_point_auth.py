@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_end_points(apps, schema_editor):
+    EPCISOutputCriteria = apps.get_model('quartet_output',
+                                         'EPCISOutputCriteria')
+    CriteriaEndPoint = apps.get_model('quartet_output', 'CriteriaEndPoint')
+    links = EPCISOutputCriteria.additional_end_points.through.objects.all()
+    CriteriaEndPoint.objects.bulk_create([
+        CriteriaEndPoint(criteria_id=link.epcisoutputcriteria_id,
+                         end_point_id=link.endpoint_id)
+        for link in links
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_output', '0009_criteria_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CriteriaEndPoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('authentication_info', models.ForeignKey(blank=True, help_text='The Authentication Info to use for this end point.  Leave empty to send without credentials.', null=True, on_delete=django.db.models.deletion.SET_NULL, to='quartet_output.authenticationinfo', verbose_name='Authentication Info')),
+                ('criteria', models.ForeignKey(help_text='The output criteria.', on_delete=django.db.models.deletion.CASCADE, related_name='criteria_end_points', to='quartet_output.epcisoutputcriteria', verbose_name='Criteria')),
+                ('end_point', models.ForeignKey(help_text='The additional end point.', on_delete=django.db.models.deletion.CASCADE, to='quartet_output.endpoint', verbose_name='End Point')),
+            ],
+            options={
+                'verbose_name': 'Criteria End Point',
+                'verbose_name_plural': 'Criteria End Points',
+                'ordering': ['end_point__name', 'pk'],
+                'unique_together': {('criteria', 'end_point')},
+            },
+        ),
+        # the through model can not be added to the existing field
+        migrations.RunPython(copy_end_points, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='epcisoutputcriteria',
+            name='additional_end_points',
+        ),
+        migrations.AddField(
+            model_name='epcisoutputcriteria',
+            name='additional_end_points',
+            field=models.ManyToManyField(blank=True, help_text='Other endpoints the same output data is delivered to along with the End Point.', related_name='additional_criteria', through='quartet_output.CriteriaEndPoint', to='quartet_output.endpoint', verbose_name='Additional End Points'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_output', '0010_criteria_end_point_auth'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='endpointthrottle',
+            name='in_flight',
+        ),
+        migrations.CreateModel(
+            name='EndPointSlot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(help_text='The number of the slot, starting at zero.', verbose_name='Number')),
+                ('holder', models.CharField(blank=True, help_text='Identifies the send holding the slot.  Empty if the slot is free.', max_length=32, verbose_name='Holder')),
+                ('expires', models.FloatField(default=0, help_text='The time the lease on the slot runs out in seconds since the epoch.', verbose_name='Expires')),
+                ('end_point', models.ForeignKey(help_text='The concurrency limited endpoint.', on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='quartet_output.endpoint', verbose_name='End Point')),
+            ],
+            options={
+                'verbose_name': 'End Point Slot',
+                'verbose_name_plural': 'End Point Slots',
+                'unique_together': {('end_point', 'number')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_output', '0011_endpoint_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outputbatchitem',
+            name='payload_key',
+            field=models.CharField(blank=True, help_text='The key of the message in `quartet_output.payloads` if it was at least as large as the payload threshold.', max_length=64, verbose_name='Payload Key'),
+        ),
+        migrations.AddField(
+            model_name='outputbatchitem',
+            name='payload_threshold',
+            field=models.PositiveIntegerField(default=0, help_text='Merged messages at least this large are stored as payloads.  0 never stores them.', verbose_name='Payload Key Threshold'),
+        ),
+        migrations.AddField(
+            model_name='outputbatchitem',
+            name='priority',
+            field=models.IntegerField(default=0, help_text='The priority of the output task.  A merged task gets the highest priority of its messages.', verbose_name='Priority'),
+        ),
+        migrations.AlterField(
+            model_name='outputbatchitem',
+            name='data',
+            field=models.TextField(blank=True, help_text='The rendered EPCIS message unless it is stored as a payload.', verbose_name='Data'),
+        ),
+    ]
@@ -14,6 +14,8 @@
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 
+import copy
+
 from EPCPyYes.core.v1_2.events import EventType
 from django.db import models
 from django.core.exceptions import ValidationError
@@ -142,6 +144,21 @@ class EPCISOutputCriteria(models.Model):
         help_text=_("A prtocol-specific endpoint defining where any output"
                     " data will be sent."),
     )
+    additional_end_points = models.ManyToManyField(
+        'quartet_output.EndPoint',
+        blank=True,
+        through='quartet_output.CriteriaEndPoint',
+        related_name='additional_criteria',
+        verbose_name=_("Additional End Points"),
+        help_text=_("Other endpoints the same output data is delivered to "
+                    "along with the End Point."),
+    )
+    priority = models.IntegerField(
+        default=0,
+        verbose_name=_("Priority"),
+        help_text=_("Output tasks with a higher priority are sent first by "
+                    "the delivery engine.  Defaults to 0."),
+    )
 
     def clean(self):
         """
@@ -157,6 +174,32 @@ class EPCISOutputCriteria(models.Model):
                 raise ValidationError(_("If either the Destination Type or ID "
                                         "are specified then both must be."))
 
+    def get_end_points(self) -> list:
+        """
+        :return: The End Point followed by any additional end points.
+        """
+        end_points = [self.end_point]
+        for link in self.criteria_end_points.all():
+            if link.end_point_id != self.end_point_id:
+                end_points.append(link.end_point)
+        return end_points
+
+    def for_end_point(self, end_point):
+        """
+        :return: A copy of the criteria, not meant to be saved, that sends
+            to the given end point instead of the End Point.  The copy
+            only keeps the criteria's Authentication Info for the End
+            Point itself; additional end points use their own.
+        """
+        criteria = copy.copy(self)
+        if end_point.pk != self.end_point_id:
+            criteria.authentication_info = None
+            for link in self.criteria_end_points.all():
+                if link.end_point_id == end_point.pk:
+                    criteria.authentication_info = link.authentication_info
+        criteria.end_point = end_point
+        return criteria
+
     def __str__(self):
         return self.name
 
@@ -184,6 +227,26 @@ class EndPoint(models.Model):
                     "protocol information."),
         null=False
     )
+    rate_limit = models.FloatField(
+        verbose_name=_("Rate Limit"),
+        help_text=_("The maximum number of messages per second that may be "
+                    "sent to the endpoint.  Leave empty for no limit."),
+        null=True, blank=True
+    )
+    burst = models.PositiveIntegerField(
+        verbose_name=_("Burst"),
+        help_text=_("The number of messages that may be sent at once "
+                    "before the rate limit applies.  Defaults to the rate "
+                    "limit."),
+        null=True, blank=True
+    )
+    max_concurrency = models.PositiveIntegerField(
+        verbose_name=_("Maximum Concurrency"),
+        help_text=_("The maximum number of messages that may be sent to "
+                    "the endpoint at the same time.  Leave empty for no "
+                    "limit."),
+        null=True, blank=True
+    )
 
     def __str__(self):
         return self.name
@@ -194,6 +257,237 @@ class EndPoint(models.Model):
         ordering = ['name']
 
 
+class CriteriaEndPoint(models.Model):
+    """
+    An additional end point of an `EPCISOutputCriteria` and the
+    credentials used to send to it.  The criteria's own Authentication
+    Info is never sent to an additional end point.
+    """
+    criteria = models.ForeignKey(
+        'quartet_output.EPCISOutputCriteria',
+        on_delete=models.CASCADE,
+        related_name='criteria_end_points',
+        verbose_name=_("Criteria"),
+        help_text=_("The output criteria.")
+    )
+    end_point = models.ForeignKey(
+        'quartet_output.EndPoint',
+        on_delete=models.CASCADE,
+        verbose_name=_("End Point"),
+        help_text=_("The additional end point.")
+    )
+    authentication_info = models.ForeignKey(
+        'quartet_output.AuthenticationInfo',
+        null=True, blank=True,
+        on_delete=models.SET_NULL,
+        verbose_name=_("Authentication Info"),
+        help_text=_("The Authentication Info to use for this end point.  "
+                    "Leave empty to send without credentials."),
+    )
+
+    def __str__(self):
+        return '%s: %s' % (self.criteria, self.end_point)
+
+    class Meta:
+        verbose_name = _('Criteria End Point')
+        verbose_name_plural = _('Criteria End Points')
+        unique_together = ('criteria', 'end_point')
+        ordering = ['end_point__name', 'pk']
+
+
+class EndPointThrottle(models.Model):
+    """
+    The token bucket shared by every worker that sends to a rate limited
+    `EndPoint`.  Rows are only changed through the conditional updates in
+    `quartet_output.scheduling`.
+    """
+    end_point = models.OneToOneField(
+        'quartet_output.EndPoint',
+        on_delete=models.CASCADE,
+        related_name='throttle',
+        verbose_name=_("End Point"),
+        help_text=_("The throttled endpoint.")
+    )
+    tokens = models.FloatField(
+        verbose_name=_("Tokens"),
+        help_text=_("The number of messages that may be sent right now."),
+        default=0
+    )
+    updated = models.FloatField(
+        verbose_name=_("Updated"),
+        help_text=_("The time the tokens were last counted in seconds "
+                    "since the epoch."),
+        default=0
+    )
+    version = models.PositiveIntegerField(
+        verbose_name=_("Version"),
+        help_text=_("Incremented on every change to the token count."),
+        default=0
+    )
+
+    def __str__(self):
+        return str(self.end_point)
+
+    class Meta:
+        verbose_name = _('End Point Throttle')
+        verbose_name_plural = _('End Point Throttles')
+
+
+class EndPointSlot(models.Model):
+    """
+    One of the `max_concurrency` slots of a concurrency limited
+    `EndPoint`.  A worker holds a slot while it sends and the slot is
+    leased until its expiry, so the slot of a worker that died while
+    sending is taken over by the next sender once the lease has run out.
+    Rows are only changed through the conditional updates in
+    `quartet_output.scheduling`.
+    """
+    end_point = models.ForeignKey(
+        'quartet_output.EndPoint',
+        on_delete=models.CASCADE,
+        related_name='slots',
+        verbose_name=_("End Point"),
+        help_text=_("The concurrency limited endpoint.")
+    )
+    number = models.PositiveIntegerField(
+        verbose_name=_("Number"),
+        help_text=_("The number of the slot, starting at zero.")
+    )
+    holder = models.CharField(
+        max_length=32,
+        blank=True,
+        verbose_name=_("Holder"),
+        help_text=_("Identifies the send holding the slot.  Empty if the "
+                    "slot is free.")
+    )
+    expires = models.FloatField(
+        verbose_name=_("Expires"),
+        help_text=_("The time the lease on the slot runs out in seconds "
+                    "since the epoch."),
+        default=0
+    )
+
+    def __str__(self):
+        return '%s: %s' % (self.end_point, self.number)
+
+    class Meta:
+        verbose_name = _('End Point Slot')
+        verbose_name_plural = _('End Point Slots')
+        unique_together = ('end_point', 'number')
+
+
+class OutputBatch(models.Model):
+    """
+    A set of batched messages that is being merged into one output task.
+    The batch is deleted along with its items once the task is created;
+    a batch that remains was interrupted and is flushed again.
+    """
+    criteria = models.ForeignKey(
+        'quartet_output.EPCISOutputCriteria',
+        on_delete=models.CASCADE,
+        verbose_name=_("EPCIS Output Criteria"),
+        help_text=_("The criteria the messages are sent with.")
+    )
+    output_rule = models.CharField(
+        max_length=100,
+        verbose_name=_("Output Rule"),
+        help_text=_("The rule that will process the merged message.")
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_("Created"),
+        help_text=_("When the messages were claimed for the batch.")
+    )
+
+    def __str__(self):
+        return '%s %s' % (self.criteria_id, self.output_rule)
+
+    class Meta:
+        verbose_name = _('Output Batch')
+        verbose_name_plural = _('Output Batches')
+
+
+class OutputBatchItem(models.Model):
+    """
+    A message waiting to be merged with other messages for the same
+    criteria and output rule; see `quartet_output.batching`.
+    """
+    criteria = models.ForeignKey(
+        'quartet_output.EPCISOutputCriteria',
+        on_delete=models.CASCADE,
+        verbose_name=_("EPCIS Output Criteria"),
+        help_text=_("The criteria the message is sent with.")
+    )
+    output_rule = models.CharField(
+        max_length=100,
+        verbose_name=_("Output Rule"),
+        help_text=_("The rule that will process the merged message.")
+    )
+    data = models.TextField(
+        blank=True,
+        verbose_name=_("Data"),
+        help_text=_("The rendered EPCIS message unless it is stored as a "
+                    "payload.")
+    )
+    payload_key = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name=_("Payload Key"),
+        help_text=_("The key of the message in `quartet_output.payloads` "
+                    "if it was at least as large as the payload threshold.")
+    )
+    payload_threshold = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Payload Key Threshold"),
+        help_text=_("Merged messages at least this large are stored as "
+                    "payloads.  0 never stores them.")
+    )
+    priority = models.IntegerField(
+        default=0,
+        verbose_name=_("Priority"),
+        help_text=_("The priority of the output task.  A merged task gets "
+                    "the highest priority of its messages.")
+    )
+    delivery_engine = models.BooleanField(
+        default=False,
+        verbose_name=_("Delivery Engine"),
+        help_text=_("Whether the merged task is left for the delivery "
+                    "engine instead of being sent to celery.")
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_("Created"),
+        help_text=_("When the message was added.")
+    )
+    batch_size = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Batch Size"),
+        help_text=_("The maximum number of messages merged into one "
+                    "message or 0 for no limit.")
+    )
+    flush_at = models.DateTimeField(
+        db_index=True,
+        verbose_name=_("Flush At"),
+        help_text=_("The time by which the message should be sent.")
+    )
+    batch = models.ForeignKey(
+        'quartet_output.OutputBatch',
+        null=True, blank=True,
+        on_delete=models.CASCADE,
+        related_name='items',
+        verbose_name=_("Batch"),
+        help_text=_("The batch the message was claimed for.")
+    )
+
+    def __str__(self):
+        return '%s %s' % (self.criteria_id, self.output_rule)
+
+    class Meta:
+        verbose_name = _('Output Batch Item')
+        verbose_name_plural = _('Output Batch Items')
+        ordering = ['created', 'pk']
+
+
 class AuthenticationInfo(models.Model):
     """
     Holds data relative to basic auth needed by EndPoints for HTTP and other
@@ -0,0 +1,128 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+Content-addressed storage for outbound payloads.  Instead of copying a
+large rendered message into the data of every output task, the
+`CreateOutputTaskStep` can store it once under the SHA-256 hash of its
+content and pass only that key to the task in the `Payload Key` task
+parameter.  The `TransportStep` then streams the payload straight from
+storage.  Identical payloads, such as the same document sent by several
+rules, are stored once.
+
+Payloads are kept under `payloads/` in the Django storage backend used
+for task data, or in the local directory given by the
+QUARTET_OUTPUT_PAYLOAD_DIR setting.  They are removed by the
+`purge_payloads` command once no unfinished task or waiting batched
+message refers to them.
+"""
+import hashlib
+import os
+from datetime import timedelta
+from logging import getLogger
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.utils import timezone
+from quartet_capture import models
+from quartet_capture.defaults import get_storage as get_task_storage
+
+from quartet_output.models import OutputBatchItem
+
+logger = getLogger(__name__)
+
+PAYLOAD_PARAMETER = 'Payload Key'
+PAYLOAD_DIRECTORY = 'payloads'
+
+
+def get_storage() -> Storage:
+    directory = getattr(settings, 'QUARTET_OUTPUT_PAYLOAD_DIR', None)
+    if directory:
+        return FileSystemStorage(location=directory)
+    return get_task_storage()
+
+
+def get_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_name(key: str) -> str:
+    if len(key) != 64 or not all(c in '0123456789abcdef' for c in key):
+        raise ValueError('%s is not a payload key.' % key)
+    return '%s/%s/%s' % (PAYLOAD_DIRECTORY, key[:2], key)
+
+
+def store(data, storage: Storage = None) -> str:
+    """
+    Stores the payload unless a payload with the same content is stored
+    already.
+    :param data: A string or bytes.
+    :return: The key of the payload.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    storage = storage or get_storage()
+    key = get_key(data)
+    name = get_name(key)
+    if storage.exists(name):
+        # keep the payload from being purged while the new task needs it
+        try:
+            os.utime(storage.path(name))
+        except NotImplementedError:
+            pass
+    else:
+        saved = storage.save(name, ContentFile(data))
+        if saved != name:
+            # stored by another process at the same time
+            storage.delete(saved)
+    return key
+
+
+def open_payload(key: str, storage: Storage = None):
+    """
+    :return: The stored payload as a binary file object.
+    """
+    return (storage or get_storage()).open(get_name(key), 'rb')
+
+
+def purge(older_than: float = 86400, storage: Storage = None) -> int:
+    """
+    Deletes the payloads that are older than the given number of seconds
+    and are not referred to by a task that has not finished or by an
+    `OutputBatchItem`.
+    :return: The number of payloads deleted.
+    """
+    storage = storage or get_storage()
+    in_use = set(models.TaskParameter.objects.filter(
+        name=PAYLOAD_PARAMETER
+    ).exclude(task__status='FINISHED').values_list('value', flat=True))
+    in_use.update(OutputBatchItem.objects.exclude(
+        payload_key='').values_list('payload_key', flat=True))
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    deleted = 0
+    try:
+        directories, files = storage.listdir(PAYLOAD_DIRECTORY)
+    except (FileNotFoundError, NotImplementedError):
+        return 0
+    for directory in directories:
+        for key in storage.listdir(
+                os.path.join(PAYLOAD_DIRECTORY, directory))[1]:
+            name = '%s/%s/%s' % (PAYLOAD_DIRECTORY, directory, key)
+            if key in in_use or storage.get_modified_time(name) > cutoff:
+                continue
+            storage.delete(name)
+            deleted += 1
+    logger.debug('Deleted %s payloads.', deleted)
+    return deleted
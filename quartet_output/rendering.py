@@ -0,0 +1,358 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+Renders EPCPyYes documents from individually rendered event fragments.
+Each event in a document's `template_events` list is rendered on its own
+and the document is assembled from those fragments, which allows the
+fragments to be cached between documents that share events (re-sends,
+partial shipments, the same pallet going to more than one partner).
+
+XML fragments are rendered with the document's context, as the
+document template's `{% include event.template %}` would render them,
+so custom event templates may use the header or additional context.
+Only fragments of the stock EPCPyYes event templates, which do not use
+the document context, are cached, and fragments are keyed by the
+event's content as well as its id.
+
+Events are always rendered in the process running the rule.  Output
+rules usually run in celery's prefork workers, which are daemonic and
+can not start processes of their own, and forking the multi-threaded
+processes of other worker pools is not safe.
+"""
+import hashlib
+import io
+from collections import OrderedDict
+from enum import Enum
+from logging import getLogger
+from threading import Lock
+
+from django.conf import settings
+from EPCPyYes.core.v1_2.template_events import TransformationEvent
+
+from quartet_output import encoders
+from quartet_output.templating import get_environment, \
+    list_epcpyyes_templates
+
+XML = 'xml'
+JSON = 'json'
+
+_fragment_cache = None
+_fragment_cache_lock = Lock()
+_stock_templates = None
+
+logger = getLogger(__name__)
+
+
+class FragmentCache:
+    """
+    A thread-safe, size bounded cache of rendered event fragments.  Once
+    the cache holds `max_size` fragments the least recently used fragment
+    is evicted for each new one.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._fragments = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+            return fragment
+
+    def set(self, key, fragment):
+        if self.max_size < 1:
+            return
+        with self._lock:
+            self._fragments[key] = fragment
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_size:
+                self._fragments.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+    def __len__(self):
+        return len(self._fragments)
+
+
+class CacheStatistics:
+    """
+    Counts the fragment cache hits and misses for a single document.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __str__(self):
+        return '%s hits, %s misses (%.1f%% hit ratio)' % (
+            self.hits, self.misses, self.ratio * 100)
+
+
+class RenderedEvent:
+    """
+    Stands in for an event in a document's event list so that the
+    document template includes an already rendered fragment.
+    """
+    _template = None
+
+    def __init__(self, fragment: str):
+        self.fragment = fragment
+
+    @property
+    def template(self):
+        if RenderedEvent._template is None:
+            RenderedEvent._template = get_environment().from_string(
+                '{{ event.fragment }}')
+        return RenderedEvent._template
+
+
+def get_fragment_cache() -> FragmentCache:
+    """
+    :return: The process wide fragment cache.  The number of fragments
+        held is set by the QUARTET_OUTPUT_FRAGMENT_CACHE_SIZE setting.
+    """
+    global _fragment_cache
+    if _fragment_cache is None:
+        with _fragment_cache_lock:
+            if _fragment_cache is None:
+                _fragment_cache = FragmentCache(getattr(
+                    settings, 'QUARTET_OUTPUT_FRAGMENT_CACHE_SIZE', 10000))
+    return _fragment_cache
+
+
+def reset_fragment_cache():
+    global _fragment_cache
+    with _fragment_cache_lock:
+        _fragment_cache = None
+
+
+def get_event_key(event):
+    """
+    :return: The database primary key of the event if it has been loaded
+        from the database, otherwise its EPCIS event id or None.
+    """
+    event_key = getattr(event, 'id', None)
+    if isinstance(event_key, tuple):
+        # EPCPyYes stores an id passed to the constructor as a tuple
+        event_key = event_key[0] if event_key else None
+    return event_key or getattr(event, 'event_id', None)
+
+
+def is_stock_template(template) -> bool:
+    """
+    :return: True if the template is one of the event templates shipped
+        with EPCPyYes, which only use the event itself.
+    """
+    global _stock_templates
+    if _stock_templates is None:
+        _stock_templates = frozenset(list_epcpyyes_templates())
+    return getattr(template, 'name', None) in _stock_templates
+
+
+def _get_content(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_get_content(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((repr(key), _get_content(item))
+                            for key, item in value.items()))
+    if hasattr(value, '__dict__') and not isinstance(value, (Enum, type)):
+        return type(value).__name__, tuple(sorted(
+            (name, _get_content(item)) for name, item in vars(value).items()
+            # the template machinery and encoders are not event data
+            if name not in ('_env', '_template', '_context', 'encoder')
+        ))
+    return repr(value)
+
+
+def get_content_hash(event) -> str:
+    """
+    :return: A hash of the event's data, so that an event changed after
+        it was cached is rendered again.
+    """
+    return hashlib.sha1(repr(_get_content(event)).encode()).hexdigest()
+
+
+def get_fragment_key(event, format):
+    """
+    Returns the cache key of the event's rendered fragment or None if the
+    event can not be identified reliably or its template may depend on
+    the document.
+    :param event: An EPCPyYes template event.
+    :param format: Either `XML` or `JSON`.
+    """
+    event_key = get_event_key(event)
+    if not event_key:
+        return None
+    if format == XML:
+        template = event.template
+        if not is_stock_template(template):
+            return None
+        return event_key, get_content_hash(event), template, format
+    return event_key, get_content_hash(event), type(event.encoder), format
+
+
+def get_document_context(document) -> dict:
+    """
+    :return: The context `EPCISEventListDocument.render` renders the
+        document template, and so each event template, with.
+    """
+    return {
+        'header': document.header,
+        'template_events': document.template_events,
+        'transformation_events': document.transformation_events,
+        'render_namespaces': getattr(document, '_render_namespaces', False),
+        'render_xml_declaration': document.render_xml_declaration,
+        'created_date': document.created_date,
+        'additional_context': getattr(document, 'additional_context', None),
+    }
+
+
+def render_xml_fragment(event, context: dict = None) -> str:
+    """
+    :param context: The context of the document the event is rendered
+        into; see `get_document_context`.
+    """
+    return event.template.render(dict(context or {}, event=event))
+
+
+def render_json_fragment(event, context: dict = None) -> bytes:
+    return encoders.render_event(event)
+
+
+FRAGMENT_RENDERERS = {
+    XML: render_xml_fragment,
+    JSON: render_json_fragment,
+}
+
+
+def render_events(events, format, context: dict = None) -> list:
+    """
+    :param context: The document context XML fragments are rendered with.
+    :return: A list of rendered fragments in the same order as `events`.
+    """
+    render = FRAGMENT_RENDERERS[format]
+    return [render(event, context) for event in events]
+
+
+def render_fragments(events, format, cache: FragmentCache = None,
+                     statistics: CacheStatistics = None,
+                     context: dict = None) -> list:
+    """
+    Renders each event on its own.
+    :param events: The EPCPyYes template events to render.
+    :param format: Either `XML` or `JSON`.
+    :param cache: If supplied, fragments are looked up in and added to the
+        cache.
+    :param statistics: Optional statistics to record cache hits and
+        misses in.
+    :param context: The document context XML fragments are rendered with.
+    :return: A list of rendered fragments in the same order as `events`.
+    """
+    if cache is None:
+        return render_events(events, format, context)
+    ret = []
+    keys = []
+    missing = []
+    for index, event in enumerate(events):
+        key = get_fragment_key(event, format)
+        fragment = cache.get(key) if key else None
+        if fragment is None:
+            missing.append(index)
+        ret.append(fragment)
+        keys.append(key)
+    if statistics:
+        statistics.hits += len(events) - len(missing)
+        statistics.misses += len(missing)
+    fragments = render_events([events[index] for index in missing],
+                              format, context)
+    for index, fragment in zip(missing, fragments):
+        ret[index] = fragment
+        if keys[index]:
+            cache.set(keys[index], fragment)
+    return ret
+
+
+def split_transformation_events(document):
+    """
+    Moves the transformation events out of the document's
+    `template_events` list exactly as
+    `EPCISEventListDocument.render()` does so that the rendered fragments
+    end up in the same place in the document.
+    """
+    for event in document.template_events:
+        if isinstance(event, TransformationEvent):
+            document.transformation_events.append(event)
+            document.template_events.remove(event)
+
+
+def assemble_xml(document, template_fragments,
+                 transformation_fragments) -> str:
+    """
+    Renders the document template with the supplied event fragments in
+    place of its events.
+    """
+    template_events = document.template_events
+    transformation_events = document.transformation_events
+    document.template_events = [RenderedEvent(fragment) for fragment in
+                                template_fragments]
+    document.transformation_events = [
+        RenderedEvent(fragment) for fragment in transformation_fragments]
+    try:
+        return document.render()
+    finally:
+        document.template_events = template_events
+        document.transformation_events = transformation_events
+
+
+def assemble_json(document, fragments) -> str:
+    buffer = io.BytesIO()
+    encoders.write_document(document, buffer, event_fragments=fragments)
+    return buffer.getvalue().decode()
+
+
+def render_document(document, format=XML, cache: FragmentCache = None,
+                    statistics: CacheStatistics = None) -> str:
+    """
+    Renders an `EPCISEventListDocument` from its event fragments.
+    :param document: The document to render.
+    :param format: Either `XML` or `JSON`.  JSON documents are written by
+        the `quartet_output.encoders` module.
+    :param cache: An optional fragment cache.
+    :param statistics: Optional statistics to record cache hits and
+        misses in.
+    :return: The rendered document.
+    """
+    if format == JSON:
+        return assemble_json(document, render_fragments(
+            document.template_events, JSON, cache, statistics))
+    split_transformation_events(document)
+    context = get_document_context(document)
+    return assemble_xml(
+        document,
+        render_fragments(document.template_events, XML, cache, statistics,
+                         context),
+        render_fragments(document.transformation_events, XML, cache,
+                         statistics, context)
+    )
@@ -0,0 +1,380 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+Rate and concurrency limits for `EndPoint` records and the deferral of
+tasks that hit them or that have to wait.
+
+The limits are enforced with a token bucket held in an
+`EndPointThrottle` row per endpoint and with one `EndPointSlot` row per
+allowed concurrent send, so they apply across all worker processes that
+share the database.  The rows are changed with conditional updates
+(compare and swap on the bucket's version or the slot's expiry) rather
+than row locks so the same code works on every database backend.  A slot
+is leased for `QUARTET_OUTPUT_SLOT_LEASE` seconds (300 by default) and
+the slot of a worker that died while sending is free again once its
+lease has run out; the lease should be longer than the slowest send.
+
+A task that can not send yet is not put to sleep.  `defer_task` records
+the time it may run again in the `Deferred Until` task parameter and
+schedules it again: celery tasks are sent back to the queue with a
+countdown and delivery engine tasks are skipped by the engine until the
+time has passed.  The step then raises a `TaskDeferredError`, which the
+`ResumableRule`, `delivery.execute_task` and the `execute_output_task`
+and `execute_deferred_task` celery tasks treat as a normal outcome and
+put the task back in QUEUED.  quartet_capture's own `execute_queued_task`
+runs a plain `Rule`, which would mark a deferred task FAILED, so steps
+that were not loaded by a `ResumableRule` (see `can_defer`) wait in the
+worker instead.  Output tasks created by this package are queued with
+`delivery.queue_task` and always run as a `ResumableRule`.
+
+A deferred task can also resume part way through its rule.
+`save_resume_point` stores the data and context of the running rule and
+the order of the step to resume after; `ResumableRule` then skips the
+steps up to and including that one when the task runs again.  This is
+how the `DelayStep` waits without holding on to a worker.  Output
+criteria in the context are stored by name and looked up again on
+resume; a context holding anything else that can not be stored as JSON,
+such as EPCPyYes events, can not be resumed.
+"""
+import io
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from logging import getLogger
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from quartet_capture import models
+from quartet_capture.defaults import get_storage
+from quartet_capture.rules import Rule
+
+from quartet_output import criteria
+from quartet_output.errors import EndPointThrottledError, TaskDeferredError
+from quartet_output.models import EndPoint, EndPointSlot, \
+    EndPointThrottle, EPCISOutputCriteria
+
+logger = getLogger(__name__)
+
+DEFERRED_PARAMETER = 'Deferred Until'
+RESUME_STEP_PARAMETER = 'Resume After Step'
+RESUME_CONTEXT_PARAMETER = 'Resume Context'
+# marks a context value that is stored as the name of an output criteria
+CRITERIA_MARKER = '__epcis_output_criteria__'
+# task parameter values are strings; this format sorts in time order
+DEFERRED_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def get_throttle(end_point: EndPoint) -> EndPointThrottle:
+    throttle, created = EndPointThrottle.objects.get_or_create(
+        end_point=end_point,
+        defaults={'tokens': get_capacity(end_point), 'updated': time.time()}
+    )
+    return throttle
+
+
+def get_capacity(end_point: EndPoint) -> float:
+    return float(end_point.burst or max(1, end_point.rate_limit or 1))
+
+
+def take_token(end_point: EndPoint, attempts: int = 10) -> float:
+    """
+    Takes a token from the endpoint's bucket.
+    :return: 0 if a token was taken, otherwise the number of seconds
+        until the next token is available.
+    """
+    if not end_point.rate_limit:
+        return 0
+    capacity = get_capacity(end_point)
+    for attempt in range(attempts):
+        throttle = get_throttle(end_point)
+        now = time.time()
+        tokens = min(capacity, throttle.tokens + max(
+            0, now - throttle.updated) * end_point.rate_limit)
+        if tokens < 1:
+            return (1 - tokens) / end_point.rate_limit
+        if EndPointThrottle.objects.filter(
+            pk=throttle.pk, version=throttle.version
+        ).update(tokens=tokens - 1, updated=now, version=F('version') + 1):
+            return 0
+    # too much contention to get a token; try again shortly
+    return 1 / end_point.rate_limit
+
+
+def get_slot_lease() -> float:
+    return float(getattr(settings, 'QUARTET_OUTPUT_SLOT_LEASE', 300))
+
+
+def acquire_slot(end_point: EndPoint):
+    """
+    Leases one of the endpoint's concurrency slots.  Slots that are free
+    or whose lease has run out may be taken.
+    :return: The holder of the slot, which is passed to `release_slot`,
+        or None if every slot is held.
+    """
+    numbers = set(EndPointSlot.objects.filter(
+        end_point=end_point, number__lt=end_point.max_concurrency
+    ).values_list('number', flat=True))
+    for number in range(end_point.max_concurrency):
+        if number not in numbers:
+            EndPointSlot.objects.get_or_create(end_point=end_point,
+                                               number=number)
+    holder = uuid.uuid4().hex
+    now = time.time()
+    for number in range(end_point.max_concurrency):
+        if EndPointSlot.objects.filter(
+            end_point=end_point, number=number, expires__lt=now
+        ).update(holder=holder, expires=now + get_slot_lease()):
+            return holder
+    return None
+
+
+def release_slot(end_point: EndPoint, holder: str):
+    """
+    Frees the slot taken by `acquire_slot` unless its lease has run out
+    and it was taken over by another send.
+    """
+    EndPointSlot.objects.filter(
+        end_point=end_point, holder=holder
+    ).update(holder='', expires=0)
+
+
+@contextmanager
+def throttle(end_point: EndPoint, retry_delay: float = 1.0):
+    """
+    Holds a concurrency slot and a rate limit token for the endpoint
+    while a message is sent.
+    :param retry_delay: The delay suggested when the concurrency limit has
+        been reached.
+    :raises EndPointThrottledError: If either limit has been reached.
+    """
+    holder = None
+    if end_point.max_concurrency:
+        holder = acquire_slot(end_point)
+        if holder is None:
+            raise EndPointThrottledError(
+                'The endpoint %s already has %s messages in flight.' % (
+                    end_point, end_point.max_concurrency), retry_delay)
+    try:
+        delay = take_token(end_point)
+        if delay:
+            raise EndPointThrottledError(
+                'The endpoint %s is limited to %s messages per second.' % (
+                    end_point, end_point.rate_limit), delay)
+        yield
+    finally:
+        if holder:
+            release_slot(end_point, holder)
+
+
+def can_defer(step) -> bool:
+    """
+    :return: True if the step was loaded by a `ResumableRule`, which stops
+        the rule without failing the task when a step defers it.
+    """
+    return getattr(step, 'step_order', None) is not None
+
+
+def defer_task(task_name: str, delay: float):
+    """
+    Schedules the task to run again after the delay.
+    :param task_name: The name of the task.
+    :param delay: Seconds to wait.
+    """
+    from quartet_output import delivery
+    run_at = timezone.now() + timedelta(seconds=delay)
+    models.TaskParameter.objects.update_or_create(
+        task_id=task_name, name=DEFERRED_PARAMETER,
+        defaults={'value': run_at.strftime(DEFERRED_FORMAT),
+                  'description': 'The task was deferred and may run '
+                                 'again after this time (UTC).'}
+    )
+    if not models.TaskParameter.objects.filter(
+        task_id=task_name, name=delivery.ENGINE_PARAMETER
+    ).exists():
+        requeue(task_name, delay)
+
+
+def requeue(task_name: str, delay: float = 0):
+    from quartet_output import delivery
+    from quartet_output.tasks import execute_deferred_task
+    priority = models.TaskParameter.objects.filter(
+        task_id=task_name, name=delivery.PRIORITY_PARAMETER
+    ).values_list('value', flat=True).first()
+    try:
+        execute_deferred_task.apply_async(
+            kwargs={'task_name': task_name}, countdown=max(0, delay),
+            priority=delivery.get_celery_priority(int(priority or 0)))
+    except Exception:
+        logger.exception('Could not queue deferred task %s; it can be '
+                         'queued with the resume_deferred_tasks command.',
+                         task_name)
+
+
+def get_deferred_names(ready: bool):
+    """
+    :param ready: True for the tasks whose deferral has passed, False for
+        the ones that still have to wait.
+    :return: A queryset of the names of deferred tasks.
+    """
+    now = timezone.now().strftime(DEFERRED_FORMAT)
+    parameters = models.TaskParameter.objects.filter(name=DEFERRED_PARAMETER)
+    if ready:
+        parameters = parameters.filter(value__lte=now)
+    else:
+        parameters = parameters.filter(value__gt=now)
+    return parameters.values('task_id')
+
+
+def get_resume_file_name(task_name: str) -> str:
+    return '{0}.resume.dat'.format(task_name)
+
+
+def dump_context(context: dict) -> tuple:
+    """
+    Converts a rule context's dictionary to JSON.  Output criteria are
+    stored by name.
+    :return: The JSON text and the keys of the entries that can not be
+        stored; a context with such entries can not be resumed.
+    """
+    saved = {}
+    skipped = []
+    for key, value in context.items():
+        if key == 'RULE_PARAMETERS':
+            continue
+        if isinstance(value, EPCISOutputCriteria):
+            saved[key] = {CRITERIA_MARKER: value.name}
+            continue
+        try:
+            json.dumps(value)
+            saved[key] = value
+        except (TypeError, ValueError):
+            skipped.append(key)
+    return json.dumps(saved), skipped
+
+
+def load_context(text: str) -> dict:
+    """
+    :return: The context dictionary stored by `dump_context`.
+    """
+    context = json.loads(text or '{}')
+    for key, value in context.items():
+        if isinstance(value, dict) and list(value) == [CRITERIA_MARKER]:
+            context[key] = criteria.get_criteria(name=value[CRITERIA_MARKER])
+    return context
+
+
+def save_resume_point(task_name: str, step_order: int, data,
+                      context: str):
+    """
+    Stores what a task needs to resume its rule after the given step.
+    :param step_order: The order of the last step that has run.
+    :param data: The data that will be passed to the next step.
+    :param context: The rule context's dictionary as returned by
+        `dump_context`.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    storage = get_storage()
+    file_name = get_resume_file_name(task_name)
+    if storage.exists(file_name):
+        storage.delete(file_name)
+    storage.save(name=file_name, content=io.BytesIO(data or b''))
+    for name, value in ((RESUME_STEP_PARAMETER, str(step_order)),
+                        (RESUME_CONTEXT_PARAMETER, context)):
+        models.TaskParameter.objects.update_or_create(
+            task_id=task_name, name=name, defaults={'value': value})
+
+
+def clear_resume_point(task_name: str):
+    models.TaskParameter.objects.filter(
+        task_id=task_name,
+        name__in=[RESUME_STEP_PARAMETER, RESUME_CONTEXT_PARAMETER]
+    ).delete()
+    storage = get_storage()
+    file_name = get_resume_file_name(task_name)
+    if storage.exists(file_name):
+        storage.delete(file_name)
+
+
+class ResumableRule(Rule):
+    """
+    A `Rule` that continues where a deferred run of its task left off;
+    see `save_resume_point`.  Tasks without a resume point run every
+    step.
+    """
+
+    def __init__(self, rule: models.Rule, task: models.Task):
+        super().__init__(rule, task)
+        parameters = dict(models.TaskParameter.objects.filter(
+            task=task,
+            name__in=[RESUME_STEP_PARAMETER, RESUME_CONTEXT_PARAMETER]
+        ).values_list('name', 'value'))
+        self.resume_after = None
+        if RESUME_STEP_PARAMETER in parameters:
+            self.resume_after = int(parameters[RESUME_STEP_PARAMETER])
+            self.steps = {order: step for order, step in self.steps.items()
+                          if order > self.resume_after}
+            self.context.context.update(
+                load_context(parameters.get(RESUME_CONTEXT_PARAMETER)))
+            self.info('Resuming the rule after step %s.', self.resume_after)
+
+    def _load_steps(self):
+        steps = super()._load_steps()
+        # the order is kept on each step instance rather than read from
+        # the step class, which every rule being loaded changes
+        for order, step in steps.items():
+            step.step_order = order
+        return steps
+
+    def read_data(self) -> bytes:
+        """
+        :return: The task's data or, when resuming, the data saved for the
+            next step.
+        """
+        if self.resume_after is None:
+            file_name = '{0}.dat'.format(self.db_task.name)
+        else:
+            file_name = get_resume_file_name(self.db_task.name)
+        with get_storage().open(name=file_name) as message_file:
+            return message_file.read()
+
+    def execute(self, data):
+        """
+        Runs the steps like `Rule.execute` but a step that defers the task
+        stops the rule without being treated as a failure: the deferral is
+        logged as an info message and the step's `on_failure` is not
+        called.
+        :raises TaskDeferredError: If a step deferred the task.
+        """
+        if not self.steps and self.resume_after is None:
+            return super().execute(data)
+        self.info('Beginning execution of Rule %s' % self.db_rule.name)
+        for number, step in self.steps.items():
+            logger.debug('Executing step %s.', number)
+            try:
+                data = step.execute(data, self.context) or data
+            except TaskDeferredError as e:
+                self.info('Step %s deferred the task: %s', number, e)
+                raise
+            except Exception:
+                self._log_exception()
+                self._on_step_failure(step)
+                raise
+        self.data = data
+        if self.resume_after is not None:
+            clear_resume_point(self.db_task.name)
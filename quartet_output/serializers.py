@@ -42,6 +42,7 @@ class ReadOnlyEPCISOutputCriteriaSerializer(ModelSerializer):
     Default read_only serializer for the EPCISOutputCriteria model.
     """
     end_point = EndPointSerializer(many=False, read_only=True)
+    additional_end_points = EndPointSerializer(many=True, read_only=True)
     authentication_info = AuthenticationInfoSerializer(many=False,
                                                        read_only=True)
 
@@ -0,0 +1,120 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+Splits a list of EPCPyYes events into several messages that stay under
+an event count and/or byte size limit.  Events are split in groups
+(units) so that the events of a single packing hierarchy can be kept in
+the same message.
+"""
+
+
+def get_event_epcs(event) -> list:
+    """
+    :return: Every EPC referenced by the event including parent ids.
+    """
+    ret = []
+    for attribute in ('epc_list', 'child_epcs', 'input_epc_list',
+                      'output_epc_list'):
+        ret.extend(getattr(event, attribute, None) or [])
+    parent_id = getattr(event, 'parent_id', None)
+    if parent_id:
+        ret.append(parent_id)
+    return ret
+
+
+def group_hierarchies(events: list) -> list:
+    """
+    Groups events that share any EPC or parent id so that a pallet, its
+    cases and their items (and the events that commissioned them) end up
+    in the same group.  Groups are ordered by their first event and the
+    events in each group keep their original order.
+    :param events: A list of EPCPyYes events.
+    :return: A list of event lists.
+    """
+    parents = list(range(len(events)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    owners = {}
+    for index, event in enumerate(events):
+        for epc in get_event_epcs(event):
+            owner = owners.setdefault(epc, index)
+            root, other = find(index), find(owner)
+            if root != other:
+                parents[max(root, other)] = min(root, other)
+    groups = {}
+    for index, event in enumerate(events):
+        groups.setdefault(find(index), []).append(event)
+    return list(groups.values())
+
+
+def pack(units: list, max_events: int = 0) -> list:
+    """
+    Packs units of events into parts of at most `max_events` events.  A
+    unit is never split, so a unit larger than `max_events` gets a part
+    of its own.
+    :param units: A list of event lists.
+    :param max_events: The maximum number of events per part or 0 for no
+        limit.
+    :return: A list of parts, each of which is a list of units.
+    """
+    if max_events < 1:
+        return [units] if units else []
+    parts = []
+    part = []
+    count = 0
+    for unit in units:
+        if part and count + len(unit) > max_events:
+            parts.append(part)
+            part = []
+            count = 0
+        part.append(unit)
+        count += len(unit)
+    if part:
+        parts.append(part)
+    return parts
+
+
+def _render_part(units: list, render, max_bytes: int) -> list:
+    data = render([event for unit in units for event in unit])
+    if max_bytes and len(units) > 1 and len(data.encode()) > max_bytes:
+        middle = len(units) // 2
+        parts = _render_part(units[:middle], render, max_bytes)
+        parts.extend(_render_part(units[middle:], render, max_bytes))
+        return parts
+    return [data]
+
+
+def split_events(units: list, render, max_events: int = 0,
+                 max_bytes: int = 0) -> list:
+    """
+    Renders the units of events into as many messages as are needed to
+    keep each message within the limits.  Parts that render to more than
+    `max_bytes` are divided in half until they fit or consist of a single
+    unit.
+    :param units: A list of event lists.
+    :param render: A callable that renders a list of events to a string.
+    :param max_events: The maximum number of events per message or 0.
+    :param max_bytes: The maximum size of a message in bytes or 0.
+    :return: A list of rendered messages.
+    """
+    ret = []
+    for part in pack(units, max_events):
+        ret.extend(_render_part(part, render, max_bytes))
+    return ret
@@ -0,0 +1,317 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+A dead-letter spool for messages the `TransportStep` could not deliver
+because their endpoint was down.  Set QUARTET_OUTPUT_DEAD_LETTER_DIR to
+a directory to turn it on; the `replay_dead_letters` command sends the
+spooled messages again in bulk once the endpoint is back.
+
+Each endpoint has a directory, named after its primary key, holding an
+append-only `spool.log`.  A record is a line of JSON describing the
+message (task, rule, criteria, step parameters and the payload length)
+followed by the payload bytes.
+
+A replay first renames the log to a `.replay` file so new failures go to
+a fresh log while it runs.  The replay sends the records in chunks, saves
+the offset reached after each chunk in a `.offset` file so an
+interrupted replay continues where it stopped, appends the records that
+fail again to the new log and deletes the `.replay` file at the end.
+"""
+import fcntl
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from logging import getLogger
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections
+from quartet_capture import models
+from quartet_capture.rules import RuleContext
+
+from quartet_output import criteria, delivery
+from quartet_output.errors import EndPointThrottledError
+from quartet_output.models import EndPoint, EPCISOutputCriteria
+from quartet_output.transport import circuit
+
+logger = getLogger(__name__)
+
+SPOOL_FILE = 'spool.log'
+REPLAY_SUFFIX = '.replay'
+OFFSET_SUFFIX = '.offset'
+
+_append_lock = Lock()
+
+
+def get_spool():
+    """
+    :return: A `DeadLetterSpool` for the QUARTET_OUTPUT_DEAD_LETTER_DIR
+        setting or None if the setting is not configured.
+    """
+    directory = getattr(settings, 'QUARTET_OUTPUT_DEAD_LETTER_DIR', None)
+    return DeadLetterSpool(directory) if directory else None
+
+
+def is_dead_letter(error: Exception) -> bool:
+    """
+    :return: True if the error shows the endpoint was unavailable, in which
+        case sending the message again later may succeed.
+    """
+    # an open circuit defers the task rather than failing it
+    return circuit.is_endpoint_failure(error)
+
+
+class DeadLetterSpool:
+    """
+    The spooled messages in a directory.
+    :param directory: The spool directory; it is created when the first
+        message is spooled.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get_directory(self, end_point_id: int) -> str:
+        return os.path.join(self.directory, str(end_point_id))
+
+    def append(self, end_point_id: int, header: dict, payload: bytes):
+        """
+        Adds a message to the end point's spool.
+        :param header: The description of the message; it must be
+            serializable as JSON.
+        :param payload: The message.
+        """
+        header = dict(header, length=len(payload),
+                      spooled=header.get('spooled', time.time()))
+        record = json.dumps(header).encode('utf-8') + b'\n' + payload
+        directory = self.get_directory(end_point_id)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, SPOOL_FILE)
+        with _append_lock:
+            while True:
+                with open(path, 'ab') as spool_file:
+                    fcntl.flock(spool_file, fcntl.LOCK_EX)
+                    # a replay may have claimed the file while we waited
+                    # for the lock
+                    if os.path.exists(path) and os.path.samestat(
+                        os.fstat(spool_file.fileno()), os.stat(path)
+                    ):
+                        spool_file.write(record)
+                        spool_file.flush()
+                        os.fsync(spool_file.fileno())
+                        return
+
+    def get_end_point_ids(self) -> list:
+        """
+        :return: The primary keys of the end points with spooled messages.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(name) for name in os.listdir(self.directory)
+                      if name.isdigit() and self.get_files(int(name)))
+
+    def get_files(self, end_point_id: int) -> list:
+        directory = self.get_directory(end_point_id)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name == SPOOL_FILE or name.endswith(REPLAY_SUFFIX)
+        )
+
+    def claim(self, end_point_id: int) -> list:
+        """
+        Moves the end point's log aside for a replay.
+        :return: The paths of the `.replay` files to send, including any
+            left by an interrupted replay.
+        """
+        directory = self.get_directory(end_point_id)
+        path = os.path.join(directory, SPOOL_FILE)
+        if os.path.exists(path):
+            with open(path, 'ab') as spool_file:
+                fcntl.flock(spool_file, fcntl.LOCK_EX)
+                os.replace(path, os.path.join(
+                    directory, '%s%s' % (time.time_ns(), REPLAY_SUFFIX)))
+        return [name for name in self.get_files(end_point_id)
+                if name.endswith(REPLAY_SUFFIX)]
+
+    def read(self, path: str, offset: int = 0):
+        """
+        Yields (next offset, header, payload) for each record in the file
+        starting at the offset.
+        """
+        with open(path, 'rb') as spool_file:
+            spool_file.seek(offset)
+            while True:
+                line = spool_file.readline()
+                if not line.endswith(b'\n'):
+                    # the end of the file or a record cut short by a crash
+                    return
+                header = json.loads(line)
+                payload = spool_file.read(header['length'])
+                if len(payload) < header['length']:
+                    return
+                yield spool_file.tell(), header, payload
+
+    def count(self, end_point_id: int) -> int:
+        total = 0
+        for path in self.get_files(end_point_id):
+            offset = self.get_offset(path)
+            for record in self.read(path, offset):
+                total += 1
+        return total
+
+    def get_offset(self, path: str) -> int:
+        try:
+            with open(path + OFFSET_SUFFIX) as offset_file:
+                return int(offset_file.read())
+        except FileNotFoundError:
+            return 0
+
+    def save_offset(self, path: str, offset: int):
+        temp_path = path + OFFSET_SUFFIX + '.part'
+        with open(temp_path, 'w') as offset_file:
+            offset_file.write(str(offset))
+        os.replace(temp_path, path + OFFSET_SUFFIX)
+
+    def remove(self, path: str):
+        for name in (path + OFFSET_SUFFIX, path):
+            if os.path.exists(name):
+                os.unlink(name)
+
+
+def get_header(rule_context: RuleContext,
+               output_criteria: EPCISOutputCriteria, parameters: dict,
+               text: bool, error: Exception) -> dict:
+    return {
+        'task': rule_context.task_name,
+        'rule': rule_context.rule_name,
+        'criteria': output_criteria.name,
+        'end_point': output_criteria.end_point.name,
+        'parameters': parameters,
+        'text': text,
+        'error': str(error),
+        'attempts': 1,
+    }
+
+
+class Replay:
+    """
+    Sends the spooled messages of end points again.
+    :param spool: The spool to replay.
+    :param workers: The number of messages sent at once.
+    :param chunk_size: The number of messages sent between saving the
+        replay's progress.
+    :param progress: Called with the end point, the number of messages
+        replayed, failed and in total and the elapsed seconds after each
+        chunk.
+    """
+
+    def __init__(self, spool: DeadLetterSpool, workers: int = 8,
+                 chunk_size: int = 100, progress=None):
+        self.spool = spool
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+    def get_criteria(self, name: str, end_point: EndPoint):
+        return criteria.get_criteria(name=name).for_end_point(end_point)
+
+    def replay(self, end_point_ids: list = None) -> tuple:
+        """
+        :param end_point_ids: The end points to replay; all of them by
+            default.
+        :return: The number of messages delivered and failed.
+        """
+        delivered = failed = 0
+        with ThreadPoolExecutor(self.workers) as executor:
+            for end_point_id in end_point_ids or \
+                    self.spool.get_end_point_ids():
+                try:
+                    end_point = EndPoint.objects.get(pk=end_point_id)
+                except EndPoint.DoesNotExist:
+                    logger.warning('Skipping the spool of the deleted end '
+                                   'point %s.', end_point_id)
+                    continue
+                result = self.replay_end_point(end_point, executor)
+                delivered += result[0]
+                failed += result[1]
+        return delivered, failed
+
+    def replay_end_point(self, end_point: EndPoint,
+                         executor: ThreadPoolExecutor) -> tuple:
+        total = self.spool.count(end_point.pk)
+        delivered = failed = 0
+        start = time.monotonic()
+        for path in self.spool.claim(end_point.pk):
+            records = self.spool.read(path, self.spool.get_offset(path))
+            while True:
+                chunk = list(islice(records, self.chunk_size))
+                if not chunk:
+                    break
+                results = executor.map(
+                    lambda record: self.send(end_point, *record[1:]), chunk)
+                for (offset, header, payload), error in zip(chunk, results):
+                    if error is None:
+                        delivered += 1
+                        self.set_delivered(header['task'], end_point)
+                        continue
+                    failed += 1
+                    header.update(error=str(error),
+                                  attempts=header.get('attempts', 1) + 1)
+                    self.spool.append(end_point.pk, header, payload)
+                self.spool.save_offset(path, chunk[-1][0])
+                if self.progress:
+                    self.progress(end_point, delivered, failed, total,
+                                  time.monotonic() - start)
+            self.spool.remove(path)
+        return delivered, failed
+
+    def set_delivered(self, task_name: str, end_point: EndPoint):
+        if models.Task.objects.filter(name=task_name).exists():
+            delivery.set_delivery_status(task_name, end_point,
+                                         delivery.DELIVERED)
+
+    def send(self, end_point: EndPoint, header: dict, payload: bytes):
+        """
+        Sends one spooled message.
+        :return: None or the error if it could not be sent.
+        """
+        from quartet_output.steps import TransportStep
+        try:
+            task = models.Task.objects.filter(name=header['task']).first()
+            # the replay is the retry; failed sends are not deferred
+            step = TransportStep(task, **dict(header['parameters'],
+                                              retries='0'))
+            output_criteria = self.get_criteria(header['criteria'],
+                                                end_point)
+            data = payload.decode('utf-8') if header['text'] else payload
+            rule_context = RuleContext(header['rule'], header['task'])
+            while True:
+                try:
+                    step.deliver(data, rule_context, output_criteria)
+                    break
+                except EndPointThrottledError as e:
+                    time.sleep(e.delay)
+            step.info('Delivered the message spooled after %s failed '
+                      'attempt(s) to %s.', header.get('attempts', 1),
+                      end_point)
+        except Exception as e:
+            logger.info('Replay to %s failed: %s', end_point, e)
+            return e
+        finally:
+            close_old_connections()
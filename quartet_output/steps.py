@@ -18,28 +18,26 @@ from urllib.parse import urlparse
 
 import io
 import re
-import requests
 import time
 from jinja2 import Environment
 from django.core.files.base import File
+from django.db.models import Q
 from django.utils.translation import gettext as _
 
 from EPCPyYes.core.v1_2 import events
 from EPCPyYes.core.v1_2 import template_events
 from quartet_capture import models, rules, errors as capture_errors
 from quartet_capture.rules import RuleContext
-from quartet_capture.tasks import create_and_queue_task
 from quartet_epcis.db_api.queries import EPCISDBProxy, EntryList
 from quartet_epcis.models.choices import EventTypeChoicesEnum
 from quartet_epcis.parsing.steps import EPCISParsingStep
-from quartet_output import errors
+from quartet_output import batching, criteria, delivery, encoders, \
+    errors, payloads, rendering, scheduling, splitting, spool
 from quartet_output.models import EPCISOutputCriteria, EndPoint
 from quartet_output.parsing import SimpleOutputParser, BusinessOutputParser
-from quartet_output.transport.http import HttpTransportMixin
-from quartet_output.transport.tcp import SocketTransportMixin
-from quartet_output.transport.mail import MailMixin
-from quartet_output.transport.sftp import SftpTransportMixin
-from quartet_templates.models import Template
+from quartet_output.transport import circuit, fanout
+from quartet_output.transport import registry
+from quartet_output.templating import load_quartet_template
 
 
 
@@ -87,6 +85,16 @@ class ContextKeys(Enum):
     When the `CreateOutputTaskStep` creates a new task for deferred processing
     it will store the value here for other interested steps to obtain if
     necessary.
+
+    OUTBOUND_EPCIS_MESSAGES_KEY
+    ---------------------------
+    When the `EPCPyYesOutputStep` splits its output into more than one
+    message the messages are placed in a list under this key instead of
+    under the OUTBOUND_EPCIS_MESSAGE_KEY.
+
+    CREATED_TASK_NAMES_KEY
+    ----------------------
+    The names of all of the tasks created by the `CreateOutputTaskStep`.
     """
     FILTERED_EVENTS_KEY = 'FILTERED_EVENTS'
     EPCIS_OUTPUT_CRITERIA_KEY = 'EPCIS_OUTPUT_CRITERIA'
@@ -94,6 +102,8 @@ class ContextKeys(Enum):
     OBJECT_EVENTS_KEY = 'OBJECT_EVENTS'
     OUTBOUND_EPCIS_MESSAGE_KEY = 'OUTBOUND_EPCIS_MESSAGE'
     CREATED_TASK_NAME_KEY = 'CREATED_TASK_NAME'
+    OUTBOUND_EPCIS_MESSAGES_KEY = 'OUTBOUND_EPCIS_MESSAGES'
+    CREATED_TASK_NAMES_KEY = 'CREATED_TASK_NAMES'
     LOT_NUMBER = 'LOT_NUMBER'
 
 
@@ -124,8 +134,7 @@ class DynamicTemplateMixin:
         """
         template_name = self.get_parameter('Template', None)
         if template_name:
-            template_model = Template.objects.get(name=template_name)
-            template = env.from_string(template_model.content)
+            template = load_quartet_template(template_name, env)
         else:
             template = env.get_template(default)
         return template
@@ -192,9 +201,7 @@ class OutputParsingStep(EPCISParsingStep):
                                              raise_exception=True)
         self.info(_('EPCIS Output Critieria is set to %s' % output_criteria))
         try:
-            return EPCISOutputCriteria.objects.get(
-                name=output_criteria
-            )
+            return criteria.get_criteria(name=output_criteria)
         except EPCISOutputCriteria.DoesNotExist:
             exc = EPCISOutputCriteria.DoesNotExist(
                 _('EPCISOutputCriteria with name %s could not be found in the '
@@ -620,14 +627,89 @@ class EPCPyYesOutputStep(rules.Step, FilteredEventStepMixin):
             else:
                 all_events = oevents + aggevents
         if len(all_events) > 0:
-            epcis_document = self.get_epcis_document_class(all_events)
-            if self.get_boolean_parameter('JSON', False):
-                data = epcis_document.render_json()
+            max_events = self.get_integer_parameter(
+                'Max Events Per Message', 0)
+            max_bytes = self.get_integer_parameter('Max Bytes Per Message', 0)
+            if max_events > 0 or max_bytes > 0:
+                messages = self.split_events(all_events, max_events,
+                                             max_bytes)
             else:
-                data = epcis_document.render()
-            rule_context.context[
-                ContextKeys.OUTBOUND_EPCIS_MESSAGE_KEY.value
-            ] = data
+                messages = [self.render_events(all_events)]
+            if len(messages) > 1:
+                rule_context.context[
+                    ContextKeys.OUTBOUND_EPCIS_MESSAGES_KEY.value
+                ] = messages
+            else:
+                rule_context.context[
+                    ContextKeys.OUTBOUND_EPCIS_MESSAGE_KEY.value
+                ] = messages[0]
+
+    def split_events(self, all_events, max_events: int,
+                     max_bytes: int) -> list:
+        """
+        Renders the events into as many messages as are needed to stay
+        within the configured event and byte limits.
+        :param all_events: The EPCPyYes events to render.
+        :param max_events: The maximum number of events per message or 0.
+        :param max_bytes: The maximum message size in bytes or 0.
+        :return: A list of rendered messages.
+        """
+        if self.get_boolean_parameter('Split On Pallets', False):
+            units = splitting.group_hierarchies(all_events)
+            if max_events > 0 and \
+                    max(len(unit) for unit in units) > max_events:
+                self.warning(_('A packing hierarchy has more than %s '
+                               'events and will not be split.') % max_events)
+        else:
+            units = [[event] for event in all_events]
+        messages = splitting.split_events(units, self.render_events,
+                                          max_events, max_bytes)
+        for message in messages:
+            if max_bytes > 0 and len(message.encode()) > max_bytes:
+                self.warning(_('A message could not be split to less than '
+                               '%s bytes.') % max_bytes)
+        self.info(_('Split %s events into %s messages.') %
+                  (len(all_events), len(messages)))
+        return messages
+
+    def render_events(self, events) -> str:
+        """
+        Creates a document for the events and renders it.
+        :param events: The EPCPyYes events to render.
+        :return: The rendered document.
+        """
+        epcis_document = self.get_epcis_document_class(list(events))
+        return self.render_document(epcis_document)
+
+    def render_document(self, epcis_document) -> str:
+        """
+        Renders the document to XML or JSON depending on the step
+        parameters.
+        :param epcis_document: The document returned by
+        `get_epcis_document_class`.
+        :return: The rendered document.
+        """
+        json_output = self.get_boolean_parameter('JSON', False)
+        cache_fragments = self.get_boolean_parameter('Cache Fragments', False)
+        if self.get_integer_parameter('Render Processes', 1) > 1:
+            self.warning(_('The Render Processes parameter is no longer '
+                           'supported; the events are rendered in this '
+                           'process.'))
+        if cache_fragments and hasattr(epcis_document, 'template_events'):
+            statistics = rendering.CacheStatistics()
+            data = rendering.render_document(
+                epcis_document,
+                rendering.JSON if json_output else rendering.XML,
+                rendering.get_fragment_cache(),
+                statistics
+            )
+            self.info(_('Event fragment cache: %s.') % statistics)
+            return data
+        if json_output:
+            if self.get_boolean_parameter('Fast JSON', False):
+                return encoders.render_json(epcis_document)
+            return epcis_document.render_json()
+        return epcis_document.render()
 
     def get_epcis_document_class(self,
                                  all_events) -> template_events.EPCISEventListDocument:
@@ -662,6 +744,35 @@ class EPCPyYesOutputStep(rules.Step, FilteredEventStepMixin):
                                              'Events will be ignored.'),
             "JSON": _('If set to True then the output message for the EPCPyYEs'
                       'events will be JSON.'),
+            "Fast JSON": _('If set to True along with the JSON parameter, the '
+                           'events are serialized directly to EPCIS JSON '
+                           'without going through the EPCPyYes encoders. '
+                           'Uses orjson if it is installed. Default is '
+                           'False.'),
+            "Cache Fragments": _('If set to True, each event is rendered on '
+                                 'its own and the rendered event is cached '
+                                 'by event id, content, template and '
+                                 'format so that events sent again in '
+                                 'later messages are not rendered again. '
+                                 'Only events using the stock EPCPyYes '
+                                 'templates are cached. JSON output is '
+                                 'written as with Fast JSON. Default is '
+                                 'False.'),
+            "Max Events Per Message": _('If greater than 0, the events are '
+                                        'split into messages of at most '
+                                        'this many events. More than one '
+                                        'message is placed in the context '
+                                        'under the '
+                                        'OUTBOUND_EPCIS_MESSAGES_KEY. '
+                                        'Default is 0.'),
+            "Max Bytes Per Message": _('If greater than 0, the events are '
+                                       'split into messages of at most this '
+                                       'many bytes. Default is 0.'),
+            "Split On Pallets": _('If set to True along with one of the '
+                                  'message limits, events that share EPCs '
+                                  '(for example a pallet, its cases and '
+                                  'their items) are always placed in the '
+                                  'same message. Default is False.'),
         }
 
     def on_failure(self):
@@ -684,6 +795,17 @@ class CreateOutputTaskStep(rules.Step):
     Events in this list would mean that the output evaluation was successful
     and that the **ENTIRE** inbound message should be sent somewhere using
     the *Endpoint* defined in the output criteria.
+
+    If the `Batch Window` *Step Parameter* is set, rendered messages are
+    not sent right away but merged with the other messages for the same
+    output criteria and Output Rule that arrive within the window; see
+    `quartet_output.batching`.
+
+    Tasks get the priority of the output criteria or of the `Priority`
+    *Step Parameter*; the delivery engine sends tasks with a higher
+    priority first.  Tasks queued with celery get it as their celery
+    priority, which only orders them if the broker's queues support
+    priorities; see `delivery.get_celery_priority`.
     '''
 
     def __init__(self, db_task: models.Task, **kwargs):
@@ -722,6 +844,15 @@ class CreateOutputTaskStep(rules.Step):
             data = rule_context.context.get(
                 ContextKeys.OUTBOUND_EPCIS_MESSAGE_KEY.value
             )
+            messages = rule_context.context.get(
+                ContextKeys.OUTBOUND_EPCIS_MESSAGES_KEY.value
+            )
+            if messages:
+                self.info(_('Found %s messages under the '
+                            'OUTBOUND_EPCIS_MESSAGES_KEY context key.'),
+                          len(messages))
+                self.create_output_tasks(messages, rule_context)
+                return
         if data:
             self.info(_('Data or a Forward Data parameter '
                         'instruction was found.  '
@@ -756,36 +887,178 @@ class CreateOutputTaskStep(rules.Step):
                 self.info(_('The Forward Data parameter was specified. The '
                             'step will send the inbound, unmodifed data to '
                             'the specified Output Rule.'))
-            task = create_and_queue_task(
-                data, output_rule_name,
-                'Output',
-                task_parameters=[task_param],
-                run_immediately=self.run_immediately
-            )
+            elif self.batch_message(data, output_rule_name, rule_context):
+                return
+            task = self.create_task(data, output_rule_name, [task_param],
+                                    epcis_output_criteria)
             rule_context.context[ContextKeys.CREATED_TASK_NAME_KEY.value] = task.name
             self.info('Created a new output task %s with rule %s',
                       task.name, output_rule_name)
 
+    def batch_message(self, data, output_rule_name: str,
+                      rule_context: RuleContext) -> bool:
+        '''
+        Adds the message to the output batch for the criteria and output
+        rule if the Batch Window step parameter is set; see
+        `quartet_output.batching`.
+        :return: True if the message was batched.
+        '''
+        window = float(self.get_parameter('Batch Window', 0))
+        if window <= 0:
+            return False
+        if not isinstance(data, str) or not batching.can_merge(data):
+            self.warning(_('The message is not an EPCIS document that can '
+                           'be merged and will be sent on its own.'))
+            return False
+        output_criteria = rule_context.get_required_context_variable(
+            ContextKeys.EPCIS_OUTPUT_CRITERIA_KEY.value)
+        if not isinstance(output_criteria, EPCISOutputCriteria):
+            output_criteria = criteria.get_criteria(name=output_criteria)
+        task_names = batching.add_message(
+            output_criteria, output_rule_name, data, window,
+            self.get_integer_parameter('Batch Size', 0),
+            self.get_boolean_parameter('Delivery Engine', False),
+            self.get_priority(output_criteria),
+            self.get_integer_parameter('Payload Key Threshold', 0)
+        )
+        if task_names:
+            rule_context.context[ContextKeys.CREATED_TASK_NAME_KEY.value] = \
+                task_names[-1]
+            rule_context.context[ContextKeys.CREATED_TASK_NAMES_KEY.value] = \
+                task_names
+            self.info('Flushed the output batch into tasks %s.',
+                      ', '.join(task_names))
+        else:
+            self.info('Added the message to the output batch for %s.',
+                      output_criteria)
+        return True
+
+    def get_priority(self, output_criteria: EPCISOutputCriteria = None):
+        '''
+        :return: The Priority step parameter or else the criteria's
+            priority.
+        '''
+        return self.get_integer_parameter(
+            'Priority', getattr(output_criteria, 'priority', 0))
+
+    def create_task(self, data, output_rule_name: str,
+                    task_parameters: list,
+                    output_criteria: EPCISOutputCriteria = None
+                    ) -> models.Task:
+        '''
+        Creates an output task with `delivery.create_output_task` and
+        either queues it or leaves it for the delivery engine depending on
+        the Delivery Engine step parameter.  Data at least as large as the
+        Payload Key Threshold is stored in `quartet_output.payloads` and
+        only its key is passed to the task.
+        :param data: The data for the task.
+        :param output_rule_name: The rule that will process the task.
+        :param task_parameters: The parameters of the new task.
+        :param output_criteria: The criteria whose priority the task gets
+            unless the Priority step parameter is set.
+        :return: The task.
+        '''
+        return delivery.create_output_task(
+            data, output_rule_name, task_parameters,
+            self.get_priority(output_criteria),
+            self.get_integer_parameter('Payload Key Threshold', 0),
+            self.get_boolean_parameter('Delivery Engine', False),
+            self.run_immediately
+        )
+
+    def create_output_tasks(self, messages: list, rule_context: RuleContext):
+        '''
+        Creates one output task for each message so that the messages can
+        be processed and sent concurrently.
+        :param messages: The messages found under the
+        OUTBOUND_EPCIS_MESSAGES_KEY.
+        :param rule_context: The rule context.
+        '''
+        output_rule_name = self.get_parameter('Output Rule',
+                                              raise_exception=True)
+        epcis_output_criteria = rule_context.get_required_context_variable(
+            ContextKeys.EPCIS_OUTPUT_CRITERIA_KEY.value
+        )
+        task_names = []
+        for part, message in enumerate(messages, 1):
+            task_parameters = [
+                models.TaskParameter(
+                    name='EPCIS Output Criteria',
+                    value=epcis_output_criteria,
+                    description=_('The name of the EPCIS Output Criteria to '
+                                  'use during task processing.')
+                ),
+                models.TaskParameter(
+                    name='Message Part',
+                    value='%s of %s' % (part, len(messages)),
+                    description=_('The part of the split outbound message '
+                                  'processed by this task.')
+                ),
+            ]
+            task = self.create_task(message, output_rule_name,
+                                    task_parameters, epcis_output_criteria)
+            task_names.append(task.name)
+        rule_context.context[ContextKeys.CREATED_TASK_NAME_KEY.value] = \
+            task_names[0]
+        rule_context.context[ContextKeys.CREATED_TASK_NAMES_KEY.value] = \
+            task_names
+        self.info('Created %s output tasks with rule %s: %s',
+                  len(task_names), output_rule_name, ', '.join(task_names))
+
     def declared_parameters(self):
         return {
             "Output Rule": _('The name of the rule that will process the '
                              'EPCIS output data created by this step.'),
             "Forward Data": _('Boolean.  Whether or not to ignore data in the '
                               'OUTBOUND_EPCIS_MESSAGE_KEY and just forward '
-                              'the inbound data to the output rule.')
+                              'the inbound data to the output rule.'),
+            "Delivery Engine": _('Boolean.  If True the output tasks are not '
+                                 'sent to celery but are left queued for '
+                                 'the deliver_output_tasks command. '
+                                 'Default is False.'),
+            "Batch Window": _('If greater than 0, messages for the same '
+                              'output criteria and Output Rule are '
+                              'collected for up to this many seconds and '
+                              'merged into one EPCIS document and output '
+                              'task. Default is 0.'),
+            "Batch Size": _('With a Batch Window, the number of messages '
+                            'that are merged at most; a full batch is sent '
+                            'right away. Default is 0 (no limit).'),
+            "Payload Key Threshold": _('If greater than 0, messages of at '
+                                       'least this many bytes are stored '
+                                       'once by content and the output '
+                                       'task only gets their key; the '
+                                       'TransportStep streams them from '
+                                       'storage. Default is 0.'),
+            "Priority": _('The priority of the output tasks; tasks with a '
+                          'higher priority are sent first by the delivery '
+                          'engine.  Celery tasks are given it as their '
+                          'message priority, which needs a broker queue '
+                          'that supports priorities.  Defaults to the '
+                          'priority of the EPCIS Output Criteria.')
         }
 
     def on_failure(self):
         pass
 
 
-class TransportStep(rules.Step, HttpTransportMixin, SftpTransportMixin,
-                    MailMixin, SocketTransportMixin):
+class TransportStep(rules.Step):
     '''
     Uses the transport information within the `EPCISOutputCriteria` placed
     on the context under the EPCIS_OUTPUT_CRITERIA_KEY to send any data that
     was placed on the context under the OUTBOUND_EPCIS_MESSAGE_KEY.
 
+    The transport is looked up by the scheme of the endpoint's urn in
+    `quartet_output.transport.registry` and is only imported when it is
+    first used.  To override a transport mixin's methods, such as
+    `post_data` or `sftp_put`, in a subclass, add the mixin to the
+    subclass's bases; the built in transports then call the subclass's
+    methods.
+
+    If the criteria has additional end points the data is delivered to
+    all of them at once and a retry of the task only resends to the end
+    points that did not get it; see `fan_out`.
+
     A transport rule is typically configured with one transport step and
     the name of that rule would be specified in a different rule as a
     step parameter to the CreateOutputTaskStep above for example.
@@ -795,10 +1068,27 @@ class TransportStep(rules.Step, HttpTransportMixin, SftpTransportMixin,
                         'http posts, puts, etc. Default is application/'
                         'xml.'
         'file-extension': 'The file extension to specify when posting and '
-                          'putting data via http. Default is xml.'
+                          'putting data via http and when writing files '
+                          'to sftp and file endpoints. Default is xml.'
         'body-raw': 'Whether or not the data should be sent as raw body '
                     'or file attachment.'
                     'Defaults to True.'
+        'gzip-attachment-threshold': 'Email attachments larger than this '
+                                     'number of bytes are gzipped. '
+                                     'Default is 0 (never).'
+        'content-encoding': 'gzip or deflate to compress http and https '
+                            'payloads while they are sent.  Default is '
+                            'no compression.'
+        'compression-level': 'The zlib compression level (1-9) used with '
+                             'content-encoding.  Default is 6.'
+        'retries': 'The number of times a failed send is retried. '
+                   'Each retry defers the task for the backoff delay '
+                   'instead of waiting in the worker. Default is 0.'
+        'retry-backoff': 'The base delay in seconds between retries, '
+                         'doubled on each attempt and jittered. '
+                         'Default is 1.'
+        'retry-backoff-max': 'The maximum delay in seconds between '
+                             'retries.  Default is 30.'
     '''
 
     def execute(self, data, rule_context: RuleContext):
@@ -806,33 +1096,291 @@ class TransportStep(rules.Step, HttpTransportMixin, SftpTransportMixin,
         try:
             self.info(_('Looking for the task parameter with the EPCIS '
                         'Output Name.'))
-            param = models.TaskParameter.objects.get(
-                task__name=rule_context.task_name,
-                name='EPCIS Output Criteria'
-            )
+            names = Q(name__in=[delivery.CRITERIA_PARAMETER,
+                                payloads.PAYLOAD_PARAMETER])
+            statuses = Q(
+                name__startswith=delivery.DELIVERY_STATUS_PARAMETER % '')
+            parameters = dict(models.TaskParameter.objects.filter(
+                names | statuses, task__name=rule_context.task_name
+            ).values_list('name', 'value'))
+            if delivery.CRITERIA_PARAMETER not in parameters:
+                raise models.TaskParameter.DoesNotExist()
             # now see if we can get the output critieria based on the param
             # value
             self.info(_('Found the output param, now looking up the '
                         'EPCIS Output Criteria instance with name %s.'),
-                      param.value
+                      parameters[delivery.CRITERIA_PARAMETER]
                       )
-            output_criteria = EPCISOutputCriteria.objects.get(
-                name=param.value
-            )
+            output_criteria = criteria.get_criteria(
+                name=parameters[delivery.CRITERIA_PARAMETER])
             self.info(_('Found output criteria with name %s.'),
                       output_criteria)
-            # check the url/urn to see if we support the protocol
-            protocol = self._supports_protocol(output_criteria.end_point)
-            self.info('Protocol supported.  Sending message to %s.' %
-                      output_criteria.end_point.urn)
-            self._send_message(data, protocol, rule_context, output_criteria)
-
         except models.TaskParameter.DoesNotExist:
             raise capture_errors.ExpectedTaskParameterError(
                 _('The task parameter with name EPCIS Output Criteria '
                   'could not be found.  This task parameter is required by '
                   'the TransportStep to function correctly.')
             )
+        payload_key = parameters.get(payloads.PAYLOAD_PARAMETER)
+        if payload_key:
+            self.info('Sending the stored payload %s.', payload_key)
+            with payloads.open_payload(payload_key) as payload:
+                self.send_output(payload, rule_context, output_criteria,
+                                 parameters)
+        else:
+            self.send_output(data, rule_context, output_criteria,
+                             parameters)
+
+    def send_output(self, data, rule_context: RuleContext,
+                    output_criteria: EPCISOutputCriteria,
+                    statuses: dict = None):
+        '''
+        Sends the data to the criteria's end points, deferring the task
+        if an end point is throttled, its circuit is open or a failed send
+        will be retried, and spooling the data if the end point is down.
+        Data that was spooled is recorded with a Delivery Status task
+        parameter and not sent again when the task is run again;
+        `replay_dead_letters` delivers it.
+        :param statuses: The task's Delivery Status parameters if they
+            have been read already.
+        '''
+        if statuses is None:
+            statuses = self.get_delivery_statuses(rule_context)
+        end_points = output_criteria.get_end_points()
+        if len(end_points) > 1:
+            self.fan_out(data, rule_context, output_criteria, end_points,
+                         statuses)
+            return
+        status = statuses.get(delivery.DELIVERY_STATUS_PARAMETER %
+                              output_criteria.end_point_id)
+        if status in (delivery.DELIVERED, delivery.SPOOLED):
+            self.info('The data for %s was already %s.',
+                      output_criteria.end_point, status.lower())
+            return
+        position = data.tell() if hasattr(data, 'seek') else None
+        while True:
+            try:
+                self.deliver(data, rule_context, output_criteria)
+                return
+            except errors.TaskDeferredError as e:
+                self.info('%s', e)
+                self.wait_or_defer(rule_context, e)
+            except Exception as e:
+                if position is not None:
+                    data.seek(position)
+                if self.spool_dead_letter(data, rule_context,
+                                          output_criteria, e):
+                    delivery.set_delivery_status(
+                        rule_context.task_name, output_criteria.end_point,
+                        delivery.SPOOLED)
+                raise
+            if position is not None:
+                data.seek(position)
+
+    def wait_or_defer(self, rule_context: RuleContext,
+                      error: errors.TaskDeferredError):
+        '''
+        Defers the task for the error's delay.  A step that was not loaded
+        by a `ResumableRule`, such as one run by quartet_capture's
+        `execute_queued_task`, can not defer its task without the task
+        being marked FAILED, so it sleeps for the delay instead and the
+        caller sends again.
+        :raises TaskDeferredError: The error, if the task was deferred.
+        '''
+        if not scheduling.can_defer(self):
+            self.info('Waiting %.2f seconds before sending again.',
+                      error.delay)
+            time.sleep(error.delay)
+            return
+        self.info('Deferring the task for %.2f seconds.', error.delay)
+        scheduling.defer_task(rule_context.task_name, error.delay)
+        error.task_name = rule_context.task_name
+        raise error
+
+    def get_delivery_statuses(self, rule_context: RuleContext) -> dict:
+        return dict(models.TaskParameter.objects.filter(
+            task__name=rule_context.task_name,
+            name__startswith=delivery.DELIVERY_STATUS_PARAMETER % ''
+        ).values_list('name', 'value'))
+
+    def deliver(self, data, rule_context: RuleContext,
+                output_criteria: EPCISOutputCriteria):
+        '''
+        Sends the data to the criteria's end point within the end point's
+        rate and concurrency limits.
+        '''
+        # check the url/urn to see if we support the protocol
+        protocol = self._supports_protocol(output_criteria.end_point)
+        self.info('Protocol supported.  Sending message to %s.' %
+                  output_criteria.end_point.urn)
+        with scheduling.throttle(output_criteria.end_point):
+            self.send_with_retries(data, protocol, rule_context,
+                                   output_criteria)
+
+    def fan_out(self, data, rule_context: RuleContext,
+                output_criteria: EPCISOutputCriteria, end_points: list,
+                statuses: dict = None):
+        '''
+        Delivers the data to each of the end points at the same time on
+        the `quartet_output.transport.fanout` pool.  The outcome for each
+        end point is kept in a Delivery Status task parameter and end
+        points that already have the data, or whose data is in the
+        dead-letter spool, are skipped, so running the task again only
+        resends to the ones that failed or were throttled.
+        Streamed data is read into memory once so every end point gets
+        the same bytes.
+        :raises: The first delivery error after all of the deliveries have
+            finished or, if every delivery that did not succeed was
+            deferred, the `TaskDeferredError` with the longest delay once
+            the task is deferred; see `wait_or_defer`.
+        '''
+        if hasattr(data, 'read'):
+            data = data.read()
+        while True:
+            throttled = self.deliver_all(data, rule_context,
+                                         output_criteria, end_points,
+                                         statuses)
+            if throttled is None:
+                return
+            self.wait_or_defer(rule_context, throttled)
+            statuses = None
+
+    def deliver_all(self, data, rule_context: RuleContext,
+                    output_criteria: EPCISOutputCriteria, end_points: list,
+                    statuses: dict = None):
+        '''
+        Delivers the data, which has been read into memory, once to each
+        of the end points that do not have it yet; see `fan_out`.
+        :return: The `TaskDeferredError` with the longest delay if any
+            delivery was deferred, otherwise None.
+        :raises: The first delivery error.
+        '''
+        if statuses is None:
+            statuses = self.get_delivery_statuses(rule_context)
+        pending = []
+        for end_point in end_points:
+            status = statuses.get(
+                delivery.DELIVERY_STATUS_PARAMETER % end_point.pk)
+            if status == delivery.DELIVERED:
+                self.info('The data was already delivered to %s.',
+                          end_point)
+            elif status == delivery.SPOOLED:
+                self.info('The data for %s is in the dead-letter spool.',
+                          end_point)
+            else:
+                pending.append(end_point)
+        futures = [
+            (end_point, fanout.submit(
+                self.deliver, data, rule_context,
+                output_criteria.for_end_point(end_point)))
+            for end_point in pending
+        ]
+        failure = None
+        throttled = None
+        for end_point, future in futures:
+            try:
+                future.result()
+                status = delivery.DELIVERED
+            except errors.TaskDeferredError as e:
+                status = delivery.DEFERRED
+                self.info('%s', e)
+                if throttled is None or e.delay > throttled.delay:
+                    throttled = e
+            except Exception as e:
+                self.error('Delivery to %s failed: %s', end_point, e)
+                if self.spool_dead_letter(
+                    data, rule_context,
+                    output_criteria.for_end_point(end_point), e
+                ):
+                    status = delivery.SPOOLED
+                else:
+                    status = delivery.FAILED
+                failure = failure or e
+            delivery.set_delivery_status(rule_context.task_name, end_point,
+                                         status)
+        if failure:
+            raise failure
+        return throttled
+
+    def spool_dead_letter(self, data, rule_context: RuleContext,
+                          output_criteria: EPCISOutputCriteria,
+                          error: Exception) -> bool:
+        '''
+        Adds the data to the dead-letter spool if the error shows the end
+        point was unavailable and QUARTET_OUTPUT_DEAD_LETTER_DIR is set.
+        See `quartet_output.spool`.
+        :return: True if the data was spooled.
+        '''
+        dead_letters = spool.get_spool()
+        if dead_letters is None or not spool.is_dead_letter(error):
+            return False
+        if hasattr(data, 'read'):
+            data = data.read()
+        text = isinstance(data, str)
+        try:
+            dead_letters.append(
+                output_criteria.end_point.pk,
+                spool.get_header(rule_context, output_criteria,
+                                 self.parameters, text, error),
+                data.encode('utf-8') if text else data
+            )
+        except Exception as e:
+            self.error('The message could not be added to the dead-letter '
+                       'spool: %s', e)
+            return False
+        self.warning('The message was added to the dead-letter spool for '
+                     '%s and can be sent again with the replay_dead_letters '
+                     'command.', output_criteria.end_point)
+        return True
+
+    def send_with_retries(self, data, protocol: str,
+                          rule_context: RuleContext,
+                          output_criteria: EPCISOutputCriteria):
+        '''
+        Sends the message through the endpoint's circuit breaker.  A
+        failed send is retried up to `retries` times by deferring the task
+        for a jittered exponential backoff, so the worker is not held
+        while it waits; the attempts are counted in a Delivery Attempts
+        task parameter.  Errors that show the endpoint is up (4xx
+        responses) are neither retried nor counted against the endpoint.
+        :raises CircuitOpenError: If the endpoint's circuit is open.
+        :raises SendRetryError: If the send failed and will be retried.
+        '''
+        breaker = circuit.get_breaker(output_criteria.end_point.urn)
+        breaker.before_send()
+        try:
+            self._send_message(data, protocol, rule_context, output_criteria)
+        except Exception as e:
+            if not circuit.is_endpoint_failure(e):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            retries = self.get_integer_parameter('retries', 0)
+            if not retries or rule_context is None:
+                raise
+            parameter, created = models.TaskParameter.objects.get_or_create(
+                task_id=rule_context.task_name,
+                name=(delivery.DELIVERY_ATTEMPTS_PARAMETER
+                      % output_criteria.end_point.pk),
+                defaults={'value': '0',
+                          'description': 'The number of failed sends to '
+                                         '%s that were retried.' %
+                                         output_criteria.end_point.name}
+            )
+            attempt = int(parameter.value)
+            if attempt >= retries:
+                raise
+            parameter.value = str(attempt + 1)
+            parameter.save(update_fields=['value'])
+            delay = circuit.get_backoff(
+                attempt, float(self.get_parameter('retry-backoff', 1)),
+                float(self.get_parameter('retry-backoff-max', 30)))
+            raise errors.SendRetryError(
+                'Sending to %s failed (%s); retry %s of %s.' % (
+                    output_criteria.end_point.urn, e, attempt + 1, retries),
+                delay)
+        else:
+            breaker.record_success()
 
     def _send_message(
         self,
@@ -849,65 +1397,17 @@ class TransportStep(rules.Step, HttpTransportMixin, SftpTransportMixin,
         :param output_criteria: The originating output criteria.
         :return: None.
         '''
-        content_type = self.get_parameter('content-type', 'application/xml')
-        file_extension = self.get_parameter('file-extension', 'xml')
-        put_data = self.get_boolean_parameter('put-data')
-        body_raw = self.get_boolean_parameter('body-raw', True)
-        if protocol.lower() in ['http', 'https']:
-            if not put_data:
-                resp = self.post_data(
-                    data,
-                    rule_context,
-                    output_criteria,
-                    content_type,
-                    file_extension,
-                    False,
-                    body_raw
-                )
-            else:
-                resp = self.put_data(
-                    data,
-                    rule_context,
-                    output_criteria,
-                    content_type,
-                    file_extension,
-                    body_raw
-                )
-            try:
-                resp.raise_for_status()
-            except requests.exceptions.HTTPError as error:
-                self.error(error.response.text)
-                raise
-            if resp.text:
-                self.info("Response Receive: %s", resp.text)
-        elif protocol.lower() == 'sftp':
-            self.sftp_put(data,
-                          rule_context,
-                          output_criteria,
-                          content_type,
-                          file_extension)
-        elif protocol.lower() == 'mailto':
-            self.send_email(
-                data,
-                rule_context,
-                output_criteria,
-                self.info,
-                file_extension=self.get_parameter('file-extension', 'txt'),
-                mimetype=self.get_parameter('content-type', 'text/plain')
-            )
-        elif protocol.lower() == 'socket':
-            self.socket_send(
-                data,
-                rule_context,
-                output_criteria,
-                self.info
-            )
+        transport = registry.get_transport(protocol)
+        if hasattr(data, 'read') and not getattr(transport, 'streams', False):
+            data = data.read()
+        transport.send(self, data, rule_context, output_criteria)
 
     def _supports_protocol(self, endpoint: EndPoint):
         '''
         Inspects the output settings and determines if this step can support
-        the protocol or not. Override this to support another or more
-        protocols.
+        the protocol or not.  Register a transport for the scheme (see
+        `quartet_output.transport.registry`) or override this to support
+        another or more protocols.
         :param EndPoint: the endpoint to inspect
         :return: Returns the supported scheme if the protocol is supported or
         None.
@@ -915,8 +1415,7 @@ class TransportStep(rules.Step, HttpTransportMixin, SftpTransportMixin,
         parse_result = urlparse(
             endpoint.urn
         )
-        if parse_result.scheme.lower() in ['http', 'https', 'sftp', 'mailto',
-                                           'socket']:
+        if registry.get_registry().supports(parse_result.scheme):
             return parse_result.scheme
         else:
             raise errors.ProtocolNotSupportedError(_(
@@ -934,10 +1433,28 @@ class TransportStep(rules.Step, HttpTransportMixin, SftpTransportMixin,
                             'http posts, puts, etc. Default is application/'
                             'xml',
             'file-extension': 'The file extension to specify when posting and '
-                              'putting data via http. Default is xml',
+                              'putting data via http and when writing files '
+                              'to sftp and file endpoints. Default is xml',
             'body-raw': 'Whether or not the data should be sent as raw body '
                         'or file attachment.'
                         'Defaults to True.',
+            'gzip-attachment-threshold': 'Email attachments larger than this '
+                                         'number of bytes are gzipped. '
+                                         'Default is 0 (never).',
+            'content-encoding': 'gzip or deflate to compress http and https '
+                                'payloads while they are sent.  Default is '
+                                'no compression.',
+            'compression-level': 'The zlib compression level (1-9) used '
+                                 'with content-encoding.  Default is 6.',
+            'retries': 'The number of times a failed send is retried. '
+                       'Each retry defers the task for the backoff '
+                       'delay instead of waiting in the worker. Default '
+                       'is 0.',
+            'retry-backoff': 'The base delay in seconds between retries, '
+                             'doubled on each attempt and jittered. '
+                             'Default is 1.',
+            'retry-backoff-max': 'The maximum delay in seconds between '
+                                 'retries.  Default is 30.',
         }
 
 
@@ -947,8 +1464,26 @@ class DelayStep(rules.Step):
     step has a default delay setting of one second but can be configured
     to allow uo to ten seconds of delay via a Timeout Interval step
     parameter.
+
+    If the Defer step parameter is True the step does not sleep.  Instead
+    it saves the current data and context, schedules the task to run again
+    once the delay has passed and stops the rule; the remaining steps run
+    when the task is resumed (see `quartet_output.scheduling`).  This
+    frees the worker during the delay so long delays are possible.  If the
+    context holds values that can not be saved, such as the events of an
+    output parsing step, the step sleeps instead.
+    Only a step loaded by a `ResumableRule` can be deferred; under other
+    rules, such as the one quartet_capture's `execute_queued_task` runs,
+    the step sleeps (see `scheduling.can_defer`).
     """
 
+    def get_order(self):
+        """
+        :return: The order of this step within its rule, which is set by
+            the `ResumableRule` that loads it, or None.
+        """
+        return getattr(self, 'step_order', None)
+
     def execute(self, data, rule_context: RuleContext):
         self.info('Checking for the Timeout Interval step parameter. '
                   'The default is 1 second.  The parameter value is '
@@ -958,16 +1493,48 @@ class DelayStep(rules.Step):
         )
         # if it comes from the database it will be a string
         timeout_interval = int(timeout_interval)
+        if timeout_interval > 0 and self.get_boolean_parameter('Defer',
+                                                               False):
+            order = self.get_order()
+            context, skipped = scheduling.dump_context(rule_context.context)
+            if not scheduling.can_defer(self):
+                self.warning('The step was not loaded by a ResumableRule so '
+                             'it can not be deferred.')
+            elif skipped:
+                self.warning('The context values %s can not be saved so the '
+                             'step can not be deferred.', ', '.join(skipped))
+            else:
+                self.defer(data, rule_context, timeout_interval, order,
+                           context)
         self.info(
             'Sleeping the thread for %s seconds...' % timeout_interval)
         if timeout_interval > 0:
             time.sleep(timeout_interval)
 
+    def defer(self, data, rule_context: RuleContext, timeout_interval: int,
+              order: int, context: str):
+        """
+        :param context: The rule context as returned by
+            `scheduling.dump_context`.
+        """
+        scheduling.save_resume_point(rule_context.task_name, order, data,
+                                     context)
+        scheduling.defer_task(rule_context.task_name, timeout_interval)
+        self.info('Deferring the remaining steps for %s seconds.',
+                  timeout_interval)
+        raise errors.TaskDeferredError(
+            'The task was deferred for %s seconds by step %s.' % (
+                timeout_interval, order), timeout_interval,
+            rule_context.task_name)
+
     @property
     def declared_parameters(self):
         return {
             'Timeout Interval': 'The amount of time in seconds to pause the '
-                                'rule.'
+                                'rule.',
+            'Defer': 'Whether or not to stop the rule and resume the task '
+                     'once the Timeout Interval has passed instead of '
+                     'sleeping.  Default is False.'
         }
 
     def on_failure(self):
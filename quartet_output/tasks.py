@@ -0,0 +1,53 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from celery import shared_task
+from quartet_capture import models
+
+from quartet_output import batching, delivery
+
+
+@shared_task(name='execute_output_task')
+def execute_output_task(task_name: str):
+    """
+    Runs an output task queued by `delivery.queue_task`.  Unlike
+    quartet_capture's `execute_queued_task` the task's rule is a
+    `ResumableRule`, so a task that is deferred goes back to QUEUED; see
+    `delivery.execute_task`.
+    :param task_name: The name of the task.
+    """
+    db_task = models.Task.objects.get(name=task_name)
+    db_task.status = 'RUNNING'
+    db_task.save()
+    delivery.execute_task(db_task)
+    db_task.save()
+
+
+@shared_task(name='execute_deferred_task')
+def execute_deferred_task(task_name: str):
+    """
+    Runs a task that was deferred by `quartet_output.scheduling.defer_task`
+    and resumes its rule where the deferred run stopped.
+    :param task_name: The name of the task.
+    """
+    execute_output_task(task_name)
+
+
+@shared_task(name='flush_output_batch')
+def flush_output_batch(criteria_id: int, output_rule: str):
+    """
+    Sends the batched messages for the criteria and output rule; see
+    `quartet_output.batching`.
+    """
+    batching.flush(criteria_id, output_rule)
@@ -0,0 +1,170 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import os
+from logging import getLogger
+from threading import Lock
+
+from django.conf import settings
+from EPCPyYes.core.v1_2 import template_events
+from jinja2 import BaseLoader, ChoiceLoader, Environment, \
+    FileSystemBytecodeCache, PackageLoader, PrefixLoader, TemplateNotFound
+from quartet_templates.models import Template
+
+logger = getLogger(__name__)
+
+EPCPYYES_TEMPLATES = ('EPCPyYes', 'templates')
+QUARTET_TEMPLATE_PREFIX = 'quartet'
+QUARTET_TEMPLATE_DELIMITER = ':'
+
+_environment = None
+_environment_lock = Lock()
+
+
+class QuartetTemplateLoader(BaseLoader):
+    """
+    Loads `quartet_templates.models.Template` instances by name so that
+    they can be compiled and cached by a jinja2 Environment like any other
+    template on the file system.  Templates are re-checked against the
+    database each time they are requested so edits made through the API or
+    the UI are picked up by running workers.
+    """
+
+    def get_source(self, environment, template):
+        try:
+            content = Template.objects.values_list(
+                'content', flat=True).get(name=template)
+        except Template.DoesNotExist:
+            raise TemplateNotFound(template)
+
+        def uptodate():
+            return Template.objects.filter(
+                name=template, content=content).exists()
+
+        return content, None, uptodate
+
+    def list_templates(self):
+        return sorted(Template.objects.values_list('name', flat=True))
+
+
+def quartet_template_name(name: str) -> str:
+    """
+    Returns the name a QU4RTET Template is registered under within the
+    shared environment.
+    :param name: The name of the `quartet_templates.models.Template`.
+    :return: The prefixed template name.
+    """
+    return '%s%s%s' % (QUARTET_TEMPLATE_PREFIX, QUARTET_TEMPLATE_DELIMITER,
+                       name)
+
+
+def list_epcpyyes_templates():
+    """
+    :return: The names of the default templates shipped with EPCPyYes.
+    """
+    return PackageLoader(*EPCPYYES_TEMPLATES).list_templates()
+
+
+def get_bytecode_cache():
+    """
+    Returns the on-disk bytecode cache configured by the
+    `QUARTET_OUTPUT_BYTECODE_CACHE` and `QUARTET_OUTPUT_BYTECODE_CACHE_DIR`
+    settings.  If no directory is configured, the jinja2 default (a per-user
+    directory in the system temp folder) is used.
+    :return: A `jinja2.FileSystemBytecodeCache` or None if disabled.
+    """
+    if not getattr(settings, 'QUARTET_OUTPUT_BYTECODE_CACHE', True):
+        return None
+    directory = getattr(settings, 'QUARTET_OUTPUT_BYTECODE_CACHE_DIR', None)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return FileSystemBytecodeCache(directory)
+
+
+def create_environment() -> Environment:
+    """
+    Creates a jinja2 Environment with the same settings EPCPyYes uses for
+    its default templates along with a loader for QU4RTET Templates and the
+    configured bytecode cache.
+    :return: A new Environment.
+    """
+    return Environment(
+        loader=ChoiceLoader([
+            PackageLoader(*EPCPYYES_TEMPLATES),
+            PrefixLoader({QUARTET_TEMPLATE_PREFIX: QuartetTemplateLoader()},
+                         delimiter=QUARTET_TEMPLATE_DELIMITER)
+        ]),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        bytecode_cache=get_bytecode_cache()
+    )
+
+
+def get_environment() -> Environment:
+    """
+    Returns the process-wide Environment, creating it on first use.  Sharing
+    one Environment means each template is compiled (or loaded from the
+    bytecode cache) once per process instead of once per EPCPyYes event.
+    :return: The shared Environment.
+    """
+    global _environment
+    if _environment is None:
+        with _environment_lock:
+            if _environment is None:
+                _environment = create_environment()
+    return _environment
+
+
+def reset_environment():
+    """
+    Discards the shared Environment so that the next call to
+    `get_environment` picks up any changed settings.
+    """
+    global _environment
+    with _environment_lock:
+        _environment = None
+
+
+def install_default_environment():
+    """
+    Points EPCPyYes at the shared Environment so that template events and
+    documents created anywhere in the process use it instead of building
+    (and compiling templates into) a fresh Environment per instance.
+    """
+    if hasattr(template_events, '_load_default_environment'):
+        template_events._load_default_environment = get_environment
+    else:
+        logger.warning('The installed version of EPCPyYes does not expose '
+                       'a default environment loader; the shared template '
+                       'environment will only be used by quartet_output.')
+
+
+def load_quartet_template(name: str, env: Environment = None):
+    """
+    Loads a QU4RTET Template through the Environment so the compiled
+    template is cached.  Environments that were not created by this
+    module do not know about QU4RTET Templates, in which case the template
+    content is compiled directly.
+    :param name: The name of the `quartet_templates.models.Template`.
+    :param env: The Environment to use.  Defaults to the shared one.
+    :return: A jinja2 Template.
+    """
+    env = env or get_environment()
+    if env.loader is not None:
+        try:
+            return env.get_template(quartet_template_name(name))
+        except TemplateNotFound:
+            pass
+    template_model = Template.objects.get(name=name)
+    return env.from_string(template_model.content)
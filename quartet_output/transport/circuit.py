@@ -0,0 +1,170 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+Per-endpoint health tracking.  Each endpoint urn gets a `CircuitBreaker`
+that opens after `failure_threshold` consecutive failed sends.  While the
+breaker is open, sends to the endpoint fail right away with a
+`CircuitOpenError` instead of waiting for connection timeouts, and the
+task is deferred until the breaker lets a probe through.  After
+`reset_timeout` seconds the breaker is half-open: a single probe send is
+let through and, if it succeeds, the breaker closes and delivery
+resumes.  If the probe fails the breaker opens again.
+
+Breakers are kept per process and are off unless the
+QUARTET_OUTPUT_CIRCUIT_FAILURE_THRESHOLD setting is greater than 0.
+"""
+import random
+import time
+from logging import getLogger
+from threading import Lock
+
+from django.conf import settings
+
+from quartet_output.errors import CircuitOpenError, EndPointThrottledError
+
+logger = getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """
+    Tracks the consecutive failures of a single endpoint.
+    :param name: The endpoint the breaker guards; used in messages.
+    :param failure_threshold: The number of consecutive failures that open
+        the breaker.  0 never opens it.
+    :param reset_timeout: Seconds the breaker stays open before a probe is
+        allowed.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 0,
+                 reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def before_send(self):
+        """
+        Call before each send.
+        :raises CircuitOpenError: If the breaker is open or another send
+            is already probing the half-open endpoint.
+        """
+        with self._lock:
+            state = self.state
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and not self._probing:
+                logger.info('Probing %s after %s failures.', self.name,
+                            self.failures)
+                self._probing = True
+                return
+            if state == OPEN:
+                elapsed = time.monotonic() - self.opened_at
+                delay = self.reset_timeout - elapsed
+            else:
+                # another send is probing the endpoint
+                delay = self.reset_timeout
+        raise CircuitOpenError(
+            'The circuit for %s is open after %s consecutive failures; '
+            'the message was not sent.' % (self.name, self.failures),
+            max(0, delay))
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info('Closing the circuit for %s.', self.name)
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            threshold = self.failure_threshold
+            if self._probing or (threshold and self.failures >= threshold):
+                if self.opened_at is None:
+                    logger.warning('Opening the circuit for %s after %s '
+                                   'failures.', self.name, self.failures)
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """
+    :return: False for errors that show the endpoint is up, such as a 4xx
+        http response, and True for everything else.
+    """
+    if isinstance(error, (CircuitOpenError, EndPointThrottledError)):
+        return False
+    # requests' HTTPError carries the response; checked by attribute so
+    # that requests is not imported for transports that do not use it
+    status_code = getattr(getattr(error, 'response', None), 'status_code',
+                          None)
+    if status_code is not None:
+        return status_code >= 500
+    return True
+
+
+def get_backoff(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """
+    :return: A random delay between 0 and base * 2 ** attempt seconds,
+        limited to cap ("full jitter"), so that retries from many
+        workers do not arrive at the endpoint at the same time.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+_breakers = {}
+_breakers_lock = Lock()
+
+
+def get_breaker(urn: str) -> CircuitBreaker:
+    """
+    :return: The process wide breaker for the endpoint urn configured by
+        the QUARTET_OUTPUT_CIRCUIT_FAILURE_THRESHOLD and
+        QUARTET_OUTPUT_CIRCUIT_RESET_TIMEOUT settings.
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(urn)
+        if breaker is None:
+            breaker = _breakers[urn] = CircuitBreaker(
+                urn,
+                getattr(settings, 'QUARTET_OUTPUT_CIRCUIT_FAILURE_THRESHOLD',
+                        0),
+                getattr(settings, 'QUARTET_OUTPUT_CIRCUIT_RESET_TIMEOUT', 30)
+            )
+        return breaker
+
+
+def reset_breakers():
+    """
+    Forgets the health of every endpoint.
+    """
+    with _breakers_lock:
+        _breakers.clear()
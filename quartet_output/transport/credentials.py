@@ -0,0 +1,127 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+Caches the parsed SSH keys and `requests` auth objects built from
+`AuthenticationInfo` records.  Entries are keyed by the record's primary
+key and a hash of its credentials so an edit made in another process is
+never served stale, and they are dropped as soon as the record is saved
+or deleted in this process.  The least recently used entry is evicted
+once the cache holds QUARTET_OUTPUT_CREDENTIAL_CACHE_SIZE entries.
+"""
+import hashlib
+import typing
+from collections import OrderedDict
+from io import StringIO
+from threading import Lock
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from requests.auth import HTTPBasicAuth, HTTPProxyAuth
+
+from quartet_output.models import AuthenticationInfo
+
+if typing.TYPE_CHECKING:
+    import paramiko
+
+# the order in which private key formats are tried; paramiko is only
+# imported once a key is parsed
+PRIVATE_KEY_CLASSES = ('RSAKey', 'Ed25519Key', 'ECDSAKey')
+
+_cache = OrderedDict()
+_lock = Lock()
+
+
+def get_content_hash(auth_info: AuthenticationInfo) -> str:
+    return hashlib.sha256('\0'.join(
+        value or '' for value in (auth_info.type, auth_info.username,
+                                  auth_info.password, auth_info.private_key)
+    ).encode()).hexdigest()
+
+
+def _get_or_create(auth_info: AuthenticationInfo, kind: str, create):
+    key = (auth_info.pk, kind, get_content_hash(auth_info))
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    value = create(auth_info)
+    max_size = getattr(settings, 'QUARTET_OUTPUT_CREDENTIAL_CACHE_SIZE', 128)
+    with _lock:
+        if auth_info.pk is not None and max_size > 0:
+            _cache[key] = value
+            _cache.move_to_end(key)
+            while len(_cache) > max_size:
+                _cache.popitem(last=False)
+    return value
+
+
+def parse_private_key(private_key: str) -> 'paramiko.PKey':
+    """
+    Parses an RSA, Ed25519 or ECDSA private key in PEM or OpenSSH format.
+    :param private_key: The private key text.
+    :return: A paramiko key.
+    """
+    import paramiko
+    for key_class_name in PRIVATE_KEY_CLASSES:
+        key_class = getattr(paramiko, key_class_name)
+        try:
+            return key_class.from_private_key(StringIO(private_key))
+        except (paramiko.SSHException, ValueError):
+            continue
+    raise paramiko.SSHException('The private key is not a supported RSA, '
+                                'Ed25519 or ECDSA key.')
+
+
+def get_private_key(auth_info: AuthenticationInfo) -> 'paramiko.PKey':
+    """
+    :return: The parsed private key of the `AuthenticationInfo`.
+    """
+    return _get_or_create(
+        auth_info, 'pkey',
+        lambda auth_info: parse_private_key(auth_info.private_key))
+
+
+def create_http_auth(auth_info: AuthenticationInfo):
+    auth_type = auth_info.type or ''
+    if 'proxy' in auth_type.lower():
+        auth = HTTPProxyAuth
+    else:
+        auth = HTTPBasicAuth
+    return auth(auth_info.username, auth_info.password)
+
+
+def get_http_auth(auth_info: AuthenticationInfo):
+    """
+    :return: A `requests` auth object for the `AuthenticationInfo`.
+    """
+    return _get_or_create(auth_info, 'http', create_http_auth)
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+@receiver(post_save, sender=AuthenticationInfo)
+@receiver(post_delete, sender=AuthenticationInfo)
+def invalidate(sender, instance, **kwargs):
+    """
+    Drops every cached credential of a saved or deleted
+    `AuthenticationInfo`.
+    """
+    with _lock:
+        for key in [key for key in _cache if key[0] == instance.pk]:
+            del _cache[key]
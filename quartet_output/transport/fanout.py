@@ -0,0 +1,68 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+The thread pool the `TransportStep` uses to deliver one message to the
+several endpoints of an output criteria at the same time.  The pool is
+shared by every task in the process and its size is set with the
+QUARTET_OUTPUT_FANOUT_WORKERS setting (default 8).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    getattr(settings, 'QUARTET_OUTPUT_FANOUT_WORKERS', 8),
+                    thread_name_prefix='quartet-output-fanout'
+                )
+    return _executor
+
+
+def _run(function, *args):
+    try:
+        return function(*args)
+    finally:
+        # each pool thread has its own database connection; keep it only
+        # as long as CONN_MAX_AGE allows
+        close_old_connections()
+
+
+def submit(function, *args):
+    """
+    Runs the function on the pool.
+    :return: A `concurrent.futures.Future`.
+    """
+    return get_executor().submit(_run, function, *args)
+
+
+def shutdown_executor():
+    """
+    Waits for running deliveries and discards the pool.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
@@ -0,0 +1,300 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+Writes outbound messages into a local or mounted directory given by a
+file:// urn, for example `file:///mnt/partner/inbound`.
+
+Each message is written to a hidden temporary file in the target
+directory and renamed into place once it is complete, so a partner
+collecting files never sees a partial one.
+
+How the data is flushed to disk is set with QUARTET_OUTPUT_FILE_FSYNC:
+
+* `always` (the default) syncs each file before it is renamed and its
+  directory after.
+* `group` lets concurrent senders share commits.  One sender at a time
+  syncs and renames the files of every sender waiting at that moment
+  and syncs each directory once; the senders that arrive while it does
+  so are committed together by the next one.  On Linux the files are
+  synced with a single syncfs(2) call per filesystem rather than one
+  fdatasync each; syncfs also flushes anything else written to that
+  filesystem, so it suits a directory on its own mount.  Setting
+  QUARTET_OUTPUT_FILE_GROUP_COMMIT_WINDOW makes each commit wait that
+  many seconds first to collect more files.
+* `never` leaves flushing to the operating system.
+"""
+import ctypes
+import ctypes.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+from logging import getLogger
+from threading import Condition, Lock
+from urllib.parse import unquote, urlparse
+
+from django.conf import settings
+from quartet_capture.rules import RuleContext
+
+from quartet_output.models import EPCISOutputCriteria
+from quartet_output.transport import registry
+
+logger = getLogger(__name__)
+
+ALWAYS = 'always'
+GROUP = 'group'
+NEVER = 'never'
+
+
+class _PendingFile:
+
+    def __init__(self, file, path: str):
+        self.file = file
+        self.path = path
+        self.done = False
+        self.error = None
+
+
+def fsync_directory(directory: str):
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def load_syncfs():
+    """
+    :return: A function that calls syncfs(2) with a file descriptor or
+        None if the platform does not have it.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        syncfs = ctypes.CDLL(ctypes.util.find_library('c'),
+                             use_errno=True).syncfs
+    except (OSError, AttributeError):
+        return None
+    syncfs.argtypes = [ctypes.c_int]
+
+    def call(descriptor: int):
+        if syncfs(descriptor) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+    return call
+
+
+_syncfs = load_syncfs()
+
+
+def _discard(pending: _PendingFile):
+    pending.file.close()
+    os.unlink(pending.file.name)
+
+
+def _commit(pending: _PendingFile, sync: bool):
+    try:
+        if sync:
+            pending.file.flush()
+            os.fdatasync(pending.file.fileno())
+        pending.file.close()
+        os.replace(pending.file.name, pending.path)
+    except BaseException:
+        _discard(pending)
+        raise
+
+
+class GroupCommit:
+    """
+    Syncs and renames the files written by concurrent senders together.
+    :param window: Seconds a commit waits for more files before it starts.
+    """
+
+    def __init__(self, window: float = 0):
+        self.window = window
+        self.commits = 0
+        self._condition = Condition(Lock())
+        self._pending = []
+        self._leader = False
+
+    def commit(self, pending: _PendingFile):
+        with self._condition:
+            self._pending.append(pending)
+            while self._leader and not pending.done:
+                self._condition.wait()
+            if pending.done:
+                if pending.error:
+                    raise pending.error
+                return
+            self._leader = True
+        batch = []
+        try:
+            if self.window:
+                time.sleep(self.window)
+            with self._condition:
+                batch, self._pending = self._pending, []
+            self._sync(batch)
+        finally:
+            with self._condition:
+                for item in batch:
+                    item.done = True
+                self._leader = False
+                self._condition.notify_all()
+        if pending.error:
+            raise pending.error
+
+    def _sync(self, batch: list):
+        if _syncfs is None:
+            committed = []
+            for item in batch:
+                try:
+                    _commit(item, True)
+                    committed.append(item)
+                except Exception as e:
+                    item.error = e
+        else:
+            committed = self._sync_filesystems(batch)
+        directories = set(os.path.dirname(item.path) for item in committed)
+        for directory in directories:
+            try:
+                fsync_directory(directory)
+            except Exception as e:
+                for item in batch:
+                    if os.path.dirname(item.path) == directory:
+                        item.error = item.error or e
+        self.commits += 1
+
+    def _sync_filesystems(self, batch: list) -> list:
+        """
+        Syncs each filesystem the batch was written to once and renames
+        the files that were synced.
+        :return: The items that were committed.
+        """
+        filesystems = {}
+        for item in batch:
+            try:
+                item.file.flush()
+                device = os.fstat(item.file.fileno()).st_dev
+                filesystems.setdefault(device, []).append(item)
+            except Exception as e:
+                item.error = e
+                _discard(item)
+        committed = []
+        for items in filesystems.values():
+            try:
+                _syncfs(items[0].file.fileno())
+            except Exception as e:
+                for item in items:
+                    item.error = e
+                    _discard(item)
+                continue
+            for item in items:
+                try:
+                    _commit(item, False)
+                    committed.append(item)
+                except Exception as e:
+                    item.error = e
+        return committed
+
+
+_group_commit = None
+_group_commit_lock = Lock()
+
+
+def get_group_commit() -> GroupCommit:
+    """
+    :return: The process wide `GroupCommit` configured by the
+        QUARTET_OUTPUT_FILE_GROUP_COMMIT_WINDOW setting.
+    """
+    global _group_commit
+    if _group_commit is None:
+        with _group_commit_lock:
+            if _group_commit is None:
+                _group_commit = GroupCommit(getattr(
+                    settings, 'QUARTET_OUTPUT_FILE_GROUP_COMMIT_WINDOW',
+                    0))
+    return _group_commit
+
+
+def write_atomic(directory: str, file_name: str, data,
+                 fsync: str = ALWAYS) -> str:
+    """
+    Writes the data to a temporary file in the directory and renames it
+    to the file name once it is complete.
+    :param data: A string, bytes or a binary file-like object.
+    :param fsync: always, group or never; see the module documentation.
+    :return: The path of the file.
+    """
+    path = os.path.join(directory, file_name)
+    temp_file = tempfile.NamedTemporaryFile(
+        dir=directory, prefix='.%s.' % file_name, suffix='.part',
+        delete=False)
+    pending = _PendingFile(temp_file, path)
+    try:
+        if hasattr(data, 'read'):
+            shutil.copyfileobj(data, temp_file)
+        else:
+            temp_file.write(data.encode('utf-8') if isinstance(data, str)
+                            else data)
+    except BaseException:
+        temp_file.close()
+        os.unlink(temp_file.name)
+        raise
+    if fsync == GROUP:
+        get_group_commit().commit(pending)
+    else:
+        _commit(pending, fsync == ALWAYS)
+        if fsync == ALWAYS:
+            fsync_directory(directory)
+    return path
+
+
+class FileTransportMixin:
+    """
+    Writes messages into the directory of a file:// endpoint.
+    """
+
+    def file_put(self, data, rule_context: RuleContext,
+                 output_criteria: EPCISOutputCriteria,
+                 file_extension='xml') -> str:
+        """
+        :param data: The data to write.
+        :param rule_context: The rule context; the file is named after its
+            task.
+        :param output_criteria: The output criteria supplying the urn.
+        :param file_extension: The extension of the file.
+        :return: The path of the file written.
+        """
+        directory = unquote(urlparse(output_criteria.end_point.urn).path)
+        file_name = '{0}.{1}'.format(rule_context.task_name, file_extension)
+        return write_atomic(
+            directory, file_name, data,
+            getattr(settings, 'QUARTET_OUTPUT_FILE_FSYNC', ALWAYS))
+
+
+class FileTransport(FileTransportMixin):
+    """
+    The file transport of the `TransportStep`.  Uses the step's
+    file-extension parameter.
+    """
+    streams = True
+
+    def send(self, step, data, rule_context: RuleContext,
+             output_criteria: EPCISOutputCriteria):
+        sender = registry.get_sender(self, step, FileTransportMixin)
+        path = sender.file_put(data, rule_context, output_criteria,
+                               step.get_parameter('file-extension', 'xml'))
+        step.info('Wrote the message to %s.', path)
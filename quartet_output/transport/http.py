@@ -13,22 +13,197 @@
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 from quartet_capture import models
+import io
+import os
+import time
+import uuid
+import zlib
 from io import StringIO
 from logging import getLogger
 import requests
-from requests.auth import HTTPBasicAuth, HTTPDigestAuth, HTTPProxyAuth
 from quartet_output.models import EndPoint, EPCISOutputCriteria
 from quartet_capture.rules import Step, RuleContext
 from quartet_output import __version__
+from quartet_output.errors import ContentEncodingNotSupportedError
+from quartet_output.transport.credentials import get_http_auth
+from quartet_output.transport import registry, sessions
 logger = getLogger(__name__)
 
 user_agent = 'quartet-output/{0}'.format(
     __version__
 )
 
+CHUNK_SIZE = 64 * 1024
+
+# zlib window bits for each supported HTTP content-coding; HTTP's deflate
+# is the zlib format rather than a raw deflate stream
+CONTENT_ENCODINGS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+def is_stream(data) -> bool:
+    """
+    :return: True if the data is a file-like object or an iterator of
+        chunks rather than a string or bytes held in memory.
+    """
+    if hasattr(data, 'read'):
+        return True
+    return hasattr(data, '__iter__') and not isinstance(
+        data, (str, bytes, bytearray, dict, list, tuple))
+
+
+def get_stream_size(data):
+    """
+    :return: The number of bytes left in a seekable binary file-like
+        object or None if the size can not be known up front.
+    """
+    if not hasattr(data, 'read') or isinstance(data, io.TextIOBase):
+        return None
+    try:
+        position = data.tell()
+        end = data.seek(0, os.SEEK_END)
+        data.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return end - position
+
+
+def iter_chunks(data, chunk_size: int = CHUNK_SIZE):
+    """
+    Yields the data of a file-like object or iterator as byte chunks.
+    """
+    chunks = data
+    if hasattr(data, 'read'):
+        chunks = iter(lambda: data.read(chunk_size), data.read(0))
+    for chunk in chunks:
+        yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+def iter_slices(data, chunk_size: int = CHUNK_SIZE):
+    """
+    Yields a string or bytes in chunks without copying it as a whole.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        data = memoryview(data)
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        yield chunk.tobytes() if isinstance(chunk, memoryview) else chunk
+
+
+class CompressionStatistics:
+    """
+    Counts the bytes that went into and came out of a compressor and the
+    time it took.
+    """
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    @property
+    def ratio(self):
+        return self.bytes_in / self.bytes_out if self.bytes_out else 0.0
+
+    def __str__(self):
+        return '%s bytes compressed to %s bytes (%.1fx) in %.3f seconds' % (
+            self.bytes_in, self.bytes_out, self.ratio, self.seconds)
+
+
+def compress_chunks(chunks, encoding: str, level: int = 6,
+                    statistics: CompressionStatistics = None):
+    """
+    Compresses byte chunks as they are read so that the compressed body
+    is never held in memory as a whole.
+    :param chunks: An iterable of byte chunks.
+    :param encoding: gzip or deflate.
+    :param level: The zlib compression level from 1 to 9.
+    :param statistics: An optional `CompressionStatistics` to update.
+    """
+    try:
+        wbits = CONTENT_ENCODINGS[encoding.lower()]
+    except KeyError:
+        raise ContentEncodingNotSupportedError(
+            'The content-encoding %s is not supported.  Use one of %s.' % (
+                encoding, ', '.join(CONTENT_ENCODINGS)))
+    return _compress(chunks, zlib.compressobj(level, zlib.DEFLATED, wbits),
+                     statistics or CompressionStatistics())
+
+
+def _compress(chunks, compressor, statistics: CompressionStatistics):
+    for chunk in chunks:
+        start = time.perf_counter()
+        compressed = compressor.compress(chunk)
+        statistics.seconds += time.perf_counter() - start
+        statistics.bytes_in += len(chunk)
+        statistics.bytes_out += len(compressed)
+        if compressed:
+            yield compressed
+    start = time.perf_counter()
+    compressed = compressor.flush()
+    statistics.seconds += time.perf_counter() - start
+    statistics.bytes_out += len(compressed)
+    yield compressed
+
+
+class StreamingBody:
+    """
+    A request body that is sent chunk by chunk.  If the length is known,
+    `requests` sends it as the Content-Length, otherwise the body is sent
+    with chunked transfer encoding.
+    :param chunks: An iterable of byte chunks.
+    :param length: The total number of bytes or None.
+    """
+
+    def __init__(self, chunks, length: int = None):
+        self.chunks = chunks
+        if length is not None:
+            self.len = length
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+def create_streaming_body(data, file_name: str, content_type: str,
+                          body_raw=True) -> tuple:
+    """
+    Wraps a file-like object or iterator so that it can be sent without
+    reading all of it into memory.  If body_raw is False, the data is sent
+    as the `file` field of a multipart/form-data body.
+    :return: A (body, content_type) tuple.
+    """
+    size = get_stream_size(data)
+    chunks = iter_chunks(data)
+    if body_raw:
+        return StreamingBody(chunks, size), content_type
+    boundary = uuid.uuid4().hex
+    head = (
+        '--{0}\r\nContent-Disposition: form-data; name="file"; '
+        'filename="{1}"\r\nContent-Type: {2}\r\n\r\n'.format(
+            boundary, file_name, content_type)
+    ).encode('utf-8')
+    tail = '\r\n--{0}--\r\n'.format(boundary).encode('utf-8')
+
+    def multipart():
+        yield head
+        yield from chunks
+        yield tail
+
+    return (
+        StreamingBody(multipart(), None if size is None else
+                      len(head) + size + len(tail)),
+        'multipart/form-data; boundary={0}'.format(boundary)
+    )
+
+
 class HttpTransportMixin:
     '''
-    Add to steps that need to support sending http messages.
+    Add to steps that need to support sending http messages.  Messages
+    are sent using the keep-alive sessions in
+    `quartet_output.transport.sessions` so connections to an endpoint are
+    reused between tasks.
     '''
 
     def post_data(self, data: str, rule_context: RuleContext,
@@ -36,7 +211,10 @@ class HttpTransportMixin:
                   content_type='application/xml',
                   file_extension='xml',
                   http_put=False,
-                  body_raw=True):
+                  body_raw=True,
+                  content_encoding=None,
+                  compression_level=6,
+                  statistics: CompressionStatistics = None):
         '''
         :param data_context_key: The key within the rule_context that contains
          the data to post.  If being invoked from the internals of this
@@ -45,7 +223,16 @@ class HttpTransportMixin:
         :param output_criteria: The output criteria containing the connection
         info.
         :param body_raw: Whether or not the data should be sent as raw body. Defaults to True.
+        :param content_encoding: gzip or deflate to compress the body while
+            it is being sent.  Defaults to None (no compression).
+        :param compression_level: The zlib compression level.
+        :param statistics: A `CompressionStatistics` instance that is
+            updated with the compression results.
         :return: The response.
+
+        The data may also be a file-like object or an iterator of chunks, in
+        which case it is streamed to the endpoint rather than read into
+        memory; see `create_streaming_body`.
         '''
         data_stream = data
         file_name = '{0}.{1}'.format(rule_context.task_name, file_extension)
@@ -54,42 +241,73 @@ class HttpTransportMixin:
                      output_criteria.end_point.urn,
                      file_name,
                      file_extension)
-        if not http_put:
-            func = requests.post
-            if body_raw:
-                files = data_stream
-            else:
-                files = {'file': data_stream}
-        else:
-            func = requests.put
-            file_name = '{0}.{1}'.format(rule_context.task_name,
-                                         file_extension)
-            if body_raw:
-                files = data_stream
-            else:
-                files = {'file': (file_name, data_stream)}
-        response = func(
+        with sessions.session(
             output_criteria.end_point.urn,
-            files,
-            auth=self.get_auth(output_criteria),
-            headers={'content-type': content_type, 'user-agent': user_agent}
-        )
-        return response
+            output_criteria.authentication_info
+        ) as session:
+            if content_encoding or is_stream(data):
+                if not is_stream(data):
+                    data = iter_slices(data)
+                body, content_type = create_streaming_body(
+                    data, file_name, content_type, body_raw)
+                headers = {'content-type': content_type,
+                           'user-agent': user_agent}
+                if content_encoding:
+                    body = StreamingBody(compress_chunks(
+                        body, content_encoding, compression_level, statistics))
+                    headers['content-encoding'] = content_encoding.lower()
+                func = session.put if http_put else session.post
+                return func(
+                    output_criteria.end_point.urn,
+                    body,
+                    auth=self.get_auth(output_criteria),
+                    headers=headers
+                )
+            if not http_put:
+                func = session.post
+                if body_raw:
+                    files = data_stream
+                else:
+                    files = {'file': data_stream}
+            else:
+                func = session.put
+                file_name = '{0}.{1}'.format(rule_context.task_name,
+                                             file_extension)
+                if body_raw:
+                    files = data_stream
+                else:
+                    files = {'file': (file_name, data_stream)}
+            response = func(
+                output_criteria.end_point.urn,
+                files,
+                auth=self.get_auth(output_criteria),
+                headers={'content-type': content_type,
+                         'user-agent': user_agent}
+            )
+            return response
 
     def put_data(self, data: str, rule_context: RuleContext,
                  output_criteria: EPCISOutputCriteria,
                  content_type='application/xml',
                  file_exension='xml',
-                 body_raw=True):
+                 body_raw=True,
+                 content_encoding=None,
+                 compression_level=6,
+                 statistics: CompressionStatistics = None):
         '''
         :param data: The data to PUT.
         :param output_criteria: The output criteria containing the connection
         info.
         :param body_raw: Whether or not the data should be sent as raw body. Defaults to True.
+        :param content_encoding: gzip or deflate; see `post_data`.
         :return: The response.
         '''
         return self.post_data(data, rule_context, output_criteria,
-                              content_type, file_exension, http_put=True, body_raw=body_raw)
+                              content_type, file_exension, http_put=True,
+                              body_raw=body_raw,
+                              content_encoding=content_encoding,
+                              compression_level=compression_level,
+                              statistics=statistics)
 
     def get_auth(self, output_criteria):
         """
@@ -99,14 +317,45 @@ class HttpTransportMixin:
         :return: A `requests.auth.HTTPBasicAuth` or `HTTPProxyAuth`
         """
         auth_info = output_criteria.authentication_info
-        auth = None
         if auth_info:
-            auth_type = auth_info.type or ''
-            if 'digest' in auth_type.lower():
-                auth = HTTPBasicAuth
-            elif 'proxy' in auth_type.lower():
-                auth = HTTPProxyAuth
-            else:
-                auth = HTTPBasicAuth
-            auth = auth(auth_info.username, auth_info.password)
-        return auth
+            return get_http_auth(auth_info)
+        return None
+
+
+class HttpTransport(HttpTransportMixin):
+    '''
+    The http and https transport of the `TransportStep`.  Uses the step's
+    content-type, file-extension, put-data, body-raw, content-encoding and
+    compression-level parameters.
+    '''
+    streams = True
+
+    def send(self, step: Step, data, rule_context: RuleContext,
+             output_criteria: EPCISOutputCriteria):
+        content_type = step.get_parameter('content-type', 'application/xml')
+        file_extension = step.get_parameter('file-extension', 'xml')
+        content_encoding = step.get_parameter('content-encoding', None)
+        statistics = CompressionStatistics()
+        sender = registry.get_sender(self, step, HttpTransportMixin)
+        resp = sender.post_data(
+            data,
+            rule_context,
+            output_criteria,
+            content_type,
+            file_extension,
+            step.get_boolean_parameter('put-data'),
+            step.get_boolean_parameter('body-raw', True),
+            content_encoding,
+            step.get_integer_parameter('compression-level', 6),
+            statistics
+        )
+        if content_encoding:
+            step.info('Content-encoding %s: %s.', content_encoding,
+                      statistics)
+        try:
+            resp.raise_for_status()
+        except requests.exceptions.HTTPError as error:
+            step.error(error.response.text)
+            raise
+        if resp.text:
+            step.info("Response Receive: %s", resp.text)
@@ -12,12 +12,152 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 # Copyright 2019 SerialLab Corp.  All rights reserved.
+import gzip
+import select
+import smtplib
+import time
+from logging import getLogger
+from threading import Lock
 from urllib.parse import urlparse, parse_qsl
 
+from django.conf import settings
+from django.core import mail
 from django.core.mail import EmailMessage
 
 from quartet_capture.rules import RuleContext
 from quartet_output.models import EPCISOutputCriteria
+from quartet_output.transport import registry
+
+logger = getLogger(__name__)
+
+_connection = None
+_last_used = 0
+_connection_lock = Lock()
+
+
+def get_connection():
+    """
+    :return: The process wide Django mail connection.  The connection is
+        opened when the first message is sent and kept open for the
+        messages that follow it.
+    """
+    global _connection
+    if _connection is None:
+        with _connection_lock:
+            if _connection is None:
+                _connection = mail.get_connection()
+    return _connection
+
+
+def close_connection():
+    """
+    Closes the shared mail connection.
+    """
+    global _connection
+    with _connection_lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+
+def is_open(connection) -> bool:
+    """
+    :return: False if the connection's SMTP socket is not open or the
+        server has closed it or sent something, such as a 421 timeout
+        reply, without being asked.  Backends without a socket are always
+        open.
+    """
+    if not hasattr(connection, 'connection'):
+        return True
+    sock = getattr(connection.connection, 'sock', None)
+    if sock is None:
+        return False
+    try:
+        readable, writable, failed = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+def _reset(connection):
+    try:
+        connection.close()
+    except Exception:
+        logger.debug('Could not close the mail connection cleanly.',
+                     exc_info=True)
+
+
+def send_message_batch(messages: list) -> list:
+    """
+    Sends the messages over the shared mail connection.  A connection
+    that has been idle for QUARTET_OUTPUT_MAIL_IDLE_TIMEOUT seconds, or
+    that the server has closed, is reopened before the next message is
+    sent.  A message whose send fails is not sent again since the server
+    may have accepted it before the connection dropped; only the messages
+    after it are sent on a new connection.
+    :param messages: A list of `EmailMessage` instances.
+    :return: A list with None for each message that was sent or the
+        exception raised while sending it, in the order of `messages`.
+    """
+    global _last_used
+    connection = get_connection()
+    idle_timeout = getattr(settings, 'QUARTET_OUTPUT_MAIL_IDLE_TIMEOUT', 60)
+    results = []
+    with _connection_lock:
+        if time.monotonic() - _last_used > idle_timeout:
+            _reset(connection)
+        for message in messages:
+            if not is_open(connection):
+                _reset(connection)
+            try:
+                # opening the connection here keeps send_messages from
+                # closing it again once the message has been sent
+                connection.open()
+            except Exception as e:
+                # the server is unreachable; do not wait on it for every
+                # message
+                results.extend([e] * (len(messages) - len(results)))
+                break
+            try:
+                connection.send_messages([message])
+                results.append(None)
+            except Exception as e:
+                if isinstance(e, (smtplib.SMTPServerDisconnected,
+                                  ConnectionError)):
+                    logger.debug('The mail server closed the connection '
+                                 'while a message was sent.')
+                    _reset(connection)
+                results.append(e)
+            _last_used = time.monotonic()
+    return results
+
+
+def send_messages(messages: list) -> int:
+    """
+    Sends the messages with `send_message_batch`.
+    :return: The number of messages sent.
+    :raises: The first error raised while sending a message.
+    """
+    for error in send_message_batch(messages):
+        if error is not None:
+            raise error
+    return len(messages)
+
+
+def compress_attachment(filename: str, data, mimetype: str,
+                        threshold: int) -> tuple:
+    """
+    Gzips attachment data that is larger than the threshold.
+    :param threshold: The size in bytes above which the data is
+        compressed or 0 to never compress.
+    :return: A (filename, data, mimetype) tuple.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if threshold and len(data) > threshold:
+        return ('%s.gz' % filename, gzip.compress(data),
+                'application/gzip')
+    return filename, data, mimetype
 
 
 class MailMixin:
@@ -34,7 +174,8 @@ class MailMixin:
                    output_criteria: EPCISOutputCriteria,
                    info_func,
                    file_extension='txt',
-                   mimetype='text/plain'):
+                   mimetype='text/plain',
+                   compress_threshold=0):
         '''
         Parses out a mailto link and sends the data parameter to the addresses
         specified in the link.
@@ -50,12 +191,30 @@ class MailMixin:
             being sent.  It is best to leave it as txt even if the "real" data is
             JSON or XML since many email filters will block those formats.
         :param mimetype: The mimetype of the attachment.  Default is text/plain.
+        :param compress_threshold: Attachments larger than this number of
+            bytes are gzipped.  Default is 0 (never compress).
         :return: None.
         '''
+        email = self.create_email(data, rule_context.task_name,
+                                  output_criteria, file_extension, mimetype,
+                                  compress_threshold)
+        send_messages([email])
+
+    def create_email(self, data, name: str,
+                     output_criteria: EPCISOutputCriteria,
+                     file_extension='txt', mimetype='text/plain',
+                     compress_threshold=0) -> EmailMessage:
+        '''
+        Creates the email for the output criteria's mailto link with the
+        data attached.
+        :param name: The name of the attachment without its extension.
+        :return: An `EmailMessage`.
+        '''
         email = self.convert_mailto_url(output_criteria.end_point.urn)
-        filename = '%s.%s' % (rule_context.task_name, file_extension)
-        email.attach(filename, data, mimetype=mimetype)
-        email.send()
+        email.attach(*compress_attachment(
+            '%s.%s' % (name, file_extension), data, mimetype,
+            compress_threshold))
+        return email
 
     def convert_mailto_url(self, mailto):
         mail_info = urlparse(mailto, 'mailto')
@@ -84,3 +243,24 @@ class MailMixin:
             reply_to=query_dict.get('reply-to')
         )
         return email
+
+
+class MailTransport(MailMixin):
+    '''
+    The mailto transport of the `TransportStep`.  Uses the step's
+    file-extension, content-type and gzip-attachment-threshold parameters.
+    '''
+
+    def send(self, step, data, rule_context: RuleContext,
+             output_criteria: EPCISOutputCriteria):
+        sender = registry.get_sender(self, step, MailMixin)
+        sender.send_email(
+            data,
+            rule_context,
+            output_criteria,
+            step.info,
+            file_extension=step.get_parameter('file-extension', 'txt'),
+            mimetype=step.get_parameter('content-type', 'text/plain'),
+            compress_threshold=step.get_integer_parameter(
+                'gzip-attachment-threshold', 0)
+        )
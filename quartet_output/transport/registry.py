@@ -0,0 +1,217 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+The transports used by the `TransportStep`, keyed by the URL scheme of an
+endpoint's urn.  A transport is any class with a
+`send(step, data, rule_context, output_criteria)` method.
+
+Transports are registered by dotted path so that a transport's module,
+and the libraries it needs (paramiko for SFTP, for example), are only
+imported the first time a message is sent with it.  The built in
+transports can be replaced, and new ones added, with the
+QUARTET_OUTPUT_TRANSPORTS setting::
+
+    QUARTET_OUTPUT_TRANSPORTS = {
+        'ftp': 'my_package.transports.FtpTransport',
+    }
+
+or by other packages through `quartet_output.transports` entry points
+named after the scheme::
+
+    entry_points={
+        'quartet_output.transports': [
+            'ftp = my_package.transports:FtpTransport',
+        ]
+    }
+
+Settings take precedence over entry points, which take precedence over
+the built in transports.
+
+The built in transports are thin classes on top of the transport mixins
+(`HttpTransportMixin`, `SftpTransportMixin` and so on).  A `TransportStep`
+subclass that overrides mixin methods such as `post_data`, `get_auth` or
+`sftp_put` has to list the mixin among its bases; the transport then
+calls the methods on the step instead of its own, see `get_sender`.
+"""
+from logging import getLogger
+from threading import Lock
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from quartet_output.errors import ProtocolNotSupportedError
+
+try:
+    from importlib import metadata
+except ImportError:
+    # python < 3.8
+    try:
+        import importlib_metadata as metadata
+    except ImportError:
+        metadata = None
+
+logger = getLogger(__name__)
+
+ENTRY_POINT_GROUP = 'quartet_output.transports'
+
+DEFAULT_TRANSPORTS = {
+    'http': 'quartet_output.transport.http.HttpTransport',
+    'https': 'quartet_output.transport.http.HttpTransport',
+    'sftp': 'quartet_output.transport.sftp.SftpTransport',
+    'mailto': 'quartet_output.transport.mail.MailTransport',
+    'socket': 'quartet_output.transport.tcp.SocketTransport',
+    'file': 'quartet_output.transport.file.FileTransport',
+}
+
+
+class TransportRegistry:
+    """
+    Maps URL schemes to transports and creates each transport on first
+    use.
+    :param transports: A dictionary of schemes to dotted paths or entry
+        points.
+    """
+
+    def __init__(self, transports: dict):
+        self._paths = {scheme.lower(): path
+                       for scheme, path in transports.items()}
+        self._transports = {}
+        self._lock = Lock()
+
+    @property
+    def schemes(self) -> list:
+        return sorted(self._paths)
+
+    def supports(self, scheme: str) -> bool:
+        return scheme.lower() in self._paths
+
+    def get_transport(self, scheme: str):
+        """
+        :return: The transport instance for the scheme.
+        :raises ProtocolNotSupportedError: If no transport is registered
+            for the scheme.
+        """
+        scheme = scheme.lower()
+        transport = self._transports.get(scheme)
+        if transport is None:
+            with self._lock:
+                transport = self._transports.get(scheme)
+                if transport is None:
+                    transport = self._transports[scheme] = self._load(scheme)
+        return transport
+
+    def _load(self, scheme: str):
+        try:
+            path = self._paths[scheme]
+        except KeyError:
+            raise ProtocolNotSupportedError(
+                'No transport is registered for the %s scheme.', scheme)
+        logger.debug('Loading the %s transport from %s.', scheme, path)
+        if isinstance(path, str):
+            transport_class = import_string(path)
+        else:
+            transport_class = path.load()
+        # http and https share one instance when they share a class
+        for loaded in self._transports.values():
+            if type(loaded) is transport_class:
+                return loaded
+        return transport_class()
+
+
+def entry_points(group: str) -> list:
+    """
+    :return: The installed entry points of the group.  Uses
+        `importlib.metadata`, or its `importlib_metadata` backport, and
+        falls back to `pkg_resources` when neither is available.
+    """
+    if metadata is None:
+        import pkg_resources
+        return list(pkg_resources.iter_entry_points(group))
+    found = metadata.entry_points()
+    if hasattr(found, 'select'):
+        return list(found.select(group=group))
+    # python < 3.10 returns a dictionary of groups
+    return list(found.get(group, ()))
+
+
+def get_transport_paths() -> dict:
+    """
+    :return: The built in transports updated with any entry points and
+        the QUARTET_OUTPUT_TRANSPORTS setting.
+    """
+    paths = dict(DEFAULT_TRANSPORTS)
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        paths[entry_point.name.lower()] = entry_point
+    paths.update(getattr(settings, 'QUARTET_OUTPUT_TRANSPORTS', {}))
+    return paths
+
+
+_registry = None
+_registry_lock = Lock()
+_warned = set()
+
+
+def get_sender(transport, step, mixin: type):
+    """
+    :param transport: The built in transport sending the message.
+    :param step: The step that is sending the message.
+    :param mixin: The transport mixin the transport is built on.
+    :return: The step if it inherits the mixin, so that the methods a
+        `TransportStep` subclass overrides are used, otherwise the
+        transport.  A warning is logged once per step class if the step
+        defines some of the mixin's methods without inheriting it, since
+        those methods are not used.
+    """
+    if isinstance(step, mixin):
+        return step
+    step_class = type(step)
+    if (step_class, mixin) not in _warned:
+        _warned.add((step_class, mixin))
+        overrides = sorted(
+            name for name in vars(mixin)
+            if not name.startswith('__') and hasattr(step_class, name))
+        if overrides:
+            logger.warning(
+                '%s defines %s but does not inherit %s, so the %s transport '
+                'does not use them.  Add %s to the bases of the step.',
+                step_class.__name__, ', '.join(overrides), mixin.__name__,
+                type(transport).__name__, mixin.__name__)
+    return transport
+
+
+def get_registry() -> TransportRegistry:
+    """
+    :return: The process wide transport registry.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TransportRegistry(get_transport_paths())
+    return _registry
+
+
+def get_transport(scheme: str):
+    return get_registry().get_transport(scheme)
+
+
+def reset_registry():
+    """
+    Discards the registry so that it is rebuilt from the settings and
+    entry points on next use.
+    """
+    global _registry
+    with _registry_lock:
+        _registry = None
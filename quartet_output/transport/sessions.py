@@ -0,0 +1,174 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+A process wide registry of keep-alive `requests.Session` objects.  A
+session is kept for each endpoint origin (scheme, host and port) and
+set of credentials so that consecutive messages to the same partner
+reuse open TCP and TLS connections.  Sessions are checked out with the
+`session` context manager, and sessions that are not checked out and
+have not been used for `QUARTET_OUTPUT_HTTP_SESSION_IDLE_TIMEOUT`
+seconds are closed.
+"""
+import time
+from collections import Counter
+from contextlib import contextmanager
+from logging import getLogger
+from threading import Lock
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = getLogger(__name__)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class SessionRegistry:
+    """
+    Holds one `requests.Session` per origin and credentials.
+    :param pool_size: The number of connections each session keeps open
+        to its origin.
+    :param idle_timeout: The number of seconds after which an unused
+        session is closed.
+    """
+
+    def __init__(self, pool_size: int = 10, idle_timeout: float = 300):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._in_use = Counter()
+        self._lock = Lock()
+
+    def get_key(self, url: str, auth_info=None) -> tuple:
+        parsed = urlparse(url)
+        scheme = parsed.scheme.lower()
+        port = parsed.port or DEFAULT_PORTS.get(scheme)
+        return (scheme, (parsed.hostname or '').lower(), port,
+                getattr(auth_info, 'pk', None))
+
+    def create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def acquire(self, url: str, auth_info=None) -> tuple:
+        """
+        Checks out the warm session for the url's origin and the
+        credentials or creates a new one.  The session is not closed as
+        idle until it is released.
+        :param url: The url that will be requested.
+        :param auth_info: The `AuthenticationInfo` used for the request.
+        :return: The key to release the session with and a
+            `requests.Session`.
+        """
+        key = self.get_key(url, auth_info)
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session, last_used = self._sessions.get(key, (None, None))
+            if session is None:
+                logger.debug('Creating a new HTTP session for %s', key[:3])
+                session = self.create_session()
+            self._sessions[key] = session, now
+            self._in_use[key] += 1
+            return key, session
+
+    def release(self, key: tuple):
+        """
+        Checks a session back in; its idle time starts now.
+        """
+        with self._lock:
+            self._in_use[key] -= 1
+            if self._in_use[key] <= 0:
+                del self._in_use[key]
+            if key in self._sessions:
+                self._sessions[key] = (self._sessions[key][0],
+                                       time.monotonic())
+
+    @contextmanager
+    def session(self, url: str, auth_info=None):
+        """
+        A context manager around `acquire` and `release`.
+        """
+        key, session = self.acquire(url, auth_info)
+        try:
+            yield session
+        finally:
+            self.release(key)
+
+    def _evict(self, now: float):
+        for key, (session, last_used) in list(self._sessions.items()):
+            if key not in self._in_use and \
+                    now - last_used > self.idle_timeout:
+                logger.debug('Closing idle HTTP session for %s', key[:3])
+                del self._sessions[key]
+                session.close()
+
+    def close(self):
+        """
+        Closes every session in the registry.
+        """
+        with self._lock:
+            for session, last_used in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+_registry = None
+_registry_lock = Lock()
+
+
+def get_registry() -> SessionRegistry:
+    """
+    :return: The process wide session registry configured by the
+        QUARTET_OUTPUT_HTTP_POOL_SIZE and
+        QUARTET_OUTPUT_HTTP_SESSION_IDLE_TIMEOUT settings.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = SessionRegistry(
+                    getattr(settings, 'QUARTET_OUTPUT_HTTP_POOL_SIZE', 10),
+                    getattr(settings,
+                            'QUARTET_OUTPUT_HTTP_SESSION_IDLE_TIMEOUT', 300)
+                )
+    return _registry
+
+
+def session(url: str, auth_info=None):
+    """
+    Checks out the process wide session for the url and credentials; see
+    `SessionRegistry.session`.
+    """
+    return get_registry().session(url, auth_info)
+
+
+def close_sessions():
+    """
+    Closes all of the sessions and discards the registry.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is not None:
+            _registry.close()
+            _registry = None
@@ -12,6 +12,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join
 from urllib.parse import urlparse
 
@@ -21,6 +23,9 @@ from io import StringIO, BytesIO
 from logging import getLogger
 from quartet_capture.rules import RuleContext
 from quartet_output.models import EPCISOutputCriteria
+from quartet_output.transport.credentials import get_private_key
+from quartet_output.transport import registry
+from quartet_output.transport.sftp_pool import get_pool
 
 logger = getLogger(__name__)
 
@@ -28,6 +33,9 @@ logger = getLogger(__name__)
 class SftpTransportMixin:
     '''
     Add to steps that need to support sending over files via SFTP.
+    Connections are taken from the pool in
+    `quartet_output.transport.sftp_pool` so consecutive uploads to the
+    same server reuse an authenticated session.
     '''
 
     def sftp_put(self, data, rule_context: RuleContext,
@@ -35,13 +43,18 @@ class SftpTransportMixin:
                   content_type='application/xml',
                   file_extension='xml'):
         '''
-        :param data: Data passed as bytes.
+        :param data: Data passed as bytes or a binary file-like object,
+        which is uploaded from its current position.
         :param output_criteria: The output criteria containing the connection
         info.
         :return: The response.
         '''
         logger.debug('Using context key %s to PUT data over SFTP.', data)
-        data_stream = BytesIO(data)
+        if hasattr(data, 'read'):
+            data_stream = data
+        else:
+            data_stream = BytesIO(data)
+        position = data_stream.tell()
         file_name = '{0}.{1}'.format(rule_context.task_name, file_extension)
         files = {'file': (file_name, data_stream)}
         logger.debug('Posting data with urn %s and file_name %s and '
@@ -50,30 +63,152 @@ class SftpTransportMixin:
                      file_name,
                      file_extension)
         parsed_urn = urlparse(output_criteria.end_point.urn)
-        sftp_client = None
-        result = None
-        try:
+        auth = self.sftp_get_auth(output_criteria)
+        remote_path = join(parsed_urn.path, file_name)
+
+        def connect():
             sftp_client = paramiko.SSHClient()
             sftp_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            auth = self.sftp_get_auth(output_criteria)
-            remote_path = join(parsed_urn.path, file_name)
-            sftp_client.connect(parsed_urn.hostname, parsed_urn.port, **auth, timeout=60)
-            sftp = sftp_client.open_sftp()
-            result = sftp.putfo(data_stream, remote_path, confirm=False)
+            sftp_client.connect(parsed_urn.hostname, parsed_urn.port,
+                                **(auth or {}), timeout=60)
+            return sftp_client
+
+        pool = get_pool()
+        key = self.sftp_get_pool_key(parsed_urn, output_criteria)
+        while True:
+            connection = pool.acquire(key, connect)
+            try:
+                result = connection.sftp.putfo(data_stream, remote_path,
+                                               confirm=False)
+            except BaseException as e:
+                retry = connection.reused and \
+                    connection.is_connection_error(e)
+                pool.release(key, connection, discard=True)
+                if not retry:
+                    raise
+                # the server dropped a pooled connection, try another
+                logger.debug('Pooled SFTP connection to %s failed; '
+                             'retrying.', parsed_urn.hostname)
+                data_stream.seek(position)
+                continue
+            pool.release(key, connection)
+            return result
+
+    def sftp_put_files(self, files: list,
+                       output_criteria: EPCISOutputCriteria,
+                       channels: int = 4) -> dict:
+        """
+        Uploads many files over a single pooled SSH connection.  The files
+        are spread over up to `channels` SFTP channels opened on that
+        connection and are written with pipelined writes.  Each file is
+        written to a hidden temporary name first and then renamed so that
+        a partner polling the directory never sees a partial file.
+        :param files: A list of (file name, bytes) tuples.
+        :param output_criteria: The output criteria containing the
+            connection info.
+        :param channels: The number of SFTP channels to upload on.
+        :return: A dictionary of file name to the exception raised while
+            uploading it or None if the upload succeeded.
+        """
+        parsed_urn = urlparse(output_criteria.end_point.urn)
+        auth = self.sftp_get_auth(output_criteria)
+
+        def connect():
+            sftp_client = paramiko.SSHClient()
+            sftp_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            sftp_client.connect(parsed_urn.hostname, parsed_urn.port,
+                                **(auth or {}), timeout=60)
+            return sftp_client
+
+        pool = get_pool()
+        key = self.sftp_get_pool_key(parsed_urn, output_criteria)
+        connection = pool.acquire(key, connect)
+        clients = [connection.sftp]
+        results = {}
+        try:
+            transport = connection.client.get_transport()
+            for i in range(min(channels, len(files)) - 1):
+                clients.append(paramiko.SFTPClient.from_transport(transport))
+
+            def upload(client, client_files):
+                for file_name, data in client_files:
+                    try:
+                        self.sftp_put_atomic(client, parsed_urn.path,
+                                             file_name, data)
+                        results[file_name] = None
+                    except Exception as error:
+                        logger.exception('Could not upload %s.', file_name)
+                        results[file_name] = error
+
+            with ThreadPoolExecutor(len(clients)) as executor:
+                for future in [
+                    executor.submit(upload, client, files[i::len(clients)])
+                    for i, client in enumerate(clients)
+                ]:
+                    future.result()
         finally:
-            if sftp_client:
-                sftp_client.close()
-        return result
+            for client in clients[1:]:
+                client.close()
+            pool.release(key, connection, discard=not connection.is_alive())
+        return results
+
+    def sftp_put_atomic(self, sftp: paramiko.SFTPClient, directory: str,
+                        file_name: str, data: bytes):
+        """
+        Writes the data to a temporary file and renames it to `file_name`.
+        Falls back to a plain rename if the server does not support the
+        posix-rename extension.
+        """
+        temp_path = join(directory, '.{0}.part'.format(file_name))
+        remote_path = join(directory, file_name)
+        with sftp.open(temp_path, 'wb') as remote_file:
+            remote_file.set_pipelined(True)
+            remote_file.write(data)
+        try:
+            sftp.posix_rename(temp_path, remote_path)
+        except IOError:
+            sftp.rename(temp_path, remote_path)
+
+    def sftp_get_pool_key(self, parsed_urn, output_criteria) -> tuple:
+        """
+        Connections are pooled by host, port and credentials.
+        """
+        auth_info = output_criteria.authentication_info
+        credentials = ''
+        username = None
+        if auth_info:
+            username = auth_info.username
+            credentials = hashlib.sha256('{0}\0{1}'.format(
+                auth_info.private_key or '', auth_info.password or ''
+            ).encode()).hexdigest()
+        return (parsed_urn.hostname, parsed_urn.port or 22, username,
+                credentials)
 
     def sftp_get_auth(self, output_criteria):
         auth_info = output_criteria.authentication_info
         if auth_info:
             auth_type = auth_info.type or ''
             if auth_info.private_key:
-                key_file = StringIO.StringIO(auth_info.private_key)
                 return {"username": auth_info.username,
-                        "pkey": paramiko.RSAKey.from_private_key(key_file)}
+                        "pkey": get_private_key(auth_info)}
             else:
                 return {"username": auth_info.username,
                         "password": auth_info.password}
         return None
+
+
+class SftpTransport(SftpTransportMixin):
+    '''
+    The sftp transport of the `TransportStep`.  Uses the step's
+    content-type and file-extension parameters.
+    '''
+    streams = True
+
+    def send(self, step, data, rule_context: RuleContext,
+             output_criteria: EPCISOutputCriteria):
+        sender = registry.get_sender(self, step, SftpTransportMixin)
+        sender.sftp_put(data,
+                        rule_context,
+                        output_criteria,
+                        step.get_parameter('content-type', 'application/xml'),
+                        step.get_parameter('file-extension', 'xml'))
@@ -0,0 +1,229 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+A process wide pool of authenticated SSH connections with open SFTP
+channels.  Connections are pooled by host, port and credentials so that
+consecutive uploads to the same server skip the SSH handshake and
+authentication.  Each key has a bounded number of connections, idle
+connections are closed after `QUARTET_OUTPUT_SFTP_IDLE_TIMEOUT` seconds
+and every connection is checked before it is handed out again.
+"""
+import socket
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from logging import getLogger
+from threading import BoundedSemaphore, Lock
+
+import paramiko
+from django.conf import settings
+
+from quartet_output.errors import ConnectionPoolTimeout
+
+logger = getLogger(__name__)
+
+CONNECTION_ERRORS = (paramiko.SSHException, EOFError)
+
+
+class PooledSftpConnection:
+    """
+    An `SSHClient` and the SFTP channel opened on it.
+    """
+
+    def __init__(self, client: paramiko.SSHClient):
+        self.client = client
+        self.sftp = client.open_sftp()
+        self.last_used = time.monotonic()
+        self.reused = False
+
+    def is_alive(self) -> bool:
+        transport = self.client.get_transport()
+        if not transport or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except CONNECTION_ERRORS + (socket.error,):
+            return False
+        return True
+
+    def is_connection_error(self, error: BaseException) -> bool:
+        """
+        :return: True if the error shows the connection was lost rather
+            than the operation failing, as it does for a missing
+            directory or a permission error, which paramiko raises as
+            IOErrors.  Socket errors only count once the transport has
+            closed.
+        """
+        if isinstance(error, CONNECTION_ERRORS):
+            return True
+        if isinstance(error, socket.error):
+            transport = self.client.get_transport()
+            return not transport or not transport.is_active()
+        return False
+
+    def close(self):
+        try:
+            self.sftp.close()
+        finally:
+            self.client.close()
+
+
+class SftpConnectionPool:
+    """
+    Pools `PooledSftpConnection` instances by key.
+    :param max_size: The maximum number of connections open to a single
+        key at any time.
+    :param idle_timeout: Seconds after which an unused connection is
+        closed.
+    :param keepalive: The SSH keepalive interval in seconds; 0 disables
+        keepalives.
+    :param acquire_timeout: Seconds to wait for a connection when
+        `max_size` connections are in use.
+    """
+
+    def __init__(self, max_size: int = 4, idle_timeout: float = 300,
+                 keepalive: int = 30, acquire_timeout: float = 300):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.acquire_timeout = acquire_timeout
+        self._idle = defaultdict(deque)
+        self._slots = {}
+        self._lock = Lock()
+
+    def _get_slot(self, key) -> BoundedSemaphore:
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = BoundedSemaphore(self.max_size)
+            return slot
+
+    def _pop_idle(self, key):
+        with self._lock:
+            idle = self._idle[key]
+            return idle.pop() if idle else None
+
+    def close_idle(self, now: float = None):
+        """
+        Closes every idle connection that has not been used within the
+        idle timeout.
+        """
+        now = now or time.monotonic()
+        expired = []
+        with self._lock:
+            for idle in self._idle.values():
+                while idle and now - idle[0].last_used > self.idle_timeout:
+                    expired.append(idle.popleft())
+        for connection in expired:
+            connection.close()
+
+    def acquire(self, key, connect) -> PooledSftpConnection:
+        """
+        Returns a healthy idle connection for the key or opens a new one.
+        :param key: The pool key.
+        :param connect: A callable that returns a connected `SSHClient`.
+        """
+        slot = self._get_slot(key)
+        if not slot.acquire(timeout=self.acquire_timeout):
+            raise ConnectionPoolTimeout(
+                'Timed out waiting for an SFTP connection to %s:%s.',
+                key[0], key[1])
+        try:
+            self.close_idle()
+            connection = self._pop_idle(key)
+            while connection:
+                if connection.is_alive():
+                    connection.reused = True
+                    return connection
+                logger.debug('Discarding a dead SFTP connection to %s:%s.',
+                             key[0], key[1])
+                connection.close()
+                connection = self._pop_idle(key)
+            client = connect()
+            if self.keepalive:
+                client.get_transport().set_keepalive(self.keepalive)
+            return PooledSftpConnection(client)
+        except BaseException:
+            slot.release()
+            raise
+
+    def release(self, key, connection: PooledSftpConnection,
+                discard: bool = False):
+        """
+        Returns a connection to the pool or closes it if `discard` is
+        True.
+        """
+        try:
+            if discard:
+                connection.close()
+            else:
+                connection.last_used = time.monotonic()
+                with self._lock:
+                    self._idle[key].append(connection)
+        finally:
+            self._get_slot(key).release()
+
+    @contextmanager
+    def connection(self, key, connect):
+        """
+        A context manager around `acquire` and `release`.  Connections
+        are discarded if the block raises an exception.
+        """
+        connection = self.acquire(key, connect)
+        try:
+            yield connection
+        except BaseException:
+            self.release(key, connection, discard=True)
+            raise
+        else:
+            self.release(key, connection)
+
+    def close(self):
+        with self._lock:
+            connections = [connection for idle in self._idle.values()
+                           for connection in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def get_pool() -> SftpConnectionPool:
+    """
+    :return: The process wide pool configured by the
+        QUARTET_OUTPUT_SFTP_POOL_SIZE, QUARTET_OUTPUT_SFTP_IDLE_TIMEOUT and
+        QUARTET_OUTPUT_SFTP_KEEPALIVE settings.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SftpConnectionPool(
+                    getattr(settings, 'QUARTET_OUTPUT_SFTP_POOL_SIZE', 4),
+                    getattr(settings, 'QUARTET_OUTPUT_SFTP_IDLE_TIMEOUT', 300),
+                    getattr(settings, 'QUARTET_OUTPUT_SFTP_KEEPALIVE', 30)
+                )
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
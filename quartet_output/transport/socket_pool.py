@@ -0,0 +1,233 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+"""
+TCP connections for the socket transport.  Each host and port gets one
+`SocketChannel` that writes every message with `sendall`.  A send that
+fails part way is not repeated, since the peer may already have some of
+the data.
+
+Label printers typically accept a single raw connection at a time, so by
+default the connection is closed after each write and other workers or
+hosts can reach the printer in between.  Keeping the connection open is
+opt-in: with an idle timeout the connection is reused for messages sent
+within that many seconds of each other and closed once it has been idle
+that long.  A connection the peer has closed is reopened before sending.
+
+If a batching window is set, messages that arrive within the window are
+coalesced and written to the socket at once: the first sender's thread
+sleeps for the window and then writes all of the pending messages for the
+senders that arrived after it.  Only the senders within one process share
+a channel, so messages sent by other worker processes are not coalesced
+with them.
+"""
+import select
+import socket
+import time
+from logging import getLogger
+from threading import Condition, Lock, Timer
+
+from django.conf import settings
+
+logger = getLogger(__name__)
+
+
+class _PendingWrite:
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.done = False
+        self.error = None
+
+
+class SocketChannel:
+    """
+    The connection to a single host and port.
+    :param address: A (host, port) tuple.
+    :param timeout: The connect and send timeout in seconds.
+    :param idle_timeout: Seconds an unused connection is kept open for the
+        next message.  0 closes the connection after each write.
+    """
+
+    def __init__(self, address: tuple, timeout: float = 60,
+                 idle_timeout: float = 0):
+        self.address = address
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._socket = None
+        self._last_used = 0
+        self._timer = None
+        self._lock = Lock()
+        self._condition = Condition(Lock())
+        self._pending = []
+        self._leader = False
+
+    def _connect(self):
+        logger.debug('Connecting to %s:%s.', *self.address)
+        self._socket = socket.create_connection(self.address, self.timeout)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    def _is_alive(self) -> bool:
+        if self._socket is None:
+            return False
+        if time.monotonic() - self._last_used > self.idle_timeout:
+            return False
+        try:
+            readable, writable, errored = select.select(
+                [self._socket], [], [], 0)
+            # a readable socket that returns no data has been closed
+            return not readable or \
+                self._socket.recv(1, socket.MSG_PEEK) != b''
+        except (OSError, ValueError):
+            return False
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close_idle(self):
+        with self._lock:
+            if time.monotonic() - self._last_used >= self.idle_timeout:
+                logger.debug('Closing the idle connection to %s:%s.',
+                             *self.address)
+                self._close()
+
+    def _close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            finally:
+                self._socket = None
+
+    def _write(self, data: bytes):
+        with self._lock:
+            if not self._is_alive():
+                self._close()
+                self._connect()
+            try:
+                self._socket.sendall(data)
+            except OSError:
+                # part of the data may have reached the peer so it is not
+                # sent again here; the retry policy of the step decides
+                logger.debug('Send to %s:%s failed; closing the '
+                             'connection.', *self.address)
+                self._close()
+                raise
+            self._last_used = time.monotonic()
+            if self.idle_timeout <= 0:
+                self._close()
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = Timer(self.idle_timeout, self._close_idle)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def send(self, data: bytes, batch_window: float = 0):
+        """
+        Writes the data to the connection.
+        :param data: The bytes to send.
+        :param batch_window: Seconds to wait for other messages to the same
+            address so they can be written together.  0 writes the data
+            right away.
+        """
+        if not batch_window:
+            self._write(data)
+            return
+        pending = _PendingWrite(data)
+        with self._condition:
+            self._pending.append(pending)
+            if self._leader:
+                while not pending.done:
+                    self._condition.wait()
+                if pending.error:
+                    raise pending.error
+                return
+            self._leader = True
+        time.sleep(batch_window)
+        with self._condition:
+            batch, self._pending = self._pending, []
+            self._leader = False
+        error = None
+        try:
+            self._write(b''.join(item.data for item in batch))
+        except Exception as e:
+            error = e
+        with self._condition:
+            for item in batch:
+                item.done = True
+                item.error = error
+            self._condition.notify_all()
+        if error:
+            raise error
+
+
+class SocketPool:
+    """
+    Holds a `SocketChannel` per host and port.
+    """
+
+    def __init__(self, timeout: float = 60, idle_timeout: float = 0):
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._channels = {}
+        self._lock = Lock()
+
+    def get_channel(self, host: str, port: int) -> SocketChannel:
+        key = (host, port)
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self._channels[key] = SocketChannel(
+                    key, self.timeout, self.idle_timeout)
+            return channel
+
+    def close(self):
+        with self._lock:
+            channels, self._channels = list(self._channels.values()), {}
+        for channel in channels:
+            channel.close()
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def get_pool() -> SocketPool:
+    """
+    :return: The process wide pool configured by the
+        QUARTET_OUTPUT_SOCKET_TIMEOUT and QUARTET_OUTPUT_SOCKET_IDLE_TIMEOUT
+        settings.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SocketPool(
+                    getattr(settings, 'QUARTET_OUTPUT_SOCKET_TIMEOUT', 60),
+                    getattr(settings, 'QUARTET_OUTPUT_SOCKET_IDLE_TIMEOUT',
+                            0)
+                )
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -12,8 +12,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 # Copyright 2019 SerialLab Corp.  All rights reserved.
-import socket
+from django.conf import settings
 from quartet_output.models import EPCISOutputCriteria
+from quartet_output.transport import registry
+from quartet_output.transport.socket_pool import get_pool
 from quartet_capture.rules import RuleContext
 from urllib.parse import urlparse
 
@@ -29,6 +31,17 @@ from urllib.parse import urlparse
 
 
 class SocketTransportMixin:
+    """
+    Sends data over raw TCP sockets through
+    `quartet_output.transport.socket_pool`.  The connection is closed
+    after each message unless QUARTET_OUTPUT_SOCKET_IDLE_TIMEOUT is set
+    to the number of seconds it may be kept open for the next one; since
+    a printer usually accepts one connection at a time, keep it to a few
+    seconds.  Set QUARTET_OUTPUT_SOCKET_BATCH_WINDOW to a number of
+    seconds to coalesce the messages this process sends within that
+    window into a single write; the sending worker thread waits for the
+    window.
+    """
 
     def socket_send(self, data, rule_context: RuleContext,
                     output_criteria: EPCISOutputCriteria,
@@ -41,15 +54,25 @@ class SocketTransportMixin:
         :param info: The info function for logging
         :return: None
         """
-        mysocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         parsed_url = urlparse(output_criteria.end_point.urn)
         host = parsed_url.netloc.split(":")[0]
         port = parsed_url.port
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        info('Sending %s bytes to %s.', len(data),
+             output_criteria.end_point.urn)
+        get_pool().get_channel(host, port).send(
+            bytes(data),
+            getattr(settings, 'QUARTET_OUTPUT_SOCKET_BATCH_WINDOW', 0)
+        )
 
-        info('Connecting to host %s ', output_criteria.end_point.urn)
-        mysocket.connect((host, port))  # connecting to host
-        info('Sending data: %s (may be truncated for display purposes)',
-                  data[:1000])
-        mysocket.send(
-            bytes(data))  # using bytes
-        mysocket.close()  # closing connection
+
+class SocketTransport(SocketTransportMixin):
+    """
+    The socket transport of the `TransportStep`.
+    """
+
+    def send(self, step, data, rule_context: RuleContext,
+             output_criteria: EPCISOutputCriteria):
+        sender = registry.get_sender(self, step, SocketTransportMixin)
+        sender.socket_send(data, rule_context, output_criteria, step.info)
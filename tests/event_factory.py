@@ -0,0 +1,110 @@
+"""
+Helpers for building EPCPyYes template events in unit tests.
+"""
+import uuid
+from datetime import datetime
+
+from EPCPyYes.core.v1_2 import template_events
+from EPCPyYes.core.v1_2.events import Action, BusinessTransaction, \
+    Destination, ErrorDeclaration, QuantityElement, Source
+from EPCPyYes.core.v1_2.CBV import error_reasons
+from EPCPyYes.core.v1_2.CBV.business_steps import BusinessSteps
+from EPCPyYes.core.v1_2.CBV.business_transactions import \
+    BusinessTransactionType
+from EPCPyYes.core.v1_2.CBV.dispositions import Disposition
+from EPCPyYes.core.v1_2.CBV.instance_lot_master_data import \
+    InstanceLotMasterDataAttribute, ItemLevelAttributeName
+from EPCPyYes.core.v1_2.CBV.source_destination import SourceDestinationTypes
+
+EVENT_TIME = '2019-06-01T12:00:00.000000+00:00'
+LOCATION = 'urn:epc:id:sgln:305555.123456.0'
+TRADE_ITEM = 'urn:epc:idpat:sgtin:305555.0555551.*'
+
+
+def sgtin(serial, item_reference='3555555'):
+    return 'urn:epc:id:sgtin:305555.%s.%s' % (item_reference, serial)
+
+
+def business_data():
+    return dict(
+        biz_location=LOCATION,
+        read_point='urn:epc:id:sgln:305555.123456.12',
+        business_transaction_list=[
+            BusinessTransaction('urn:epcglobal:cbv:bt:0555555555555.DE45_111',
+                                BusinessTransactionType.Despatch_Advice)
+        ],
+        source_list=[
+            Source(SourceDestinationTypes.location.value, LOCATION)
+        ],
+        destination_list=[
+            Destination(SourceDestinationTypes.location.value,
+                        'urn:epc:id:sgln:0614141.00001.23')
+        ],
+        error_declaration=ErrorDeclaration(
+            reason=error_reasons.ErrorReason.incorrect_data.value,
+            corrective_event_ids=[str(uuid.uuid4())]
+        ),
+        event_id=str(uuid.uuid4()),
+    )
+
+
+def object_event(epcs, **kwargs):
+    event = template_events.ObjectEvent(
+        EVENT_TIME, '+00:00', record_time=datetime(2019, 6, 1, 12),
+        action=Action.add.value, epc_list=epcs,
+        biz_step=BusinessSteps.commissioning.value,
+        disposition=Disposition.encoded.value,
+        ilmd=[InstanceLotMasterDataAttribute(
+            name=ItemLevelAttributeName.lotNumber.value, value='DL232')],
+        quantity_list=[QuantityElement(epc_class=TRADE_ITEM, quantity=10)],
+        **dict(business_data(), **kwargs)
+    )
+    return event
+
+
+def aggregation_event(parent_id, epcs, **kwargs):
+    return template_events.AggregationEvent(
+        EVENT_TIME, '+00:00', action=Action.add.value, parent_id=parent_id,
+        child_epcs=epcs, biz_step=BusinessSteps.packing.value,
+        child_quantity_list=[
+            QuantityElement(epc_class=TRADE_ITEM, quantity=94.3, uom='LB')],
+        **dict(business_data(), **kwargs)
+    )
+
+
+def transaction_event(parent_id, epcs, **kwargs):
+    return template_events.TransactionEvent(
+        EVENT_TIME, '+00:00', action=Action.add.value, parent_id=parent_id,
+        epc_list=epcs, biz_step=BusinessSteps.shipping.value,
+        disposition=Disposition.in_transit.value,
+        **dict(business_data(), **kwargs)
+    )
+
+
+def transformation_event(input_epcs, output_epcs):
+    data = business_data()
+    return template_events.TransformationEvent(
+        EVENT_TIME, '+00:00', EVENT_TIME, data.pop('event_id'), input_epcs,
+        output_epc_list=output_epcs,
+        transformation_id=str(uuid.uuid4()),
+        biz_step=BusinessSteps.repackaging.value,
+        disposition=Disposition.returned.value,
+        **data
+    )
+
+
+def pallet(pallet_serial, case_count=2, items_per_case=3):
+    """
+    Returns the commissioning and aggregation events for a pallet with
+    cases of items.
+    """
+    pallet_epc = sgtin(pallet_serial, '4555555')
+    cases = [sgtin('%s%s' % (pallet_serial, case), '5555555')
+             for case in range(case_count)]
+    ret = [object_event([pallet_epc] + cases)]
+    for case in cases:
+        items = ['%s.%s' % (case, item) for item in range(items_per_case)]
+        ret.append(object_event(items))
+        ret.append(aggregation_event(case, items))
+    ret.append(aggregation_event(pallet_epc, cases))
+    return ret
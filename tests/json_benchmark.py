@@ -0,0 +1,50 @@
+"""
+Compares the EPCPyYes `render_json()` function with the template-free
+serializer in `quartet_output.encoders` on a large document.  Run it with
+an optional number of events:
+
+    python -m tests.json_benchmark [events]
+
+The serializer is timed with orjson, if it is installed, and with the
+standard library json module.
+"""
+import sys
+import time
+
+from EPCPyYes.core.v1_2 import template_events
+from quartet_output import encoders
+from tests import event_factory
+from tests.test_encoders import stdlib_encoding
+
+
+def create_document(event_count: int):
+    events = []
+    pallet = 0
+    while len(events) < event_count:
+        events += event_factory.pallet(str(pallet))
+        pallet += 1
+    return template_events.EPCISEventListDocument(
+        events[:event_count], created_date='2019-06-01T12:00:00')
+
+
+def benchmark(event_count: int = 100000):
+    document = create_document(event_count)
+    renderers = [('render_json()', document.render_json)]
+    if encoders.orjson:
+        renderers.append(('fast serializer, orjson',
+                          lambda: encoders.render_json(document)))
+    renderers.append(('fast serializer, json',
+                      lambda: stdlib_render_json(document)))
+    for name, render in renderers:
+        start = time.monotonic()
+        render()
+        print('%-30s %6.2fs' % (name, time.monotonic() - start))
+
+
+def stdlib_render_json(document):
+    with stdlib_encoding():
+        return encoders.render_json(document)
+
+
+if __name__ == '__main__':
+    benchmark(*[int(arg) for arg in sys.argv[1:2]])
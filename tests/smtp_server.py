@@ -0,0 +1,113 @@
+"""
+A minimal local SMTP server that stands in for a mail relay in the mail
+transport tests.  Run this module to benchmark the mail transport:
+
+    python -m tests.smtp_server
+"""
+import socketserver
+import threading
+import time
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line: str):
+        self.wfile.write(('%s\r\n' % line).encode())
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply('220 localhost ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.decode().strip().upper()
+            if command.startswith('EHLO'):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                message = []
+                for data in iter(self.rfile.readline, b''):
+                    if data == b'.\r\n':
+                        break
+                    message.append(data)
+                with self.server.lock:
+                    self.server.messages.append(b''.join(message))
+                if self.server.drop_before_reply:
+                    break
+                self.reply('250 OK')
+                if self.server.close_connections:
+                    break
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                break
+            elif command.split(' ')[0] in ('HELO', 'MAIL', 'RCPT', 'RSET',
+                                           'NOOP'):
+                self.reply('250 OK')
+            else:
+                self.reply('502 Command not implemented')
+
+
+class LocalSmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, close_connections=False, drop_before_reply=False):
+        super().__init__(('127.0.0.1', 0), SmtpHandler)
+        self.close_connections = close_connections
+        self.drop_before_reply = drop_before_reply
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        self.thread = threading.Thread(target=self.serve_forever)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+
+def benchmark(messages: int = 500):
+    from django.core.mail import EmailMessage
+    from django.test import override_settings
+    from quartet_output.transport import mail
+    data = '<epcis>%s</epcis>' % ('x' * 4000)
+
+    def create_email():
+        email = EmailMessage(subject='Output', to=['to@localhost'],
+                             from_email='from@localhost')
+        email.attach('message.xml', data, 'text/plain')
+        return email
+
+    for name, send in (
+        ('new connection per message', lambda: create_email().send()),
+        ('shared connection', lambda: mail.send_messages([create_email()])),
+    ):
+        with LocalSmtpServer() as server, override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.port
+        ):
+            mail.close_connection()
+            start = time.monotonic()
+            for i in range(messages):
+                send()
+            elapsed = time.monotonic() - start
+            mail.close_connection()
+            print('%-30s %8.0f messages/s  %5s connections' % (
+                name, messages / elapsed, server.connections))
+
+
+if __name__ == '__main__':
+    import django
+    django.setup()
+    benchmark()
@@ -0,0 +1,97 @@
+"""
+A local TCP server that stands in for a label printer in the socket
+transport tests.  Run this module to benchmark the socket transport:
+
+    python -m tests.socket_server
+"""
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RecordingHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            with self.server.lock:
+                self.server.received.append(data)
+                self.server.total += len(data)
+            if self.server.close_connections:
+                break
+
+
+class LocalSocketServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, close_connections=False):
+        super().__init__(('127.0.0.1', 0), RecordingHandler)
+        self.close_connections = close_connections
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.received = []
+        self.total = 0
+        self.thread = threading.Thread(target=self.serve_forever)
+
+    @property
+    def address(self):
+        return self.server_address
+
+    def wait_for(self, total: int, timeout: float = 5):
+        end = time.monotonic() + timeout
+        while self.total < total and time.monotonic() < end:
+            time.sleep(0.001)
+        return b''.join(self.received)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+
+def benchmark(jobs: int = 2000, threads: int = 8):
+    from quartet_output.transport.socket_pool import SocketChannel
+    job = b'^XA^A0N,50,50^FO50,50^FDSocket Test^FS^XZ'
+
+    def connection_per_job(address):
+        def send(i):
+            sock = socket.create_connection(address)
+            sock.sendall(job)
+            sock.close()
+        return send
+
+    def persistent(address, window=0):
+        channel = SocketChannel(address, idle_timeout=5)
+        return lambda i: channel.send(job, window)
+
+    for name, factory in (
+        ('new connection per job', connection_per_job),
+        ('persistent connection', persistent),
+        ('persistent, 2ms batch window',
+         lambda address: persistent(address, 0.002)),
+    ):
+        with LocalSocketServer() as server:
+            send = factory(server.address)
+            start = time.monotonic()
+            with ThreadPoolExecutor(threads) as executor:
+                list(executor.map(send, range(jobs)))
+            server.wait_for(jobs * len(job))
+            elapsed = time.monotonic() - start
+            print('%-30s %8.0f jobs/s  %5s connections' % (
+                name, jobs / elapsed, server.connections))
+
+
+if __name__ == '__main__':
+    benchmark()
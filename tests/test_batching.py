@@ -0,0 +1,157 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from EPCPyYes.core.v1_2 import template_events
+
+from quartet_capture import models
+from quartet_capture.defaults import get_storage
+from quartet_capture.rules import RuleContext
+from quartet_output import batching, delivery, payloads
+from quartet_output.models import EndPoint, EPCISOutputCriteria, \
+    OutputBatch, OutputBatchItem
+from quartet_output.steps import ContextKeys, CreateOutputTaskStep
+
+
+def render(epc, json_output=False):
+    document = template_events.EPCISEventListDocument([
+        template_events.ObjectEvent(epc_list=[epc], action='ADD')])
+    return document.render_json() if json_output else document.render()
+
+
+class TestBatching(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('quartet_output.tasks.flush_output_batch.'
+                             'apply_async')
+        self.schedule = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rule = models.Rule.objects.create(name='Transport Rule')
+        end_point = EndPoint.objects.create(name='Partner',
+                                            urn='http://unittest.local')
+        self.criteria = EPCISOutputCriteria.objects.create(
+            name='Partner', end_point=end_point)
+
+    def _read(self, task_name):
+        with get_storage().open('%s.dat' % task_name) as task_file:
+            return task_file.read().decode()
+
+    def _add(self, epc, window=60, size=0):
+        return batching.add_message(self.criteria, self.rule.name,
+                                    render(epc), window, size,
+                                    delivery_engine=True)
+
+    def test_merge_xml(self):
+        merged = batching.merge_documents([render('urn:a'), render('urn:b'),
+                                           render('urn:c')])
+        self.assertEqual(merged.count('<ObjectEvent>'), 3)
+        self.assertEqual(merged.count('<EPCISBody>'), 1)
+        self.assertLess(merged.index('urn:a'), merged.index('urn:c'))
+
+    def test_merge_json(self):
+        merged = json.loads(batching.merge_documents([
+            render('urn:a', True), render('urn:b', True)]))
+        self.assertEqual(
+            [event['objectEvent']['epcList'] for event in merged['events']],
+            [['urn:a'], ['urn:b']])
+
+    def test_can_merge(self):
+        self.assertTrue(batching.can_merge(render('urn:a')))
+        self.assertFalse(batching.can_merge('<foo/>'))
+        self.assertFalse(batching.can_merge('{"foo": 1}'))
+
+    def test_full_batch_is_sent(self):
+        self.assertEqual(self._add('urn:a', size=3), [])
+        self.assertEqual(self._add('urn:b', size=3), [])
+        self.assertEqual(self.schedule.call_count, 1)
+        task_name, = self._add('urn:c', size=3)
+        self.assertEqual(self._read(task_name).count('<ObjectEvent>'), 3)
+        parameters = dict(models.TaskParameter.objects.filter(
+            task_id=task_name).values_list('name', 'value'))
+        self.assertEqual(parameters[batching.BATCHED_PARAMETER], '3')
+        self.assertEqual(parameters[delivery.CRITERIA_PARAMETER], 'Partner')
+        self.assertFalse(OutputBatchItem.objects.exists())
+        self.assertFalse(OutputBatch.objects.exists())
+
+    def test_earliest_message_schedules_the_flush(self):
+        self._add('urn:a')
+        # another message was added before this one counted the batch
+        OutputBatchItem.objects.create(
+            criteria=self.criteria, output_rule=self.rule.name,
+            data=render('urn:b'), delivery_engine=True,
+            flush_at=timezone.now() + timedelta(seconds=120))
+        self.schedule.reset_mock()
+        self._add('urn:c', window=30)
+        self.assertEqual(self.schedule.call_count, 1)
+        self.assertEqual(self.schedule.call_args[1]['countdown'], 30)
+        self._add('urn:d')
+        self.assertEqual(self.schedule.call_count, 1)
+
+    def test_due_batches_are_flushed(self):
+        self._add('urn:a')
+        self._add('urn:b')
+        self.assertEqual(batching.flush_due(), [])
+        OutputBatchItem.objects.update(
+            flush_at=timezone.now() - timedelta(seconds=1))
+        call_command('flush_output_batches', stdout=mock.Mock())
+        task = models.Task.objects.get(rule=self.rule)
+        self.assertEqual(self._read(task.name).count('<ObjectEvent>'), 2)
+
+    def test_interrupted_flush_is_recovered(self):
+        self._add('urn:a')
+        batch = OutputBatch.objects.create(criteria=self.criteria,
+                                           output_rule=self.rule.name)
+        OutputBatchItem.objects.update(batch=batch)
+        self.assertEqual(batching.flush_due(recover_after=300), [])
+        task_name, = batching.flush_due(recover_after=0)
+        self.assertIn('urn:a', self._read(task_name))
+
+    def test_step_batches_messages(self):
+        step = CreateOutputTaskStep(
+            None, **{'Output Rule': self.rule.name, 'Batch Window': '30',
+                     'Batch Size': '2', 'Delivery Engine': 'True',
+                     'run-immediately': 'False'})
+        for epc in ('urn:a', 'urn:b'):
+            context = RuleContext('Inbound', 'inbound-task')
+            context.context[ContextKeys.EPCIS_OUTPUT_CRITERIA_KEY.value] = \
+                self.criteria
+            context.context[ContextKeys.OUTBOUND_EPCIS_MESSAGE_KEY.value] = \
+                render(epc)
+            with mock.patch.object(step, 'info'):
+                step.execute(None, context)
+        task = models.Task.objects.get(rule=self.rule)
+        self.assertEqual(
+            context.context[ContextKeys.CREATED_TASK_NAME_KEY.value],
+            task.name)
+        self.assertEqual(self._read(task.name).count('<ObjectEvent>'), 2)
+
+    def test_step_priority_and_payload_threshold(self):
+        step = CreateOutputTaskStep(
+            None, **{'Output Rule': self.rule.name, 'Batch Window': '30',
+                     'Batch Size': '2', 'Delivery Engine': 'True',
+                     'Priority': '7', 'Payload Key Threshold': '100',
+                     'run-immediately': 'False'})
+        for epc in ('urn:a', 'urn:b'):
+            context = RuleContext('Inbound', 'inbound-task')
+            context.context[ContextKeys.EPCIS_OUTPUT_CRITERIA_KEY.value] = \
+                self.criteria
+            context.context[ContextKeys.OUTBOUND_EPCIS_MESSAGE_KEY.value] = \
+                render(epc)
+            with mock.patch.object(step, 'info'):
+                step.execute(None, context)
+            if epc == 'urn:a':
+                item = OutputBatchItem.objects.get()
+                self.assertEqual(item.data, '')
+                self.assertTrue(item.payload_key)
+        task = models.Task.objects.get(rule=self.rule)
+        parameters = dict(models.TaskParameter.objects.filter(
+            task=task).values_list('name', 'value'))
+        self.assertEqual(parameters[delivery.PRIORITY_PARAMETER], '7')
+        key = parameters[payloads.PAYLOAD_PARAMETER]
+        with payloads.open_payload(key) as payload:
+            self.assertEqual(payload.read().decode().count('<ObjectEvent>'),
+                             2)
+        self.assertEqual(self._read(task.name), '')
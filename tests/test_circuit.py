@@ -0,0 +1,160 @@
+from unittest import mock
+
+import requests
+from django.test import TestCase, override_settings
+from quartet_capture import models
+from quartet_capture.rules import RuleContext
+
+from quartet_output import delivery
+from quartet_output.errors import CircuitOpenError, SendRetryError, \
+    TaskDeferredError
+from quartet_output.models import EndPoint, EPCISOutputCriteria
+from quartet_output.steps import TransportStep
+from quartet_output.transport import circuit
+
+
+class TestCircuitBreaker(TestCase):
+
+    def setUp(self):
+        self.breaker = circuit.CircuitBreaker('http://partner', 2, 30)
+
+    def _fail(self, times):
+        for i in range(times):
+            self.breaker.before_send()
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self._fail(1)
+        self.breaker.record_success()
+        self._fail(1)
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+        self._fail(1)
+        self.assertEqual(self.breaker.state, circuit.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_send()
+
+    def test_half_open_allows_a_single_probe(self):
+        with mock.patch.object(circuit.time, 'monotonic', return_value=0):
+            self._fail(2)
+        with mock.patch.object(circuit.time, 'monotonic', return_value=30):
+            self.assertEqual(self.breaker.state, circuit.HALF_OPEN)
+            self.breaker.before_send()
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.before_send()
+            self.breaker.record_success()
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+        self.breaker.before_send()
+
+    def test_failed_probe_reopens(self):
+        with mock.patch.object(circuit.time, 'monotonic', return_value=0):
+            self._fail(2)
+        with mock.patch.object(circuit.time, 'monotonic', return_value=30):
+            self._fail(1)
+            self.assertEqual(self.breaker.state, circuit.OPEN)
+
+    def test_backoff_is_jittered_and_capped(self):
+        for attempt in range(10):
+            delay = circuit.get_backoff(attempt, 1, 8)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(8, 2 ** attempt))
+
+    def test_client_errors_are_not_endpoint_failures(self):
+        response = requests.Response()
+        response.status_code = 404
+        self.assertFalse(circuit.is_endpoint_failure(
+            requests.HTTPError(response=response)))
+        response.status_code = 503
+        self.assertTrue(circuit.is_endpoint_failure(
+            requests.HTTPError(response=response)))
+        self.assertTrue(circuit.is_endpoint_failure(ConnectionError()))
+
+
+class TestTransportRetries(TestCase):
+
+    def setUp(self):
+        circuit.reset_breakers()
+        self.criteria = EPCISOutputCriteria.objects.create(
+            name='Retry', end_point=EndPoint.objects.create(
+                name='Retry', urn='http://unittest.local/retry'))
+        rule = models.Rule.objects.create(name='Transport Rule')
+        self.task = models.Task.objects.create(rule=rule, status='RUNNING')
+        self.rule_context = RuleContext(rule.name, self.task.name)
+
+    def tearDown(self):
+        circuit.reset_breakers()
+
+    def _send(self, side_effect, **parameters):
+        step = TransportStep(self.task, **parameters)
+        with mock.patch.object(step, '_send_message',
+                               side_effect=side_effect) as send, \
+            mock.patch.object(circuit, 'get_backoff',
+                              return_value=5) as get_backoff:
+            step.send_with_retries('data', 'http', self.rule_context,
+                                   self.criteria)
+        return send, get_backoff
+
+    def test_failed_sends_defer_the_task(self):
+        for attempt in range(2):
+            with self.assertRaises(SendRetryError) as raised:
+                self._send(ConnectionError(), retries='2',
+                           **{'retry-backoff': '2'})
+            self.assertEqual(raised.exception.delay, 5)
+        self.assertEqual(models.TaskParameter.objects.get(
+            task=self.task, name=(delivery.DELIVERY_ATTEMPTS_PARAMETER
+                                  % self.criteria.end_point.pk)).value, '2')
+        # the retries are used up
+        with self.assertRaises(ConnectionError):
+            self._send(ConnectionError(), retries='2')
+        send, get_backoff = self._send([None], retries='2')
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(
+            circuit.get_breaker(self.criteria.end_point.urn).failures, 0)
+
+    def test_backoff_grows_with_the_attempts(self):
+        for attempt in range(2):
+            try:
+                self._send(ConnectionError(), retries='3',
+                           **{'retry-backoff': '2'})
+            except SendRetryError:
+                pass
+        with mock.patch.object(circuit, 'get_backoff',
+                               return_value=0) as get_backoff, \
+                self.assertRaises(SendRetryError):
+            step = TransportStep(self.task, retries='3',
+                                 **{'retry-backoff': '2'})
+            with mock.patch.object(step, '_send_message',
+                                   side_effect=ConnectionError()):
+                step.send_with_retries('data', 'http', self.rule_context,
+                                       self.criteria)
+        get_backoff.assert_called_once_with(2, 2.0, 30.0)
+
+    @override_settings(QUARTET_OUTPUT_CIRCUIT_FAILURE_THRESHOLD=3)
+    def test_open_circuit_defers(self):
+        for attempt in range(3):
+            with self.assertRaises(ConnectionError):
+                self._send(ConnectionError())
+        with self.assertRaises(CircuitOpenError) as raised:
+            send, get_backoff = self._send(ConnectionError())
+        self.assertIsInstance(raised.exception, TaskDeferredError)
+        self.assertLessEqual(raised.exception.delay, 30)
+        self.assertGreater(raised.exception.delay, 0)
+        self.assertEqual(
+            circuit.get_breaker(self.criteria.end_point.urn).state,
+            circuit.OPEN)
+
+    def test_circuit_is_off_by_default(self):
+        for attempt in range(10):
+            with self.assertRaises(ConnectionError):
+                self._send(ConnectionError())
+        self.assertEqual(
+            circuit.get_breaker(self.criteria.end_point.urn).state,
+            circuit.CLOSED)
+
+    def test_client_errors_are_not_retried(self):
+        response = requests.Response()
+        response.status_code = 400
+        with self.assertRaises(requests.HTTPError):
+            send, get_backoff = self._send(
+                requests.HTTPError(response=response), retries='3')
+        self.assertEqual(
+            circuit.get_breaker(self.criteria.end_point.urn).failures, 0)
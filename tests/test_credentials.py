@@ -0,0 +1,89 @@
+from io import StringIO
+
+import paramiko
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from django.test import TestCase, override_settings
+from requests.auth import HTTPBasicAuth, HTTPProxyAuth
+
+from quartet_output.models import AuthenticationInfo
+from quartet_output.transport import credentials
+
+
+def private_key_text(key: paramiko.PKey) -> str:
+    out = StringIO()
+    key.write_private_key(out)
+    return out.getvalue()
+
+
+def ed25519_key_text() -> str:
+    return ed25519.Ed25519PrivateKey.generate().private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH,
+        serialization.NoEncryption()).decode()
+
+
+class TestCredentialCache(TestCase):
+
+    def setUp(self):
+        credentials.clear()
+
+    def _create_auth(self, **kwargs):
+        return AuthenticationInfo.objects.create(
+            username='user', password='pass', description='Unit test auth.',
+            **kwargs)
+
+    def test_key_types(self):
+        for text, key_class in (
+            (private_key_text(paramiko.RSAKey.generate(1024)),
+             paramiko.RSAKey),
+            (private_key_text(paramiko.ECDSAKey.generate()),
+             paramiko.ECDSAKey),
+            (ed25519_key_text(), paramiko.Ed25519Key),
+        ):
+            key = credentials.get_private_key(
+                self._create_auth(private_key=text))
+            self.assertIsInstance(key, key_class)
+
+    def test_unsupported_key(self):
+        with self.assertRaises(paramiko.SSHException):
+            credentials.parse_private_key('not a key')
+
+    def test_keys_are_cached(self):
+        auth_info = self._create_auth(private_key=private_key_text(
+            paramiko.ECDSAKey.generate()))
+        key = credentials.get_private_key(auth_info)
+        reloaded = AuthenticationInfo.objects.get(pk=auth_info.pk)
+        self.assertIs(credentials.get_private_key(reloaded), key)
+
+    def test_save_invalidates(self):
+        auth_info = self._create_auth()
+        auth = credentials.get_http_auth(auth_info)
+        self.assertIs(credentials.get_http_auth(auth_info), auth)
+        auth_info.save()
+        self.assertIsNot(credentials.get_http_auth(auth_info), auth)
+
+    def test_changed_content_is_not_served(self):
+        auth_info = self._create_auth()
+        auth = credentials.get_http_auth(auth_info)
+        AuthenticationInfo.objects.filter(pk=auth_info.pk).update(
+            password='changed', type='proxy')
+        auth = credentials.get_http_auth(
+            AuthenticationInfo.objects.get(pk=auth_info.pk))
+        self.assertIsInstance(auth, HTTPProxyAuth)
+        self.assertEqual(auth.password, 'changed')
+
+    def test_http_auth(self):
+        auth = credentials.get_http_auth(self._create_auth(type='Basic'))
+        self.assertIsInstance(auth, HTTPBasicAuth)
+        self.assertEqual((auth.username, auth.password), ('user', 'pass'))
+
+    @override_settings(QUARTET_OUTPUT_CREDENTIAL_CACHE_SIZE=2)
+    def test_least_recently_used_is_evicted(self):
+        first, second, third = [self._create_auth() for i in range(3)]
+        auth = credentials.get_http_auth(first)
+        credentials.get_http_auth(second)
+        self.assertIs(credentials.get_http_auth(first), auth)
+        credentials.get_http_auth(third)
+        self.assertEqual(len(credentials._cache), 2)
+        self.assertIs(credentials.get_http_auth(first), auth)
+        self.assertNotIn(second.pk, [key[0] for key in credentials._cache])
@@ -0,0 +1,70 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from quartet_capture import models
+from quartet_capture.rules import RuleContext
+from quartet_output import criteria
+from quartet_output.models import AuthenticationInfo, EndPoint, \
+    EPCISOutputCriteria
+from quartet_output.steps import TransportStep
+
+
+class TestCriteriaCache(TestCase):
+
+    def setUp(self):
+        criteria.reset_cache()
+        self.addCleanup(criteria.reset_cache)
+        self.end_point = EndPoint.objects.create(
+            name='Partner', urn='http://unittest.local/partner')
+        self.auth = AuthenticationInfo.objects.create(username='partner')
+        self.criteria = EPCISOutputCriteria.objects.create(
+            name='Partner', end_point=self.end_point,
+            authentication_info=self.auth)
+
+    def test_warm_lookups_do_not_query(self):
+        criteria.get_criteria(name='Partner')
+        with self.assertNumQueries(0):
+            by_name = criteria.get_criteria(name='Partner')
+            by_pk = criteria.get_criteria(pk=self.criteria.pk)
+            self.assertEqual(by_name.end_point.urn, self.end_point.urn)
+            self.assertEqual(by_pk.authentication_info.username, 'partner')
+            self.assertEqual(by_name.get_end_points(), [self.end_point])
+        self.assertIsNot(by_name, by_pk)
+        self.assertEqual(criteria.get_cache().hits, 2)
+
+    def test_changes_clear_the_cache(self):
+        criteria.get_criteria(name='Partner')
+        self.end_point.urn = 'http://unittest.local/moved'
+        self.end_point.save()
+        self.assertEqual(criteria.get_criteria(name='Partner').end_point.urn,
+                         'http://unittest.local/moved')
+        archive = EndPoint.objects.create(name='Archive',
+                                          urn='http://unittest.local/a')
+        criteria.get_criteria(name='Partner')
+        self.criteria.additional_end_points.add(archive)
+        self.assertEqual(
+            len(criteria.get_criteria(name='Partner').get_end_points()), 2)
+        self.criteria.delete()
+        with self.assertRaises(EPCISOutputCriteria.DoesNotExist):
+            criteria.get_criteria(name='Partner')
+
+    @override_settings(QUARTET_OUTPUT_CRITERIA_CACHE_TTL=0)
+    def test_ttl(self):
+        criteria.get_criteria(name='Partner')
+        with self.assertNumQueries(2):
+            criteria.get_criteria(name='Partner')
+
+    def test_transport_step_queries(self):
+        rule = models.Rule.objects.create(name='Transport')
+        task = models.Task.objects.create(rule=rule, status='RUNNING')
+        models.TaskParameter.objects.create(
+            task=task, name='EPCIS Output Criteria', value='Partner')
+        step = TransportStep(task)
+        context = RuleContext(rule.name, task.name)
+        with mock.patch.object(step, 'info'), \
+                mock.patch.object(step, 'send_with_retries'):
+            step.execute('data', context)
+            # only the task parameter is read once the cache is warm
+            with self.assertNumQueries(1):
+                step.execute('data', context)
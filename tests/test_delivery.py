@@ -0,0 +1,226 @@
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from quartet_capture import models, rules
+from quartet_output import delivery
+from quartet_output.models import EndPoint, EPCISOutputCriteria
+from quartet_output.transport.sftp import SftpTransport
+
+
+class RecordingStep(rules.Step):
+    """
+    Records how many tasks are running at once for each endpoint.
+    """
+    lock = threading.Lock()
+    running = Counter()
+    peak = Counter()
+    data = []
+
+    def execute(self, data, rule_context):
+        criteria = models.TaskParameter.objects.get(
+            task__name=rule_context.task_name,
+            name='EPCIS Output Criteria').value
+        with self.lock:
+            RecordingStep.running[criteria] += 1
+            RecordingStep.peak[criteria] = max(
+                RecordingStep.peak[criteria], RecordingStep.running[criteria])
+            RecordingStep.data.append(data)
+        time.sleep(0.05)
+        with self.lock:
+            RecordingStep.running[criteria] -= 1
+        if data == b'fail':
+            raise ValueError('Unit test failure.')
+
+    def declared_parameters(self):
+        return {}
+
+    def on_failure(self):
+        pass
+
+
+class TestDeliveryEngine(TransactionTestCase):
+
+    def setUp(self):
+        RecordingStep.running.clear()
+        RecordingStep.peak.clear()
+        RecordingStep.data.clear()
+        rule = models.Rule.objects.create(name='Delivery Rule')
+        models.Step.objects.create(
+            rule=rule, order=1, name='Record',
+            step_class='tests.test_delivery.RecordingStep')
+        for name in ('Criteria A', 'Criteria B'):
+            EPCISOutputCriteria.objects.create(
+                name=name, end_point=EndPoint.objects.create(
+                    name=name, urn='http://%s' % name[-1].lower()))
+
+    def _create_task(self, data, criteria='Criteria A', priority=0):
+        return delivery.create_task(data, 'Delivery Rule', task_parameters=[
+            models.TaskParameter(name='EPCIS Output Criteria', value=criteria)
+        ] + [delivery.get_priority_parameter(priority)] * bool(priority))
+
+    def test_tasks_run_concurrently_per_endpoint(self):
+        tasks = [self._create_task('message %s' % i, criteria)
+                 for i in range(6)
+                 for criteria in ('Criteria A', 'Criteria B')]
+        engine = delivery.DeliveryEngine(concurrency=8,
+                                         endpoint_concurrency=2,
+                                         batch_size=5, poll_interval=0.01)
+        self.assertEqual(engine.start(once=True), len(tasks))
+        self.assertEqual(RecordingStep.peak['Criteria A'], 2)
+        self.assertEqual(RecordingStep.peak['Criteria B'], 2)
+        self.assertEqual(
+            models.Task.objects.filter(status='FINISHED').count(), len(tasks))
+        self.assertEqual(sorted(RecordingStep.data),
+                         sorted(('message %s' % i).encode()
+                                for i in range(6) for criteria in range(2)))
+
+    def test_failures_are_recorded(self):
+        task = self._create_task('fail')
+        delivery.DeliveryEngine(poll_interval=0.01).start(once=True)
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'FAILED')
+
+    def test_celery_tasks_are_ignored(self):
+        task = self._create_task('message')
+        models.TaskParameter.objects.filter(
+            task=task, name=delivery.ENGINE_PARAMETER).delete()
+        out = StringIO()
+        call_command('deliver_output_tasks', '--once', stdout=out)
+        self.assertIn('Processed 0 output tasks.', out.getvalue())
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'QUEUED')
+
+    def test_claim_order(self):
+        backlog = [self._create_task('a %s' % i) for i in range(4)]
+        other = [self._create_task('b %s' % i, 'Criteria B')
+                 for i in range(2)]
+        urgent = self._create_task('urgent', priority=5)
+        engine = delivery.DeliveryEngine()
+        self.addCleanup(engine._executor.shutdown)
+        self.addCleanup(engine._db_executor.shutdown)
+        end_points = dict(EPCISOutputCriteria.objects.values_list(
+            'name', 'end_point_id'))
+        claimed = engine.claim_tasks(5)
+        self.assertEqual(
+            [(task.name, end_point_id) for task, end_point_id in claimed],
+            [(urgent.name, end_points['Criteria A']),
+             (backlog[0].name, end_points['Criteria A']),
+             (other[0].name, end_points['Criteria B']),
+             (backlog[1].name, end_points['Criteria A']),
+             (other[1].name, end_points['Criteria B'])])
+        self.assertEqual([task.name for task, end_point_id in
+                          engine.claim_tasks(5)],
+                         [task.name for task in backlog[2:]])
+
+    def test_claims_only_free_endpoint_slots(self):
+        for i in range(4):
+            self._create_task('a %s' % i)
+        other = self._create_task('b', 'Criteria B')
+        engine = delivery.DeliveryEngine(endpoint_concurrency=2)
+        self.addCleanup(engine._executor.shutdown)
+        self.addCleanup(engine._db_executor.shutdown)
+        end_points = dict(EPCISOutputCriteria.objects.values_list(
+            'name', 'end_point_id'))
+        claimed = engine.claim_tasks(10, {end_points['Criteria A']: 1})
+        self.assertEqual(
+            Counter(end_point_id for task, end_point_id in claimed),
+            {end_points['Criteria A']: 1, end_points['Criteria B']: 1})
+        self.assertEqual(engine.claim_tasks(
+            10, {end_points['Criteria A']: 2, end_points['Criteria B']: 0}),
+            [])
+        self.assertIn(other.name, [task.name for task, e in claimed])
+
+    def test_queue_depths(self):
+        for i in range(3):
+            self._create_task('a %s' % i)
+        self._create_task('b', 'Criteria B', priority=2)
+        depths = delivery.get_queue_depths()
+        self.assertEqual(
+            [(depth['queued'], depth['priority']) for depth in depths],
+            [(3, 0), (1, 2)])
+        out = StringIO()
+        call_command('output_queue_depth', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith('Criteria A'))
+
+    def test_sftp_batch(self):
+        step = models.Step.objects.get(rule__name='Delivery Rule')
+        models.StepParameter.objects.create(step=step, name='file-extension',
+                                            value='json')
+        tasks = [self._create_task('message %s' % i, criteria)
+                 for i, criteria in enumerate(('Criteria A', 'Criteria A',
+                                               'Criteria B'))]
+        failed = '%s.json' % tasks[1].name
+
+        def put_files(files, output_criteria, channels):
+            return {name: IOError('full') if name == failed else None
+                    for name, data in files}
+
+        with mock.patch.object(SftpTransport, 'sftp_put_files',
+                               side_effect=put_files) as sftp_put_files:
+            out = StringIO()
+            call_command('deliver_output_tasks', '--sftp-batch',
+                         '--rule', 'Delivery Rule', '--sftp-channels', '2',
+                         stdout=out)
+        self.assertIn('Processed 3 output tasks.', out.getvalue())
+        self.assertEqual(sftp_put_files.call_count, 2)
+        files, output_criteria, channels = sftp_put_files.call_args_list[0][0]
+        self.assertEqual(output_criteria.name, 'Criteria A')
+        self.assertEqual(files, [('%s.json' % tasks[0].name, b'message 0'),
+                                 (failed, b'message 1')])
+        self.assertEqual(channels, 2)
+        self.assertEqual(
+            list(models.Task.objects.filter(name__in=[
+                task.name for task in tasks]).order_by(
+                'name').values_list('name', 'status')),
+            sorted([(tasks[0].name, 'FINISHED'), (tasks[1].name, 'FAILED'),
+                    (tasks[2].name, 'FINISHED')])
+        )
+        self.assertFalse(RecordingStep.data)
+
+    def test_batch_runs_fan_out_criteria_through_the_rule(self):
+        criteria = EPCISOutputCriteria.objects.get(name='Criteria B')
+        criteria.additional_end_points.add(
+            EndPoint.objects.get(name='Criteria A'))
+        task = self._create_task('message', 'Criteria B')
+        with mock.patch.object(SftpTransport,
+                               'sftp_put_files') as sftp_put_files:
+            call_command('deliver_output_tasks', '--sftp-batch',
+                         '--rule', 'Delivery Rule', stdout=StringIO())
+        sftp_put_files.assert_not_called()
+        self.assertEqual(RecordingStep.data, [b'message'])
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'FINISHED')
+
+    def test_stale_claims_are_queued_again(self):
+        stale, fresh = self._create_task('a'), self._create_task('b')
+        celery_task = models.Task.objects.create(
+            rule=stale.rule, status='RUNNING')
+        models.Task.objects.filter(
+            name__in=[stale.name, fresh.name, celery_task.name]
+        ).update(status='RUNNING')
+        models.Task.objects.filter(
+            name__in=[stale.name, celery_task.name]
+        ).update(status_changed=timezone.now() - timedelta(seconds=120))
+        self.assertEqual(delivery.requeue_stale_tasks(lease=60), 1)
+        self.assertEqual(
+            dict(models.Task.objects.filter(name__in=[
+                stale.name, fresh.name, celery_task.name
+            ]).values_list('name', 'status')),
+            {stale.name: 'QUEUED', fresh.name: 'RUNNING',
+             celery_task.name: 'RUNNING'})
+        delivery.renew_lease([fresh.name])
+        self.assertEqual(delivery.requeue_stale_tasks(lease=60), 0)
+
+    def test_batch_delivery_is_abstract(self):
+        with self.assertRaises(TypeError):
+            delivery.BatchDelivery(['Delivery Rule'])
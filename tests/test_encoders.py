@@ -0,0 +1,84 @@
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from EPCPyYes.core.SBDH import sbdh, template_sbdh
+from EPCPyYes.core.v1_2 import template_events
+from quartet_output import encoders
+from tests import event_factory
+
+
+def stdlib_encoding():
+    """
+    Forces the encoders module to use the standard library json module
+    even if orjson is installed.
+    """
+    encoder = json.JSONEncoder()
+    return mock.patch.multiple(
+        encoders,
+        dumps=lambda obj: encoder.encode(obj).encode(),
+        ITEM_SEPARATOR=b', ',
+        KEY_SEPARATOR=b': '
+    )
+
+
+class TestFastJSONEncoder(TestCase):
+
+    def _create_events(self):
+        return event_factory.pallet('1') + [
+            event_factory.transaction_event(
+                event_factory.sgtin('1', '4555555'),
+                [event_factory.sgtin('2', '4555555')]),
+            event_factory.transformation_event(
+                [event_factory.sgtin('3')], [event_factory.sgtin('4')]),
+        ]
+
+    def _create_header(self):
+        return template_sbdh.StandardBusinessDocumentHeader(
+            document_identification=sbdh.DocumentIdentification(
+                creation_date_and_time='2019-06-01T12:00:00',
+                document_type=sbdh.DocumentType.EVENTS),
+            partners=[sbdh.Partner(
+                partner_type=sbdh.PartnerType.SENDER,
+                partner_id=sbdh.PartnerIdentification(
+                    authority='SGLN',
+                    value='urn:epc:id:sgln:039999.999999.0'))]
+        )
+
+    def test_events_match_render_json(self):
+        for event in self._create_events():
+            self.assertEqual(
+                json.loads(encoders.render_event(event)),
+                json.loads(event.render_json())
+            )
+
+    def test_document_matches_render_json(self):
+        document = template_events.EPCISEventListDocument(
+            self._create_events(), header=self._create_header())
+        self.assertEqual(json.loads(encoders.render_json(document)),
+                         json.loads(document.render_json()))
+
+    def test_stdlib_document_is_identical(self):
+        document = template_events.EPCISEventListDocument(
+            self._create_events(), header=self._create_header())
+        with stdlib_encoding():
+            self.assertEqual(encoders.render_json(document),
+                             document.render_json())
+
+    def test_typed_document_lists(self):
+        document = template_events.EPCISDocument(
+            object_events=[event_factory.object_event(
+                [event_factory.sgtin('5')])],
+            aggregation_events=[event_factory.aggregation_event(
+                event_factory.sgtin('6'), [event_factory.sgtin('7')])]
+        )
+        with stdlib_encoding():
+            self.assertEqual(encoders.render_json(document),
+                             document.render_json())
+
+    def test_custom_encoder_is_used(self):
+        event = event_factory.object_event([event_factory.sgtin('8')])
+        event.encoder = mock.Mock()
+        event.encoder.default.return_value = {'custom': True}
+        self.assertEqual(encoders.encode_event(event), {'custom': True})
@@ -0,0 +1,117 @@
+import io
+import os
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+
+from quartet_capture import models
+from quartet_capture.rules import RuleContext
+from quartet_output import delivery
+from quartet_output.models import AuthenticationInfo, CriteriaEndPoint, \
+    EndPoint, EPCISOutputCriteria
+from quartet_output.steps import TransportStep
+from quartet_output.transport import file
+
+
+@override_settings(QUARTET_OUTPUT_FILE_FSYNC='never')
+class TestFanOut(TransactionTestCase):
+
+    def setUp(self):
+        self.directories = []
+        end_points = []
+        for name in ('Partner', 'Archive', 'Backup'):
+            directory = tempfile.TemporaryDirectory()
+            self.addCleanup(directory.cleanup)
+            self.directories.append(directory.name)
+            end_points.append(EndPoint.objects.create(
+                name=name, urn='file://%s' % directory.name))
+        self.criteria = EPCISOutputCriteria.objects.create(
+            name='Fan Out', end_point=end_points[0])
+        self.criteria.additional_end_points.set(end_points)
+        self.rule = models.Rule.objects.create(name='Fan Out Rule')
+        self.task = models.Task.objects.create(rule=self.rule,
+                                               status='RUNNING')
+        models.TaskParameter.objects.create(
+            task=self.task, name='EPCIS Output Criteria', value='Fan Out')
+
+    def _execute(self, data='<epcis/>'):
+        TransportStep(self.task).execute(
+            data, RuleContext(self.rule.name, self.task.name))
+
+    def test_end_points(self):
+        self.assertEqual([e.name for e in self.criteria.get_end_points()],
+                         ['Partner', 'Archive', 'Backup'])
+        copy = self.criteria.for_end_point(
+            EndPoint.objects.get(name='Backup'))
+        self.assertEqual(copy.end_point.name, 'Backup')
+        self.assertEqual(self.criteria.end_point.name, 'Partner')
+
+    def test_credentials_stay_with_their_end_point(self):
+        partner, backup = (AuthenticationInfo.objects.create(
+            username=name, password='secret', type='Basic')
+            for name in ('partner', 'backup'))
+        self.criteria.authentication_info = partner
+        self.criteria.save()
+        CriteriaEndPoint.objects.filter(
+            criteria=self.criteria, end_point__name='Backup'
+        ).update(authentication_info=backup)
+        end_points = {end_point.name: end_point
+                      for end_point in self.criteria.get_end_points()}
+        self.assertEqual(self.criteria.for_end_point(
+            end_points['Partner']).authentication_info, partner)
+        self.assertIsNone(self.criteria.for_end_point(
+            end_points['Archive']).authentication_info)
+        self.assertEqual(self.criteria.for_end_point(
+            end_points['Backup']).authentication_info, backup)
+
+    def test_delivers_to_every_end_point_in_parallel(self):
+        threads = set()
+        put = file.FileTransportMixin.file_put
+
+        def file_put(*args, **kwargs):
+            threads.add(threading.current_thread().name)
+            return put(*args, **kwargs)
+
+        with mock.patch.object(file.FileTransportMixin, 'file_put',
+                               autospec=True, side_effect=file_put):
+            self._execute(io.BytesIO(b'<epcis/>'))
+        for directory in self.directories:
+            with open(os.path.join(directory,
+                                   '%s.xml' % self.task.name)) as f:
+                self.assertEqual(f.read(), '<epcis/>')
+        self.assertNotIn(threading.current_thread().name, threads)
+        self.assertEqual(
+            list(models.TaskParameter.objects.filter(
+                task=self.task, name__startswith='Delivery Status'
+            ).values_list('value', flat=True).distinct()),
+            [delivery.DELIVERED])
+
+    def test_retry_only_resends_failed_end_points(self):
+        put = file.FileTransportMixin.file_put
+        sent = []
+
+        def fail_archive(transport, data, rule_context, criteria, *args):
+            sent.append(criteria.end_point.name)
+            if criteria.end_point.name == 'Archive':
+                raise OSError('The archive share is not mounted.')
+            return put(transport, data, rule_context, criteria, *args)
+
+        with mock.patch.object(file.FileTransportMixin, 'file_put',
+                               autospec=True, side_effect=fail_archive):
+            with self.assertRaises(OSError):
+                self._execute()
+        self.assertEqual(sorted(sent), ['Archive', 'Backup', 'Partner'])
+        archive = EndPoint.objects.get(name='Archive')
+        self.assertEqual(models.TaskParameter.objects.get(
+            task=self.task,
+            name=delivery.DELIVERY_STATUS_PARAMETER % archive.pk).value,
+            delivery.FAILED)
+        sent.clear()
+        with mock.patch.object(file.FileTransportMixin, 'file_put',
+                               autospec=True, side_effect=put) as file_put:
+            self._execute()
+        self.assertEqual(
+            [call[0][3].end_point.name for call in file_put.call_args_list],
+            ['Archive'])
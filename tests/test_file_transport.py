@@ -0,0 +1,139 @@
+import io
+import os
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from quartet_capture.rules import RuleContext
+
+from quartet_output.models import EndPoint, EPCISOutputCriteria
+from quartet_output.steps import TransportStep
+from quartet_output.transport import file, registry
+
+
+class TestFileTransport(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        end_point = EndPoint.objects.create(
+            name='Drop', urn='file://%s' % self.directory.name)
+        self.criteria = EPCISOutputCriteria.objects.create(
+            name='Drop', end_point=end_point)
+        self.context = RuleContext('Drop', task_name='task-1')
+
+    def test_registered(self):
+        self.assertIsInstance(registry.get_transport('file'),
+                              file.FileTransport)
+
+    def test_file_put(self):
+        path = file.FileTransportMixin().file_put(
+            '<epcis/>', self.context, self.criteria, 'txt')
+        self.assertEqual(path, os.path.join(self.directory.name,
+                                            'task-1.txt'))
+        with open(path) as f:
+            self.assertEqual(f.read(), '<epcis/>')
+        self.assertEqual(os.listdir(self.directory.name), ['task-1.txt'])
+
+    def test_stream_and_quoted_path(self):
+        directory = os.path.join(self.directory.name, 'partner inbound')
+        os.mkdir(directory)
+        self.criteria.end_point.urn = 'file://%s' % directory.replace(
+            ' ', '%20')
+        path = file.FileTransportMixin().file_put(
+            io.BytesIO(b'x' * 100000), self.context, self.criteria)
+        self.assertEqual(os.path.getsize(path), 100000)
+
+    def test_no_partial_file_on_failure(self):
+        with mock.patch('quartet_output.transport.file.os.replace',
+                        side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                file.write_atomic(self.directory.name, 'a.xml', b'data')
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_partial_file_is_hidden(self):
+        seen = []
+
+        def replace(source, destination):
+            seen.extend(os.listdir(self.directory.name))
+            os.rename(source, destination)
+
+        with mock.patch('quartet_output.transport.file.os.replace',
+                        side_effect=replace):
+            file.write_atomic(self.directory.name, 'a.xml', b'data')
+        self.assertEqual(len(seen), 1)
+        self.assertTrue(seen[0].startswith('.a.xml.'))
+        self.assertTrue(seen[0].endswith('.part'))
+
+    def test_fsync_never(self):
+        with mock.patch('quartet_output.transport.file.os.fdatasync') as sync:
+            file.write_atomic(self.directory.name, 'a.xml', b'data',
+                              file.NEVER)
+        sync.assert_not_called()
+
+    def test_group_commit(self):
+        committer = file.GroupCommit(window=0.02)
+        with mock.patch('quartet_output.transport.file.get_group_commit',
+                        return_value=committer):
+            threads = [
+                threading.Thread(target=file.write_atomic, args=(
+                    self.directory.name, '%s.xml' % i, b'data', file.GROUP))
+                for i in range(10)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(os.listdir(self.directory.name)), 10)
+        self.assertLess(committer.commits, 10)
+
+    def test_group_commit_error(self):
+        committer = file.GroupCommit(window=0)
+        for syncfs in (None, mock.Mock(side_effect=OSError('I/O error'))):
+            with mock.patch('quartet_output.transport.file.get_group_commit',
+                            return_value=committer), \
+                    mock.patch.object(file, '_syncfs', syncfs), \
+                    mock.patch('quartet_output.transport.file.os.fdatasync',
+                               side_effect=OSError('I/O error')):
+                with self.assertRaises(OSError):
+                    file.write_atomic(self.directory.name, 'a.xml', b'data',
+                                      file.GROUP)
+            self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_group_commit_syncs_each_filesystem_once(self):
+        committer = file.GroupCommit(window=0)
+        batch = []
+        for i in range(3):
+            temp_file = tempfile.NamedTemporaryFile(
+                dir=self.directory.name, delete=False)
+            temp_file.write(b'data')
+            batch.append(file._PendingFile(
+                temp_file, os.path.join(self.directory.name, '%s.xml' % i)))
+        with mock.patch.object(file, '_syncfs') as syncfs, \
+                mock.patch('quartet_output.transport.file.os.fdatasync') \
+                as fdatasync:
+            descriptor = batch[0].file.fileno()
+            committer._sync(batch)
+        syncfs.assert_called_once_with(descriptor)
+        fdatasync.assert_not_called()
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['0.xml', '1.xml', '2.xml'])
+
+    def test_syncfs(self):
+        syncfs = file.load_syncfs()
+        if syncfs is None:
+            self.skipTest('syncfs(2) is not available.')
+        with open(os.path.join(self.directory.name, 'a.xml'), 'wb') as f:
+            syncfs(f.fileno())
+        with self.assertRaises(OSError):
+            syncfs(-1)
+
+    @override_settings(QUARTET_OUTPUT_FILE_FSYNC='never')
+    def test_transport_step(self):
+        step = TransportStep(None)
+        protocol = step._supports_protocol(self.criteria.end_point)
+        with mock.patch.object(TransportStep, 'info'):
+            step._send_message('<epcis/>', protocol, self.context,
+                               self.criteria)
+        self.assertEqual(os.listdir(self.directory.name), ['task-1.xml'])
@@ -0,0 +1,124 @@
+import io
+import threading
+import zlib
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.test import TestCase
+
+from quartet_output.errors import ContentEncodingNotSupportedError
+from quartet_output.models import EndPoint, EPCISOutputCriteria
+from quartet_output.transport import sessions
+from quartet_output.transport.http import CompressionStatistics, \
+    HttpTransportMixin
+
+
+class StreamingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _read_body(self):
+        if self.headers['Transfer-Encoding'] == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                if not size:
+                    return body
+        return self.rfile.read(int(self.headers['Content-Length']))
+
+    def do_POST(self):
+        self.server.requests.append((self.headers, self._read_body()))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_PUT = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestStreamingUpload(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StreamingHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.criteria = EPCISOutputCriteria.objects.create(
+            name='Streaming', end_point=EndPoint.objects.create(
+                name='Streaming',
+                urn='http://127.0.0.1:%s/' % self.server.server_port))
+        self.rule_context = type('Context', (), {'task_name': 'task'})()
+
+    def tearDown(self):
+        sessions.close_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _send(self, data, **kwargs):
+        response = HttpTransportMixin().post_data(
+            data, self.rule_context, self.criteria, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return self.server.requests[-1]
+
+    def test_file_is_sent_with_content_length(self):
+        data = b'<epcis>' + b'x' * 200000 + b'</epcis>'
+        headers, body = self._send(io.BytesIO(data))
+        self.assertEqual(headers['Content-Length'], str(len(data)))
+        self.assertIsNone(headers['Transfer-Encoding'])
+        self.assertEqual(body, data)
+
+    def test_iterator_is_sent_chunked(self):
+        chunks = (('<event>%s</event>' % i).encode() for i in range(1000))
+        headers, body = self._send(chunks, http_put=True)
+        self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+        self.assertEqual(body, b''.join(
+            ('<event>%s</event>' % i).encode() for i in range(1000)))
+
+    def test_multipart_file(self):
+        data = b'<epcis/>' * 1000
+        headers, body = self._send(io.BytesIO(data), body_raw=False)
+        self.assertEqual(headers['Content-Length'], str(len(body)))
+        content_type = headers['Content-Type'].encode()
+        message = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + content_type + b'\r\n\r\n' + body)
+        part = next(message.iter_parts())
+        self.assertEqual(part.get_filename(), 'task.xml')
+        self.assertEqual(part.get_content(), data)
+
+    def test_multipart_iterator_is_sent_chunked(self):
+        headers, body = self._send(iter(['<epcis>', '</epcis>']),
+                                   body_raw=False)
+        self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+        self.assertIn(b'\r\n\r\n<epcis></epcis>\r\n--', body)
+
+    def test_gzip_content_encoding(self):
+        data = '<epcis>%s</epcis>' % ('<event>1</event>' * 10000)
+        statistics = CompressionStatistics()
+        headers, body = self._send(data, content_encoding='gzip',
+                                   compression_level=9,
+                                   statistics=statistics)
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS),
+                         data.encode())
+        self.assertEqual(statistics.bytes_in, len(data))
+        self.assertEqual(statistics.bytes_out, len(body))
+        self.assertGreater(statistics.ratio, 10)
+
+    def test_deflate_content_encoding_of_a_file(self):
+        data = b'<epcis/>' * 10000
+        headers, body = self._send(io.BytesIO(data),
+                                   content_encoding='deflate')
+        self.assertEqual(headers['Content-Encoding'], 'deflate')
+        self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+        self.assertEqual(zlib.decompress(body), data)
+
+    def test_unsupported_content_encoding(self):
+        with self.assertRaises(ContentEncodingNotSupportedError):
+            HttpTransportMixin().post_data('data', self.rule_context,
+                                           self.criteria,
+                                           content_encoding='br')
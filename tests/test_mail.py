@@ -0,0 +1,115 @@
+import gzip
+import smtplib
+from email import message_from_bytes
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from quartet_capture import models
+from quartet_output import delivery
+from quartet_output.models import EndPoint, EPCISOutputCriteria
+from quartet_output.transport import mail
+from quartet_output.transport.mail import MailMixin
+from tests.smtp_server import LocalSmtpServer
+
+
+def smtp_settings(server):
+    return override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.port)
+
+
+def create_criteria(name='Mail Criteria'):
+    return EPCISOutputCriteria.objects.create(
+        name=name, end_point=EndPoint.objects.create(
+            name=name, urn='mailto:partner@unittest.local'))
+
+
+class TestSharedConnection(TestCase):
+
+    def tearDown(self):
+        mail.close_connection()
+
+    def setUp(self):
+        self.criteria = create_criteria()
+
+    def _create_email(self, data='<epcis/>'):
+        return MailMixin().create_email(data, 'task', self.criteria)
+
+    def test_connection_is_reused(self):
+        with LocalSmtpServer() as server, smtp_settings(server):
+            mail.close_connection()
+            for i in range(3):
+                mail.send_messages([self._create_email()])
+        self.assertEqual(len(server.messages), 3)
+        self.assertEqual(server.connections, 1)
+
+    def test_reconnects_after_server_closes(self):
+        with LocalSmtpServer(close_connections=True) as server, \
+                smtp_settings(server):
+            mail.close_connection()
+            email = self._create_email()
+            self.assertEqual(mail.send_messages([email, email]), 2)
+        self.assertEqual(len(server.messages), 2)
+        self.assertEqual(server.connections, 2)
+
+    def test_unacknowledged_messages_are_not_sent_again(self):
+        with LocalSmtpServer(drop_before_reply=True) as server, \
+                smtp_settings(server):
+            mail.close_connection()
+            email = self._create_email()
+            results = mail.send_message_batch([email, email])
+        self.assertEqual([type(error) for error in results],
+                         [smtplib.SMTPServerDisconnected] * 2)
+        self.assertEqual(len(server.messages), 2)
+        self.assertEqual(server.connections, 2)
+
+    def test_large_attachments_are_gzipped(self):
+        data = '<epcis>%s</epcis>' % ('x' * 1000)
+        email = MailMixin().create_email(data, 'task', self.criteria,
+                                         'xml', 'text/xml',
+                                         compress_threshold=100)
+        filename, content, mimetype = email.attachments[0]
+        self.assertEqual(filename, 'task.xml.gz')
+        self.assertEqual(mimetype, 'application/gzip')
+        self.assertEqual(gzip.decompress(content).decode(), data)
+
+    def test_small_attachments_are_not_gzipped(self):
+        email = MailMixin().create_email('<epcis/>', 'task',
+                                         self.criteria, 'xml',
+                                         compress_threshold=100)
+        self.assertEqual(email.attachments[0][0], 'task.xml')
+
+
+class TestMailBatchDelivery(TransactionTestCase):
+
+    def tearDown(self):
+        mail.close_connection()
+
+    def test_mail_batch(self):
+        rule = models.Rule.objects.create(name='Mail Rule')
+        step = models.Step.objects.create(
+            rule=rule, order=1, name='Transport',
+            step_class='quartet_output.steps.TransportStep')
+        models.StepParameter.objects.create(
+            step=step, name='gzip-attachment-threshold', value='10')
+        create_criteria()
+        tasks = [delivery.create_task('<epcis>%s</epcis>' % i, 'Mail Rule',
+                                      task_parameters=[models.TaskParameter(
+                                          name='EPCIS Output Criteria',
+                                          value='Mail Criteria')])
+                 for i in range(3)]
+        with LocalSmtpServer() as server, smtp_settings(server):
+            mail.close_connection()
+            out = StringIO()
+            call_command('deliver_output_tasks', '--mail-batch',
+                         '--rule', 'Mail Rule', stdout=out)
+        self.assertIn('Processed 3 output tasks.', out.getvalue())
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(len(server.messages), 3)
+        attachment = message_from_bytes(server.messages[0]).get_payload()[1]
+        self.assertEqual(attachment.get_filename(),
+                         '%s.txt.gz' % tasks[0].name)
+        self.assertEqual(
+            models.Task.objects.filter(status='FINISHED').count(), 3)
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from quartet_capture import models
+from quartet_capture.defaults import get_storage
+from quartet_capture.rules import RuleContext
+
+from quartet_output import delivery, payloads
+from quartet_output.models import EndPoint, EPCISOutputCriteria
+from quartet_output.steps import ContextKeys, CreateOutputTaskStep, \
+    TransportStep
+
+
+class TestPayloads(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings = override_settings(
+            QUARTET_OUTPUT_PAYLOAD_DIR=os.path.join(self.directory.name,
+                                                    'store'),
+            QUARTET_OUTPUT_FILE_FSYNC='never')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.rule = models.Rule.objects.create(name='Transport Rule')
+        self.outbound = os.path.join(self.directory.name, 'outbound')
+        os.mkdir(self.outbound)
+        end_point = EndPoint.objects.create(name='Drop',
+                                            urn='file://%s' % self.outbound)
+        self.criteria = EPCISOutputCriteria.objects.create(
+            name='Drop', end_point=end_point)
+
+    def test_store_once(self):
+        key = payloads.store('<epcis/>')
+        self.assertEqual(payloads.store(b'<epcis/>'), key)
+        directories, files = payloads.get_storage().listdir(
+            '%s/%s' % (payloads.PAYLOAD_DIRECTORY, key[:2]))
+        self.assertEqual(files, [key])
+        with payloads.open_payload(key) as payload:
+            self.assertEqual(payload.read(), b'<epcis/>')
+
+    def test_invalid_key(self):
+        with self.assertRaises(ValueError):
+            payloads.open_payload('../../etc/passwd')
+
+    def _create_task(self, data):
+        step = CreateOutputTaskStep(
+            None, **{'Output Rule': self.rule.name,
+                     'Payload Key Threshold': '10',
+                     'Delivery Engine': 'True',
+                     'run-immediately': 'False'})
+        context = RuleContext('Inbound', 'inbound-task')
+        context.context[ContextKeys.EPCIS_OUTPUT_CRITERIA_KEY.value] = \
+            self.criteria
+        context.context[ContextKeys.OUTBOUND_EPCIS_MESSAGE_KEY.value] = data
+        with mock.patch.object(step, 'info'):
+            step.execute(None, context)
+        return models.Task.objects.get(
+            name=context.context[ContextKeys.CREATED_TASK_NAME_KEY.value])
+
+    def test_task_is_sent_from_payload(self):
+        data = '<epcis>%s</epcis>' % ('x' * 1000)
+        task = self._create_task(data)
+        with get_storage().open('%s.dat' % task.name) as task_file:
+            self.assertEqual(task_file.read(), b'')
+        self.assertEqual(
+            models.TaskParameter.objects.get(
+                task=task, name=payloads.PAYLOAD_PARAMETER).value,
+            payloads.get_key(data.encode()))
+        batch = delivery.MailBatchDelivery([self.rule.name])
+        self.assertEqual(batch.read_data(task), data.encode())
+        step = TransportStep(task)
+        with mock.patch.object(step, 'info'):
+            step.execute(b'', RuleContext(self.rule.name, task.name))
+        with open(os.path.join(self.outbound, '%s.xml' % task.name)) as f:
+            self.assertEqual(f.read(), data)
+
+    def test_small_data_is_not_stored(self):
+        task = self._create_task('<a/>')
+        self.assertFalse(models.TaskParameter.objects.filter(
+            task=task, name=payloads.PAYLOAD_PARAMETER).exists())
+
+    def test_purge(self):
+        task = self._create_task('<epcis>in use</epcis>')
+        unused = payloads.store('<epcis>unused</epcis>')
+        old = time.time() - 3600
+        for key in (unused, payloads.store('<epcis>in use</epcis>')):
+            os.utime(payloads.get_storage().path(payloads.get_name(key)),
+                     (old, old))
+        self.assertEqual(payloads.purge(older_than=7200), 0)
+        call_command('purge_payloads', '--older-than', '60',
+                     stdout=mock.Mock())
+        self.assertFalse(payloads.get_storage().exists(
+            payloads.get_name(unused)))
+        task.status = 'FINISHED'
+        task.save()
+        self.assertEqual(payloads.purge(older_than=60), 1)
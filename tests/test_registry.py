@@ -0,0 +1,122 @@
+import os
+import subprocess
+import sys
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from quartet_output.errors import ProtocolNotSupportedError
+from quartet_output.models import EndPoint, EPCISOutputCriteria
+from quartet_output.steps import TransportStep
+from quartet_output.transport import registry
+
+
+class RecordingTransport:
+    sent = []
+
+    def send(self, step, data, rule_context, output_criteria):
+        RecordingTransport.sent.append((data, output_criteria.name))
+
+
+class TestTransportRegistry(TestCase):
+
+    def setUp(self):
+        registry.reset_registry()
+        RecordingTransport.sent.clear()
+
+    def tearDown(self):
+        registry.reset_registry()
+
+    def test_steps_do_not_import_transports(self):
+        code = ('import django, sys; django.setup(); '
+                'import quartet_output.steps; '
+                'print(sorted(m for m in ("paramiko", "requests") '
+                'if m in sys.modules))')
+        output = subprocess.check_output(
+            [sys.executable, '-c', code],
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='tests.settings',
+                     PYTHONPATH='.'), stderr=subprocess.DEVNULL)
+        self.assertEqual(output.decode().strip(), '[]')
+
+    def test_http_and_https_share_a_transport(self):
+        self.assertIs(registry.get_transport('http'),
+                      registry.get_transport('HTTPS'))
+
+    def test_unknown_scheme(self):
+        self.assertFalse(registry.get_registry().supports('ftp'))
+        with self.assertRaises(ProtocolNotSupportedError):
+            registry.get_transport('ftp')
+
+    @override_settings(QUARTET_OUTPUT_TRANSPORTS={
+        'ftp': 'tests.test_registry.RecordingTransport'})
+    def test_transport_from_settings(self):
+        end_point = EndPoint.objects.create(name='FTP',
+                                            urn='ftp://unittest.local/in')
+        criteria = EPCISOutputCriteria.objects.create(name='FTP',
+                                                      end_point=end_point)
+        step = TransportStep(None)
+        protocol = step._supports_protocol(end_point)
+        step._send_message('data', protocol, None, criteria)
+        self.assertEqual(RecordingTransport.sent, [('data', 'FTP')])
+
+    def test_transport_from_entry_point(self):
+        entry_point = mock.Mock()
+        entry_point.name = 'FTP'
+        entry_point.load.return_value = RecordingTransport
+        with mock.patch.object(registry, 'entry_points',
+                               return_value=[entry_point]) as entry_points:
+            self.assertIsInstance(registry.get_transport('ftp'),
+                                  RecordingTransport)
+        entry_points.assert_called_once_with(group='quartet_output.transports')
+        # entry points are only loaded once they are used
+        registry.get_transport('ftp')
+        entry_point.load.assert_called_once_with()
+
+    def test_entry_points_are_found(self):
+        entry_point = mock.Mock()
+        entry_point.name = 'ftp'
+        with mock.patch.object(registry.metadata, 'entry_points',
+                               return_value={registry.ENTRY_POINT_GROUP: [
+                                   entry_point]}):
+            self.assertEqual(
+                registry.entry_points(group=registry.ENTRY_POINT_GROUP),
+                [entry_point])
+        self.assertEqual(registry.entry_points(group='unittest.none'), [])
+
+
+class TestStepOverrides(TestCase):
+
+    def setUp(self):
+        end_point = EndPoint.objects.create(name='Partner',
+                                            urn='http://unittest.local/in')
+        self.criteria = EPCISOutputCriteria.objects.create(
+            name='Partner', end_point=end_point)
+
+    def test_transport_calls_the_step_mixin_methods(self):
+        from quartet_output.transport.http import HttpTransportMixin
+
+        class PostingStep(TransportStep, HttpTransportMixin):
+            def post_data(self, data, *args, **kwargs):
+                response = mock.Mock(text='')
+                response.data = data
+                self.posted = data
+                return response
+
+        step = PostingStep(None)
+        step._send_message('data', 'http', None, self.criteria)
+        self.assertEqual(step.posted, 'data')
+
+    def test_overrides_without_the_mixin_are_reported(self):
+        class PostingStep(TransportStep):
+            def get_auth(self, output_criteria):
+                pass
+
+        step = PostingStep(None)
+        post_data = mock.patch('quartet_output.transport.http.'
+                               'HttpTransportMixin.post_data')
+        with post_data as post_data, \
+                self.assertLogs(registry.logger, 'WARNING') as logs:
+            step._send_message('data', 'http', None, self.criteria)
+        post_data.assert_called_once()
+        self.assertIn('PostingStep defines get_auth but does not inherit '
+                      'HttpTransportMixin', logs.output[0])
@@ -0,0 +1,145 @@
+import uuid
+
+from django.test import TestCase
+from jinja2 import DictLoader, Environment
+
+from EPCPyYes.core.v1_2 import template_events
+from quartet_output import encoders, rendering
+from tests import event_factory
+from tests.test_encoders import stdlib_encoding
+
+
+class TestFragmentRendering(TestCase):
+
+    def setUp(self):
+        self.events = event_factory.pallet('1') + [
+            event_factory.transformation_event(
+                [event_factory.sgtin('3')], [event_factory.sgtin('4')]),
+            event_factory.transaction_event(
+                event_factory.sgtin('1', '4555555'),
+                [event_factory.sgtin('2', '4555555')]),
+        ]
+        self.events[0].id = uuid.uuid4()
+
+    def _create_document(self):
+        return template_events.EPCISEventListDocument(
+            list(self.events), created_date='2019-06-01T12:00:00')
+
+    def test_xml_matches_render(self):
+        self.assertEqual(
+            rendering.render_document(self._create_document()),
+            self._create_document().render()
+        )
+
+    def test_cached_xml_matches_render(self):
+        cache = rendering.FragmentCache(100)
+        statistics = rendering.CacheStatistics()
+        rendering.render_document(self._create_document(), cache=cache)
+        self.assertEqual(
+            rendering.render_document(self._create_document(), cache=cache,
+                                      statistics=statistics),
+            self._create_document().render()
+        )
+        self.assertEqual(statistics.hits, len(self.events))
+        self.assertEqual(statistics.ratio, 1.0)
+
+    def test_cached_json_matches_render_json(self):
+        cache = rendering.FragmentCache(100)
+        with stdlib_encoding():
+            rendering.render_document(self._create_document(),
+                                      rendering.JSON, cache)
+            self.assertEqual(
+                rendering.render_document(self._create_document(),
+                                          rendering.JSON, cache),
+                self._create_document().render_json()
+            )
+        self.assertEqual(len(cache), len(self.events))
+
+    def test_event_key(self):
+        event = self.events[1]
+        self.assertEqual(rendering.get_event_key(event), event.event_id)
+        self.assertEqual(rendering.get_event_key(self.events[0]),
+                         self.events[0].id)
+        event.event_id = None
+        self.assertIsNone(rendering.get_fragment_key(event, rendering.XML))
+
+    def test_custom_template_gets_the_document_context(self):
+        environment = Environment(loader=DictLoader({
+            'custom/object_event.xml':
+                '<ObjectEvent partner="{{ additional_context.partner }}"/>'
+        }))
+        event = self.events[0]
+        event._template = environment.get_template('custom/object_event.xml')
+        cache = rendering.FragmentCache(100)
+        document = template_events.EPCISEventListDocument(
+            [event], created_date='2019-06-01T12:00:00',
+            additional_context={'partner': 'Acme'})
+        rendered = rendering.render_document(document, cache=cache)
+        self.assertIn('<ObjectEvent partner="Acme"/>', rendered)
+        self.assertEqual(rendered, document.render())
+        self.assertEqual(len(cache), 0)
+
+    def test_changed_events_are_rendered_again(self):
+        cache = rendering.FragmentCache(100)
+        event = self.events[1]
+        first = rendering.render_fragments([event], rendering.XML, cache)
+        event.action = 'DELETE'
+        second = rendering.render_fragments([event], rendering.XML, cache)
+        self.assertNotEqual(first, second)
+        self.assertIn('DELETE', second[0])
+
+    def test_lru_eviction(self):
+        cache = rendering.FragmentCache(2)
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        self.assertEqual(cache.get('a'), 'A')
+        cache.set('c', 'C')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(len(cache), 2)
+
+    def test_render_fragments_without_cache(self):
+        fragments = rendering.render_fragments(self.events[:1],
+                                               rendering.JSON)
+        self.assertEqual(fragments,
+                         [encoders.render_event(self.events[0])])
+
+
+class TestDocumentRendering(TestCase):
+
+    def _create_document(self, events):
+        return template_events.EPCISEventListDocument(
+            list(events), created_date='2019-06-01T12:00:00')
+
+    def setUp(self):
+        self.events = []
+        for pallet in range(5):
+            self.events += event_factory.pallet(str(pallet))
+
+    def test_xml_is_identical(self):
+        self.assertEqual(
+            rendering.render_document(self._create_document(self.events),
+                                      cache=rendering.FragmentCache(100)),
+            self._create_document(self.events).render()
+        )
+
+    def test_json_is_identical(self):
+        self.assertEqual(
+            rendering.render_document(self._create_document(self.events),
+                                      rendering.JSON,
+                                      rendering.FragmentCache(100)),
+            rendering.render_document(self._create_document(self.events),
+                                      rendering.JSON)
+        )
+
+    def test_partly_cached(self):
+        cache = rendering.FragmentCache(100)
+        statistics = rendering.CacheStatistics()
+        rendering.render_fragments(self.events[:5], rendering.XML, cache)
+        fragments = rendering.render_fragments(
+            self.events, rendering.XML, cache, statistics)
+        self.assertEqual(
+            fragments,
+            rendering.render_fragments(self.events, rendering.XML))
+        self.assertEqual(statistics.hits, 5)
+        self.assertEqual(len(cache), len(self.events))
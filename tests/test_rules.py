@@ -7,7 +7,9 @@ test_quartet_output
 
 Tests for `quartet_output` models module.
 """
+import json
 import os
+from unittest import mock
 from urllib.parse import urlparse
 
 import paramiko
@@ -20,10 +22,11 @@ from EPCPyYes.core.SBDH.sbdh import StandardBusinessDocumentHeader as sbdheader
 from EPCPyYes.core.v1_2.CBV.business_steps import BusinessSteps
 from EPCPyYes.core.v1_2.CBV.dispositions import Disposition
 from EPCPyYes.core.v1_2.events import EventType
-from quartet_capture.models import Rule, Step, StepParameter, Task
+from quartet_capture.models import Rule, Step, StepParameter, Task, \
+    TaskMessage, TaskParameter
 from quartet_capture.tasks import execute_rule, execute_queued_task
 from quartet_epcis.parsing.context_parser import BusinessEPCISParser
-from quartet_output import models
+from quartet_output import models, rendering
 from quartet_output.models import EPCISOutputCriteria
 from quartet_output.steps import SimpleOutputParser, ContextKeys
 from quartet_output.transport.mail import MailMixin
@@ -184,6 +187,94 @@ class TestQuartetOutput(TestCase):
             task = Task.objects.get(name=task_name)
             self.assertEqual(task.status, 'FINISHED')
 
+    def test_rule_with_fast_json_output(self):
+        self._create_good_ouput_criterion()
+        db_rule = self._create_rule()
+        self._create_step(db_rule)
+        self._create_output_steps(db_rule)
+        self._create_comm_step(db_rule)
+        self._create_epcpyyes_step(db_rule, json=True, fast_json=True)
+        db_task = self._create_task(db_rule)
+        self._parse_test_data('data/commission_one_event.xml')
+        self._parse_test_data('data/nested_pack.xml')
+        curpath = os.path.dirname(__file__)
+        data_path = os.path.join(curpath, 'data/ship_pallet.xml')
+        with open(data_path, 'r') as data_file:
+            context = execute_rule(data_file.read().encode(), db_task)
+            message = json.loads(
+                context.context[ContextKeys.OUTBOUND_EPCIS_MESSAGE_KEY.value])
+            self.assertEqual(
+                len(message['events']),
+                sum(len(context.context[key.value]) for key in (
+                    ContextKeys.OBJECT_EVENTS_KEY,
+                    ContextKeys.AGGREGATION_EVENTS_KEY,
+                    ContextKeys.FILTERED_EVENTS_KEY))
+            )
+
+    def test_rule_with_cached_fragments(self):
+        self._create_good_ouput_criterion()
+        db_rule = self._create_rule()
+        self._create_step(db_rule)
+        self._create_output_steps(db_rule)
+        self._create_comm_step(db_rule)
+        self._create_epcpyyes_step(db_rule, cache_fragments=True)
+        self._parse_test_data('data/commission_one_event.xml')
+        self._parse_test_data('data/nested_pack.xml')
+        curpath = os.path.dirname(__file__)
+        data_path = os.path.join(curpath, 'data/ship_pallet.xml')
+        with open(data_path, 'r') as data_file:
+            data = data_file.read().encode()
+        rendering.reset_fragment_cache()
+        messages = []
+        for name in ('first task', 'second task'):
+            db_task = Task.objects.create(rule=db_rule, name=name)
+            context = execute_rule(data, db_task)
+            messages.append(
+                context.context[ContextKeys.OUTBOUND_EPCIS_MESSAGE_KEY.value])
+        self.assertEqual(messages[0].count('<ObjectEvent>'),
+                         messages[1].count('<ObjectEvent>'))
+        self.assertTrue(TaskMessage.objects.filter(
+            task__name='first task', message__contains=' 0 hits').exists())
+        self.assertFalse(TaskMessage.objects.filter(
+            task__name='second task', message__contains=' 0 hits').exists())
+
+    def test_rule_with_split_output(self):
+        self._create_good_ouput_criterion()
+        db_rule = self._create_rule()
+        self._create_step(db_rule)
+        self._create_output_steps(db_rule)
+        self._create_comm_step(db_rule)
+        step = self._create_epcpyyes_step(db_rule)
+        StepParameter.objects.create(step=step, name='Max Events Per Message',
+                                     value='2')
+        task_step = self._create_task_step(db_rule)
+        self._create_transport_rule()
+        StepParameter.objects.filter(step=task_step,
+                                     name='run-immediately').update(
+            value='False')
+        db_task = self._create_task(db_rule)
+        self._parse_test_data('data/commission_one_event.xml')
+        self._parse_test_data('data/nested_pack.xml')
+        curpath = os.path.dirname(__file__)
+        data_path = os.path.join(curpath, 'data/ship_pallet.xml')
+        with open(data_path, 'r') as data_file, \
+                mock.patch('quartet_output.tasks.execute_output_task.'
+                           'apply_async') as queue:
+            context = execute_rule(data_file.read().encode(), db_task)
+        messages = context.context[
+            ContextKeys.OUTBOUND_EPCIS_MESSAGES_KEY.value]
+        task_names = context.context[ContextKeys.CREATED_TASK_NAMES_KEY.value]
+        self.assertGreater(len(messages), 1)
+        self.assertEqual(len(task_names), len(messages))
+        self.assertEqual(queue.call_count, len(messages))
+        self.assertNotIn(ContextKeys.OUTBOUND_EPCIS_MESSAGE_KEY.value,
+                         context.context)
+        self.assertEqual(
+            TaskParameter.objects.get(
+                task__name=task_names[-1], name='Message Part').value,
+            '%s of %s' % (len(messages), len(messages))
+        )
+
     def test_rule_with_agg_comm_output(self):
         self._create_good_ouput_criterion()
         db_rule = self._create_rule()
@@ -596,7 +687,8 @@ class TestQuartetOutput(TestCase):
         step.description = 'unit test commissioning step'
         step.save()
 
-    def _create_epcpyyes_step(self, rule, json=False):
+    def _create_epcpyyes_step(self, rule, json=False, fast_json=False,
+                              cache_fragments=False):
         step = Step()
         step.rule = rule
         step.order = 4
@@ -611,6 +703,19 @@ class TestQuartetOutput(TestCase):
                 name='JSON',
                 value=True
             )
+        if fast_json:
+            StepParameter.objects.create(
+                step=step,
+                name='Fast JSON',
+                value=True
+            )
+        if cache_fragments:
+            StepParameter.objects.create(
+                step=step,
+                name='Cache Fragments',
+                value=True
+            )
+        return step
 
     def _create_forward_data_step(self, rule):
         step = Step()
@@ -0,0 +1,371 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from celery.exceptions import SoftTimeLimitExceeded
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from quartet_capture import models, rules
+from quartet_capture.rules import RuleContext
+from quartet_capture.tasks import execute_queued_task
+from quartet_output import delivery, scheduling
+from quartet_output.tasks import execute_deferred_task, execute_output_task
+from quartet_output.errors import EndPointThrottledError, TaskDeferredError
+from quartet_output.models import EndPoint, EndPointSlot, \
+    EndPointThrottle, EPCISOutputCriteria
+from quartet_output import steps
+from quartet_output.steps import TransportStep
+
+
+class CountingStep(rules.Step):
+    """
+    Records the data and context it sees and changes the data.
+    """
+    calls = []
+
+    def execute(self, data, rule_context):
+        CountingStep.calls.append((self.get_parameter('Name'), data,
+                                   dict(rule_context.context)))
+        rule_context.context['count'] = len(CountingStep.calls)
+        if self.get_boolean_parameter('Unsaved', False):
+            rule_context.context['unsaved'] = object()
+        return data + b'!'
+
+    @property
+    def declared_parameters(self):
+        return {}
+
+    def on_failure(self):
+        pass
+
+
+class OutboundMessageStep(rules.Step):
+    """
+    Puts a message and output criteria on the context as the output
+    parsing and rendering steps do.
+    """
+
+    def execute(self, data, rule_context):
+        rule_context.context[
+            steps.ContextKeys.EPCIS_OUTPUT_CRITERIA_KEY.value
+        ] = EPCISOutputCriteria.objects.get(name='Delayed Criteria')
+        rule_context.context[
+            steps.ContextKeys.OUTBOUND_EPCIS_MESSAGE_KEY.value
+        ] = '<epcis/>'
+
+    @property
+    def declared_parameters(self):
+        return {}
+
+    def on_failure(self):
+        pass
+
+
+class TestLimits(TestCase):
+
+    def setUp(self):
+        self.end_point = EndPoint.objects.create(
+            name='Limited', urn='http://unittest.local/limited',
+            rate_limit=2, burst=2, max_concurrency=1)
+
+    def test_token_bucket(self):
+        with mock.patch.object(scheduling.time, 'time', return_value=100):
+            self.assertEqual(scheduling.take_token(self.end_point), 0)
+            self.assertEqual(scheduling.take_token(self.end_point), 0)
+            self.assertAlmostEqual(scheduling.take_token(self.end_point),
+                                   0.5)
+        with mock.patch.object(scheduling.time, 'time', return_value=100.5):
+            self.assertEqual(scheduling.take_token(self.end_point), 0)
+            self.assertGreater(scheduling.take_token(self.end_point), 0)
+
+    def test_unlimited_endpoints_are_not_tracked(self):
+        end_point = EndPoint.objects.create(name='Open',
+                                            urn='http://unittest.local')
+        with scheduling.throttle(end_point):
+            pass
+        self.assertFalse(EndPointThrottle.objects.filter(
+            end_point=end_point).exists())
+
+    def test_concurrency_limit(self):
+        holder = scheduling.acquire_slot(self.end_point)
+        self.assertTrue(holder)
+        self.assertIsNone(scheduling.acquire_slot(self.end_point))
+        scheduling.release_slot(self.end_point, holder)
+        self.assertTrue(scheduling.acquire_slot(self.end_point))
+
+    def test_expired_slots_are_reclaimed(self):
+        with mock.patch.object(scheduling.time, 'time', return_value=100):
+            stale = scheduling.acquire_slot(self.end_point)
+            self.assertIsNone(scheduling.acquire_slot(self.end_point))
+        with mock.patch.object(scheduling.time, 'time',
+                               return_value=100 + 301):
+            holder = scheduling.acquire_slot(self.end_point)
+        self.assertTrue(holder)
+        # the stale holder can not free the slot that was taken over
+        scheduling.release_slot(self.end_point, stale)
+        self.assertEqual(EndPointSlot.objects.get().holder, holder)
+
+    def test_throttle_raises_a_deferral(self):
+        with scheduling.throttle(self.end_point):
+            with self.assertRaises(EndPointThrottledError) as context:
+                with scheduling.throttle(self.end_point, retry_delay=3):
+                    pass
+        self.assertEqual(context.exception.delay, 3)
+        self.assertNotIsInstance(context.exception, SoftTimeLimitExceeded)
+        self.assertEqual(EndPointSlot.objects.get().holder, '')
+
+
+class TestDeferral(TestCase):
+
+    def setUp(self):
+        self.rule = models.Rule.objects.create(name='Limited Rule')
+        end_point = EndPoint.objects.create(
+            name='Limited', urn='http://unittest.local/limited',
+            rate_limit=1, burst=1)
+        EPCISOutputCriteria.objects.create(name='Limited',
+                                           end_point=end_point)
+        # use up the only token
+        scheduling.take_token(end_point)
+
+    def _create_task(self, engine=False):
+        task = models.Task.objects.create(rule=self.rule, status='QUEUED')
+        models.TaskParameter.objects.create(
+            task=task, name='EPCIS Output Criteria', value='Limited')
+        if engine:
+            models.TaskParameter.objects.create(
+                task=task, name=delivery.ENGINE_PARAMETER, value='True')
+        return task
+
+    def _execute(self, task):
+        step = TransportStep(task)
+        # as set by the ResumableRule that loads the step
+        step.step_order = 1
+        with mock.patch.object(step, '_send_message') as send:
+            with self.assertRaises(EndPointThrottledError):
+                step.execute('data', RuleContext(self.rule.name, task.name))
+        send.assert_not_called()
+
+    def test_celery_tasks_are_requeued_with_a_countdown(self):
+        task = self._create_task()
+        with mock.patch('quartet_output.tasks.execute_deferred_task.'
+                        'apply_async') as apply_async:
+            self._execute(task)
+        self.assertTrue(models.TaskParameter.objects.filter(
+            task=task, name=scheduling.DEFERRED_PARAMETER).exists())
+        kwargs = apply_async.call_args[1]
+        self.assertEqual(kwargs['kwargs'], {'task_name': task.name})
+        self.assertGreater(kwargs['countdown'], 0)
+
+    def test_engine_skips_deferred_tasks(self):
+        task = self._create_task(engine=True)
+        self._execute(task)
+        engine = delivery.DeliveryEngine()
+        self.assertEqual(engine.claim_tasks(10), [])
+        models.TaskParameter.objects.filter(
+            task=task, name=scheduling.DEFERRED_PARAMETER
+        ).update(value=(timezone.now() - timedelta(seconds=1)).strftime(
+            scheduling.DEFERRED_FORMAT))
+        self.assertEqual([claimed.name for claimed, end_point_id in
+                          engine.claim_tasks(10)], [task.name])
+
+    def _create_rule_task(self):
+        models.Step.objects.create(
+            rule=self.rule, order=1, name='Send',
+            step_class='quartet_output.steps.TransportStep')
+        return [models.TaskParameter(name='EPCIS Output Criteria',
+                                     value='Limited')]
+
+    def test_queued_output_tasks_are_not_failed_when_deferred(self):
+        task_parameters = self._create_rule_task()
+        with mock.patch('quartet_output.tasks.execute_output_task.'
+                        'apply_async') as queue:
+            task = delivery.queue_task('data', 'Limited Rule',
+                                       task_parameters=task_parameters)
+        queue.assert_called_once_with(kwargs={'task_name': task.name},
+                                      priority=None)
+        with mock.patch('quartet_output.tasks.execute_deferred_task.'
+                        'apply_async') as apply_async:
+            execute_output_task(task.name)
+        self.assertEqual(models.Task.objects.get(name=task.name).status,
+                         'QUEUED')
+        apply_async.assert_called_once()
+
+    def test_execute_queued_task_waits_instead_of_deferring(self):
+        task = delivery.create_task('data', 'Limited Rule',
+                                    task_parameters=self._create_rule_task(),
+                                    engine=False)
+
+        def refill(delay):
+            EndPointThrottle.objects.update(tokens=1)
+
+        with mock.patch.object(TransportStep, '_send_message') as send, \
+            mock.patch.object(steps.time, 'sleep',
+                              side_effect=refill) as sleep:
+            execute_queued_task(task_name=task.name)
+        self.assertEqual(models.Task.objects.get(name=task.name).status,
+                         'FINISHED')
+        sleep.assert_called_once()
+        send.assert_called_once()
+        self.assertFalse(models.TaskParameter.objects.filter(
+            task=task, name=scheduling.DEFERRED_PARAMETER).exists())
+
+    def test_priority_is_passed_to_celery(self):
+        task_parameters = self._create_rule_task()
+        with mock.patch('quartet_output.tasks.execute_output_task.'
+                        'apply_async') as queue:
+            task = delivery.create_output_task(
+                'data', 'Limited Rule', task_parameters, priority=20)
+        self.assertEqual(queue.call_args[1]['priority'], 9)
+        with mock.patch('quartet_output.tasks.execute_deferred_task.'
+                        'apply_async') as apply_async:
+            scheduling.requeue(task.name, 5)
+        self.assertEqual(apply_async.call_args[1]['priority'], 9)
+        with self.settings(QUARTET_OUTPUT_CELERY_PRIORITY_REVERSED=True):
+            self.assertEqual(delivery.get_celery_priority(2), 7)
+        self.assertIsNone(delivery.get_celery_priority(0))
+        self.assertEqual(delivery.get_celery_priority(-3), 0)
+
+    def test_resume_deferred_tasks(self):
+        ready = self._create_task()
+        waiting = self._create_task()
+        for task, seconds in ((ready, -1), (waiting, 60)):
+            models.TaskParameter.objects.create(
+                task=task, name=scheduling.DEFERRED_PARAMETER,
+                value=(timezone.now() + timedelta(seconds=seconds)).strftime(
+                    scheduling.DEFERRED_FORMAT))
+        EndPointSlot.objects.create(end_point=EndPoint.objects.get(),
+                                    number=0, holder='dead', expires=1e12)
+        out = StringIO()
+        with mock.patch('quartet_output.tasks.execute_deferred_task.'
+                        'apply_async') as apply_async:
+            call_command('resume_deferred_tasks', '--reset-concurrency',
+                         stdout=out)
+        self.assertIn('Queued 1 deferred tasks.', out.getvalue())
+        self.assertEqual(apply_async.call_args[1]['kwargs'],
+                         {'task_name': ready.name})
+        self.assertEqual(EndPointSlot.objects.get().holder, '')
+
+
+class TestDeferredDelayStep(TestCase):
+
+    def setUp(self):
+        CountingStep.calls.clear()
+        self.rule = models.Rule.objects.create(name='Delayed Rule')
+        for order, name, step_class, parameters in (
+            (1, 'Before', 'tests.test_scheduling.CountingStep', {}),
+            (2, 'Delay', 'quartet_output.steps.DelayStep',
+             {'Timeout Interval': '60', 'Defer': 'True'}),
+            (3, 'After', 'tests.test_scheduling.CountingStep', {}),
+        ):
+            step = models.Step.objects.create(
+                rule=self.rule, order=order, name=name,
+                step_class=step_class)
+            parameters['Name'] = name
+            for key, value in parameters.items():
+                models.StepParameter.objects.create(step=step, name=key,
+                                                    value=value)
+
+    def _resume(self, task):
+        models.TaskParameter.objects.filter(
+            task=task, name=scheduling.DEFERRED_PARAMETER
+        ).update(value=(timezone.now() - timedelta(seconds=1)).strftime(
+            scheduling.DEFERRED_FORMAT))
+
+    def test_engine_task_resumes_after_the_delay(self):
+        task = delivery.create_task('data', 'Delayed Rule')
+        with mock.patch.object(steps.time, 'sleep') as sleep:
+            delivery.execute_task(task)
+        sleep.assert_not_called()
+        self.assertEqual(task.status, 'QUEUED')
+        # a deferral is not logged as an error
+        self.assertFalse(models.TaskMessage.objects.filter(
+            task=task, level='ERROR').exists())
+        self.assertEqual([call[0] for call in CountingStep.calls],
+                         ['Before'])
+        self._resume(task)
+        self.assertEqual(delivery.execute_task(task).status, 'FINISHED')
+        name, data, context = CountingStep.calls[-1]
+        self.assertEqual([call[0] for call in CountingStep.calls],
+                         ['Before', 'After'])
+        self.assertEqual(data, b'data!')
+        self.assertEqual(context['count'], 1)
+        self.assertFalse(models.TaskParameter.objects.filter(
+            task=task, name=scheduling.RESUME_STEP_PARAMETER).exists())
+
+    def test_unsaved_context_sleeps(self):
+        models.StepParameter.objects.create(
+            step=models.Step.objects.get(rule=self.rule, order=1),
+            name='Unsaved', value='True')
+        task = delivery.create_task('data', 'Delayed Rule')
+        with mock.patch.object(steps.time, 'sleep') as sleep:
+            self.assertEqual(delivery.execute_task(task).status, 'FINISHED')
+        sleep.assert_called_once_with(60)
+        self.assertEqual([call[0] for call in CountingStep.calls],
+                         ['Before', 'After'])
+        self.assertFalse(models.TaskParameter.objects.filter(
+            task=task, name=scheduling.RESUME_STEP_PARAMETER).exists())
+
+    def test_output_task_is_created_after_the_delay(self):
+        EPCISOutputCriteria.objects.create(
+            name='Delayed Criteria', end_point=EndPoint.objects.create(
+                name='Delayed', urn='http://unittest.local/delayed'))
+        models.Rule.objects.create(name='Delayed Transport')
+        rule = models.Rule.objects.create(name='Delayed Output')
+        for order, step_class, parameters in (
+            (1, 'tests.test_scheduling.OutboundMessageStep', {}),
+            (2, 'quartet_output.steps.DelayStep',
+             {'Timeout Interval': '60', 'Defer': 'True'}),
+            (3, 'quartet_output.steps.CreateOutputTaskStep',
+             {'Output Rule': 'Delayed Transport'}),
+        ):
+            step = models.Step.objects.create(
+                rule=rule, order=order, name=str(order),
+                step_class=step_class)
+            for key, value in parameters.items():
+                models.StepParameter.objects.create(step=step, name=key,
+                                                    value=value)
+        task = delivery.create_task('data', 'Delayed Output')
+        self.assertEqual(delivery.execute_task(task).status, 'QUEUED')
+        self.assertFalse(models.Task.objects.filter(
+            rule__name='Delayed Transport').exists())
+        self._resume(task)
+        with mock.patch('quartet_output.tasks.execute_output_task.'
+                        'apply_async'):
+            self.assertEqual(delivery.execute_task(task).status,
+                             'FINISHED')
+        output_task = models.Task.objects.get(rule__name='Delayed Transport')
+        self.assertEqual(models.TaskParameter.objects.get(
+            task=output_task, name=delivery.CRITERIA_PARAMETER).value,
+            'Delayed Criteria')
+
+    def test_celery_task_is_requeued(self):
+        task = delivery.create_task('data', 'Delayed Rule')
+        models.TaskParameter.objects.filter(
+            task=task, name=delivery.ENGINE_PARAMETER).delete()
+        with mock.patch('quartet_output.tasks.execute_deferred_task.'
+                        'apply_async') as apply_async:
+            delivery.execute_task(task)
+        self.assertEqual(apply_async.call_args[1],
+                         {'kwargs': {'task_name': task.name},
+                          'countdown': 60, 'priority': None})
+        execute_deferred_task(task.name)
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'FINISHED')
+        self.assertEqual([call[0] for call in CountingStep.calls],
+                         ['Before', 'After'])
+
+    def test_order_comes_from_the_rule(self):
+        task = delivery.create_task('data', 'Delayed Rule')
+        other = models.Step(order=99)
+        rule = scheduling.ResumableRule(self.rule, task)
+        # another rule loaded afterwards replaces the class attribute
+        with mock.patch.object(steps.DelayStep, 'db_step', other,
+                               create=True):
+            with self.assertRaises(TaskDeferredError):
+                rule.execute(rule.read_data())
+        self.assertEqual(models.TaskParameter.objects.get(
+            task=task, name=scheduling.RESUME_STEP_PARAMETER).value, '2')
+        # a step that was not loaded by a ResumableRule sleeps instead
+        self.assertIsNone(steps.DelayStep(task).get_order())
@@ -0,0 +1,89 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.test import TestCase
+
+from quartet_output.transport import sessions
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def do_POST(self):
+        RecordingHandler.connections.add(self.client_address)
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestSessionRegistry(TestCase):
+
+    def setUp(self):
+        self.registry = sessions.SessionRegistry(pool_size=2, idle_timeout=60)
+
+    def tearDown(self):
+        self.registry.close()
+
+    def _get(self, url, auth_info=None):
+        with self.registry.session(url, auth_info) as session:
+            return session
+
+    def test_sessions_are_shared_per_origin(self):
+        session = self._get('https://example.com/a')
+        self.assertIs(session, self._get('https://EXAMPLE.com:443/b'))
+        self.assertIsNot(session, self._get('http://example.com/a'))
+        self.assertEqual(len(self.registry), 2)
+
+    def test_sessions_are_separated_by_credentials(self):
+        session = self._get('https://example.com', mock.Mock(pk=1))
+        self.assertIsNot(session,
+                         self._get('https://example.com', mock.Mock(pk=2)))
+        self.assertIsNot(session, self._get('https://example.com'))
+
+    def test_idle_sessions_are_closed(self):
+        with mock.patch.object(sessions.time, 'monotonic', return_value=0):
+            session = self._get('https://example.com')
+        with mock.patch.object(session, 'close') as close, \
+                mock.patch.object(sessions.time, 'monotonic', return_value=61):
+            self.assertIsNot(session,
+                             self._get('https://example.com'))
+        close.assert_called_once_with()
+        self.assertEqual(len(self.registry), 1)
+
+    def test_sessions_in_use_are_not_closed(self):
+        with mock.patch.object(sessions.time, 'monotonic', return_value=0):
+            key, session = self.registry.acquire('https://example.com')
+        with mock.patch.object(session, 'close') as close, \
+                mock.patch.object(sessions.time, 'monotonic', return_value=61):
+            self._get('https://example.org')
+            close.assert_not_called()
+            self.registry.release(key)
+            self.assertIs(session, self._get('https://example.com'))
+        with mock.patch.object(session, 'close') as close, \
+                mock.patch.object(sessions.time, 'monotonic',
+                                  return_value=122):
+            self._get('https://example.org')
+        close.assert_called_once_with()
+
+    def test_connections_are_reused(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), RecordingHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%s/' % server.server_port
+            for i in range(3):
+                with self.registry.session(url) as session:
+                    response = session.post(url, 'data')
+                self.assertEqual(response.status_code, 200)
+        finally:
+            self.registry.close()
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.assertEqual(len(RecordingHandler.connections), 1)
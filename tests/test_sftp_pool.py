@@ -0,0 +1,161 @@
+from unittest import mock
+
+import paramiko
+from django.test import TestCase
+
+from quartet_output.errors import ConnectionPoolTimeout
+from quartet_output.transport import sftp_pool
+from quartet_output.transport.sftp import SftpTransportMixin
+
+KEY = ('testsftphost', 22, 'foo', 'hash')
+SSHClient = paramiko.SSHClient
+
+
+def connect():
+    client = mock.Mock(spec=SSHClient)
+    client.get_transport.return_value.is_active.return_value = True
+    client.open_sftp.return_value = mock.MagicMock()
+    return client
+
+
+class TestSftpConnectionPool(TestCase):
+
+    def setUp(self):
+        self.pool = sftp_pool.SftpConnectionPool(max_size=2, idle_timeout=60,
+                                                 acquire_timeout=0.01)
+
+    def test_connections_are_reused(self):
+        with self.pool.connection(KEY, connect) as connection:
+            self.assertFalse(connection.reused)
+        with self.pool.connection(KEY, connect) as reused:
+            self.assertIs(reused, connection)
+            self.assertTrue(reused.reused)
+        connection.client.get_transport().set_keepalive.assert_called_with(30)
+
+    def test_failed_connections_are_discarded(self):
+        with self.assertRaises(ValueError):
+            with self.pool.connection(KEY, connect) as connection:
+                raise ValueError()
+        connection.client.close.assert_called_once_with()
+        with self.pool.connection(KEY, connect) as other:
+            self.assertIsNot(other, connection)
+
+    def test_dead_connections_are_discarded(self):
+        with self.pool.connection(KEY, connect) as connection:
+            pass
+        connection.client.get_transport().is_active.return_value = False
+        with self.pool.connection(KEY, connect) as other:
+            self.assertIsNot(other, connection)
+        connection.client.close.assert_called_once_with()
+
+    def test_idle_connections_are_closed(self):
+        with self.pool.connection(KEY, connect) as connection:
+            pass
+        self.pool.close_idle(connection.last_used + 61)
+        connection.client.close.assert_called_once_with()
+
+    def test_pool_is_bounded(self):
+        self.pool.acquire(KEY, connect)
+        self.pool.acquire(KEY, connect)
+        with self.assertRaises(ConnectionPoolTimeout):
+            self.pool.acquire(KEY, connect)
+        self.pool.acquire(KEY[:3] + ('other',), connect)
+
+
+class TestSftpPut(TestCase):
+
+    def setUp(self):
+        self.pool = sftp_pool.SftpConnectionPool()
+        patcher = mock.patch.object(sftp_pool, '_pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.output_criteria = mock.Mock()
+        self.output_criteria.end_point.urn = 'sftp://testsftphost:22/upload'
+        self.output_criteria.authentication_info.private_key = None
+        self.rule_context = mock.Mock(task_name='task')
+
+    def _put(self):
+        with mock.patch('paramiko.SSHClient', side_effect=connect):
+            return SftpTransportMixin().sftp_put(
+                b'data', self.rule_context, self.output_criteria)
+
+    def test_uploads_share_a_connection(self):
+        self._put()
+        self._put()
+        (key, idle), = self.pool._idle.items()
+        self.assertEqual(len(idle), 1)
+        self.assertEqual(idle[0].sftp.putfo.call_count, 2)
+        self.assertEqual(key[:3], ('testsftphost', 22,
+                         self.output_criteria.authentication_info.username))
+
+    def test_dropped_connection_is_retried(self):
+        self._put()
+        (key, idle), = self.pool._idle.items()
+        stale = idle[0]
+        stale.sftp.putfo.side_effect = EOFError()
+        self._put()
+        stale.client.close.assert_called_once_with()
+        self.assertIsNot(self.pool._idle[key][0], stale)
+        self.pool._idle[key][0].sftp.putfo.assert_called_once_with(
+            mock.ANY, '/upload/task.xml', confirm=False)
+
+    def test_sftp_errors_are_not_retried(self):
+        self._put()
+        (key, idle), = self.pool._idle.items()
+        stale = idle[0]
+        stale.sftp.putfo.side_effect = IOError(2, 'No such file')
+        with self.assertRaises(IOError):
+            self._put()
+        self.assertEqual(stale.sftp.putfo.call_count, 2)
+        self.assertEqual(len(self.pool._idle[key]), 0)
+
+    def test_socket_errors_on_a_closed_transport_are_retried(self):
+        self._put()
+        (key, idle), = self.pool._idle.items()
+        stale = idle[0]
+
+        def drop(*args, **kwargs):
+            stale.client.get_transport.return_value.is_active.return_value = \
+                False
+            raise OSError(104, 'Connection reset by peer')
+        stale.sftp.putfo.side_effect = drop
+        self._put()
+        self.assertIsNot(self.pool._idle[key][0], stale)
+
+
+class TestSftpPutFiles(TestSftpPut):
+
+    def _put_files(self, files, channels=2, client=None):
+        with mock.patch('paramiko.SSHClient',
+                        side_effect=lambda: client or connect()), \
+            mock.patch('paramiko.SFTPClient.from_transport',
+                       side_effect=lambda transport: mock.MagicMock()) as \
+                from_transport:
+            results = SftpTransportMixin().sftp_put_files(
+                files, self.output_criteria, channels)
+        return results, from_transport
+
+    def test_files_are_renamed_into_place(self):
+        files = [('%s.xml' % i, b'data') for i in range(5)]
+        results, from_transport = self._put_files(files, channels=3)
+        self.assertEqual(results, {name: None for name, data in files})
+        self.assertEqual(from_transport.call_count, 2)
+        (key, idle), = self.pool._idle.items()
+        sftp = idle[0].sftp
+        sftp.open.assert_any_call('/upload/.0.xml.part', 'wb')
+        sftp.posix_rename.assert_any_call('/upload/.0.xml.part',
+                                          '/upload/0.xml')
+        remote_file = sftp.open.return_value.__enter__.return_value
+        remote_file.set_pipelined.assert_called_with(True)
+
+    def test_rename_fallback_and_errors(self):
+        client = connect()
+        sftp = client.open_sftp.return_value
+        sftp.posix_rename.side_effect = IOError()
+        sftp.open.side_effect = [mock.MagicMock(), IOError('full')]
+        results, from_transport = self._put_files(
+            [('a.xml', b'a'), ('b.xml', b'b')], channels=1, client=client)
+        sftp.rename.assert_called_once_with('/upload/.a.xml.part',
+                                            '/upload/a.xml')
+        self.assertIsNone(results['a.xml'])
+        self.assertIsInstance(results['b.xml'], IOError)
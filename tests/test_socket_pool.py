@@ -0,0 +1,120 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import TestCase
+
+from quartet_output.transport import socket_pool
+from quartet_output.transport.tcp import SocketTransportMixin
+from tests.socket_server import LocalSocketServer
+
+
+class TestSocketChannel(TestCase):
+
+    def test_connection_is_closed_after_each_write(self):
+        with LocalSocketServer() as server:
+            channel = socket_pool.SocketChannel(server.address)
+            for i in range(3):
+                channel.send(b'job%d' % i)
+                self.assertIsNone(channel._socket)
+            self.assertEqual(server.wait_for(12), b'job0job1job2')
+        self.assertEqual(server.connections, 3)
+
+    def test_connection_is_reused(self):
+        with LocalSocketServer() as server:
+            channel = socket_pool.SocketChannel(server.address,
+                                                idle_timeout=5)
+            for i in range(5):
+                channel.send(b'job%d' % i)
+            self.assertEqual(server.wait_for(20), b'job0job1job2job3job4')
+            channel.close()
+        self.assertEqual(server.connections, 1)
+
+    def test_idle_connection_is_closed(self):
+        with LocalSocketServer() as server:
+            channel = socket_pool.SocketChannel(server.address,
+                                                idle_timeout=0.05)
+            channel.send(b'job')
+            self.assertIsNotNone(channel._socket)
+            end = time.monotonic() + 5
+            while channel._socket is not None and time.monotonic() < end:
+                time.sleep(0.01)
+            self.assertIsNone(channel._socket)
+            channel.send(b'job')
+            self.assertEqual(server.wait_for(6), b'jobjob')
+            channel.close()
+        self.assertEqual(server.connections, 2)
+
+    def test_reconnects_after_peer_closes(self):
+        with LocalSocketServer(close_connections=True) as server:
+            channel = socket_pool.SocketChannel(server.address,
+                                                idle_timeout=5)
+            channel.send(b'first')
+            server.wait_for(5)
+            time.sleep(0.05)
+            channel.send(b'second')
+            self.assertEqual(server.wait_for(11), b'firstsecond')
+            channel.close()
+        self.assertEqual(server.connections, 2)
+
+    def test_failed_send_is_not_repeated(self):
+        with LocalSocketServer() as server:
+            channel = socket_pool.SocketChannel(server.address,
+                                                idle_timeout=5)
+            channel.send(b'first')
+            server.wait_for(5)
+            sendall = mock.Mock(side_effect=BrokenPipeError())
+            channel._socket = mock.Mock(wraps=channel._socket,
+                                        sendall=sendall)
+            with mock.patch.object(channel, '_is_alive', return_value=True):
+                with self.assertRaises(BrokenPipeError):
+                    channel.send(b'second')
+            self.assertEqual(sendall.call_count, 1)
+            self.assertIsNone(channel._socket)
+            channel.send(b'third')
+            self.assertEqual(server.wait_for(10), b'firstthird')
+            channel.close()
+        self.assertEqual(server.connections, 2)
+
+    def test_batching_window_coalesces_writes(self):
+        with LocalSocketServer() as server:
+            channel = socket_pool.SocketChannel(server.address)
+            with mock.patch.object(channel, '_write',
+                                   wraps=channel._write) as write:
+                threads = [threading.Thread(target=channel.send,
+                                            args=(b'job', 0.1))
+                           for i in range(5)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            self.assertEqual(server.wait_for(15), b'job' * 5)
+            self.assertLess(write.call_count, 5)
+            channel.close()
+
+    def test_batch_errors_reach_every_sender(self):
+        channel = socket_pool.SocketChannel(('127.0.0.1', 1))
+        with mock.patch.object(channel, '_write',
+                               side_effect=ConnectionRefusedError()):
+            with self.assertRaises(ConnectionRefusedError):
+                channel.send(b'job', 0.01)
+
+
+class TestSocketTransport(TestCase):
+
+    def test_socket_send(self):
+        output_criteria = mock.Mock()
+        info = mock.Mock()
+        with LocalSocketServer() as server:
+            output_criteria.end_point.urn = 'socket://127.0.0.1:%s' % \
+                                            server.address[1]
+            pool = socket_pool.SocketPool(idle_timeout=5)
+            with mock.patch.object(socket_pool, '_pool', pool):
+                for i in range(3):
+                    SocketTransportMixin().socket_send(
+                        b'^XA^XZ', mock.Mock(), output_criteria, info)
+            self.assertEqual(server.wait_for(18), b'^XA^XZ' * 3)
+            pool.close()
+        self.assertEqual(server.connections, 1)
+        info.assert_called_with('Sending %s bytes to %s.', 6,
+                                output_criteria.end_point.urn)
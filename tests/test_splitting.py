@@ -0,0 +1,48 @@
+from django.test import TestCase
+
+from quartet_output import splitting
+from tests import event_factory
+
+
+class TestSplitting(TestCase):
+
+    def setUp(self):
+        self.pallets = [event_factory.pallet(str(pallet))
+                        for pallet in range(3)]
+        self.events = [event for pallet in self.pallets for event in pallet]
+
+    def test_group_hierarchies(self):
+        self.assertEqual(splitting.group_hierarchies(self.events),
+                         self.pallets)
+
+    def test_group_hierarchies_keeps_order(self):
+        pallet_event = self.pallets[1][-1]
+        events = [pallet_event] + [event for event in self.events
+                                   if event is not pallet_event]
+        groups = splitting.group_hierarchies(events)
+        self.assertEqual(len(groups), 3)
+        self.assertEqual(groups[0], [pallet_event] + self.pallets[1][:-1])
+        self.assertEqual(groups[1], self.pallets[0])
+
+    def test_pack(self):
+        units = [[1, 2], [3], [4, 5, 6], [7]]
+        self.assertEqual(splitting.pack(units, 3),
+                         [[[1, 2], [3]], [[4, 5, 6]], [[7]]])
+        self.assertEqual(splitting.pack(units, 2),
+                         [[[1, 2]], [[3]], [[4, 5, 6]], [[7]]])
+        self.assertEqual(splitting.pack(units), [units])
+
+    def test_split_by_bytes(self):
+        def render(events):
+            return 'x' * 10 * len(events)
+
+        units = [[event] for event in self.events]
+        messages = splitting.split_events(units, render, max_bytes=40)
+        self.assertTrue(all(len(message) <= 40 for message in messages))
+        self.assertEqual(sum(len(message) for message in messages),
+                         10 * len(self.events))
+
+    def test_split_on_pallets(self):
+        units = splitting.group_hierarchies(self.events)
+        messages = splitting.split_events(units, len, max_events=1)
+        self.assertEqual(messages, [len(pallet) for pallet in self.pallets])
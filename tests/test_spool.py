@@ -0,0 +1,149 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+
+from quartet_capture import models
+from quartet_capture.rules import RuleContext
+from quartet_output import delivery, spool
+from quartet_output.errors import CircuitOpenError
+from quartet_output.models import EndPoint, EPCISOutputCriteria
+from quartet_output.steps import TransportStep
+from quartet_output.transport import circuit, file
+
+
+class TestDeadLetterSpool(TransactionTestCase):
+
+    def setUp(self):
+        circuit.reset_breakers()
+        self.addCleanup(circuit.reset_breakers)
+        spool_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_directory.cleanup)
+        self.drop = tempfile.TemporaryDirectory()
+        self.addCleanup(self.drop.cleanup)
+        settings = override_settings(
+            QUARTET_OUTPUT_DEAD_LETTER_DIR=spool_directory.name,
+            QUARTET_OUTPUT_FILE_FSYNC='never')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.spool = spool.get_spool()
+        self.end_point = EndPoint.objects.create(
+            name='Partner', urn='file://%s' % self.drop.name)
+        EPCISOutputCriteria.objects.create(name='Partner',
+                                           end_point=self.end_point)
+        self.rule = models.Rule.objects.create(name='Transport Rule')
+
+    def _execute(self, count=1):
+        for i in range(count):
+            task = models.Task.objects.create(rule=self.rule,
+                                              status='RUNNING')
+            models.TaskParameter.objects.create(
+                task=task, name='EPCIS Output Criteria', value='Partner')
+            step = TransportStep(task, **{'file-extension': 'txt'})
+            try:
+                step.execute('<epcis>%s</epcis>' % i,
+                             RuleContext(self.rule.name, task.name))
+            except ConnectionError:
+                pass
+
+    def _fail(self):
+        return mock.patch.object(
+            file.FileTransportMixin, 'file_put',
+            side_effect=ConnectionError('The share is offline.'))
+
+    def test_failed_messages_are_spooled(self):
+        with self._fail():
+            self._execute(3)
+        self.assertEqual(self.spool.get_end_point_ids(), [self.end_point.pk])
+        self.assertEqual(self.spool.count(self.end_point.pk), 3)
+        path, = self.spool.get_files(self.end_point.pk)
+        offset, header, payload = next(self.spool.read(path))
+        self.assertEqual(payload, b'<epcis>0</epcis>')
+        self.assertEqual(header['parameters'], {'file-extension': 'txt'})
+        self.assertEqual(header['error'], 'The share is offline.')
+
+    def test_client_errors_are_not_spooled(self):
+        error = ConnectionError('Bad request')
+        error.response = mock.Mock(status_code=400)
+        with mock.patch.object(file.FileTransportMixin, 'file_put',
+                               side_effect=error):
+            self._execute()
+        self.assertEqual(self.spool.get_end_point_ids(), [])
+
+    def test_replay(self):
+        with self._fail():
+            self._execute(5)
+        # the outage is over
+        circuit.reset_breakers()
+        out = StringIO()
+        call_command('replay_dead_letters', '--chunk-size=2', stdout=out)
+        self.assertIn('Partner: 5/5 (100%)', out.getvalue())
+        self.assertIn('Delivered 5 messages; 0 are still spooled.',
+                      out.getvalue())
+        self.assertEqual(len(os.listdir(self.drop.name)), 5)
+        self.assertEqual(self.spool.get_end_point_ids(), [])
+        self.assertEqual(models.TaskParameter.objects.filter(
+            name=delivery.DELIVERY_STATUS_PARAMETER % self.end_point.pk,
+            value=delivery.DELIVERED).count(), 5)
+
+    def test_failed_replays_stay_spooled(self):
+        with self._fail():
+            self._execute(3)
+            delivered, failed = spool.Replay(self.spool).replay()
+        self.assertEqual((delivered, failed), (0, 3))
+        path, = self.spool.get_files(self.end_point.pk)
+        self.assertTrue(path.endswith(spool.SPOOL_FILE))
+        attempts = [header['attempts']
+                    for offset, header, payload in self.spool.read(path)]
+        self.assertEqual(attempts, [2, 2, 2])
+
+    def test_interrupted_replay_resumes(self):
+        with self._fail():
+            self._execute(4)
+        path, = self.spool.claim(self.end_point.pk)
+        offsets = [offset for offset, header, payload
+                   in self.spool.read(path)]
+        self.spool.save_offset(path, offsets[1])
+        # messages spooled during a replay go to a new log
+        with self._fail():
+            self._execute(1)
+        circuit.reset_breakers()
+        self.assertEqual(self.spool.count(self.end_point.pk), 3)
+        self.assertEqual(spool.Replay(self.spool).replay(), (3, 0))
+        self.assertEqual(len(os.listdir(self.drop.name)), 3)
+
+    def test_spooled_messages_are_not_sent_again(self):
+        with self._fail():
+            self._execute()
+        task = models.Task.objects.get()
+        self.assertEqual(models.TaskParameter.objects.get(
+            task=task,
+            name=delivery.DELIVERY_STATUS_PARAMETER % self.end_point.pk
+        ).value, delivery.SPOOLED)
+        # the task is run again before the spool is replayed
+        circuit.reset_breakers()
+        step = TransportStep(task, **{'file-extension': 'txt'})
+        step.execute('<epcis>0</epcis>',
+                     RuleContext(self.rule.name, task.name))
+        self.assertEqual(os.listdir(self.drop.name), [])
+        self.assertEqual(spool.Replay(self.spool).replay(), (1, 0))
+        self.assertEqual(len(os.listdir(self.drop.name)), 1)
+
+    @override_settings(QUARTET_OUTPUT_CIRCUIT_FAILURE_THRESHOLD=1)
+    def test_open_circuit_defers_instead_of_spooling(self):
+        with self._fail():
+            self._execute()
+        task = models.Task.objects.create(rule=self.rule, status='RUNNING')
+        models.TaskParameter.objects.create(
+            task=task, name='EPCIS Output Criteria', value='Partner')
+        step = TransportStep(task, **{'file-extension': 'txt'})
+        step.step_order = 1
+        with mock.patch('quartet_output.scheduling.requeue') as requeue, \
+                self.assertRaises(CircuitOpenError):
+            step.execute('<epcis>1</epcis>',
+                         RuleContext(self.rule.name, task.name))
+        requeue.assert_called_once_with(task.name, mock.ANY)
+        self.assertEqual(self.spool.count(self.end_point.pk), 1)
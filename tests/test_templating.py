@@ -0,0 +1,70 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from EPCPyYes.core.v1_2 import template_events
+from quartet_templates.models import Template
+from quartet_output import templating
+
+
+class TestTemplating(TestCase):
+
+    def tearDown(self):
+        templating.reset_environment()
+
+    def test_events_share_environment(self):
+        event = template_events.ObjectEvent(
+            epc_list=['urn:epc:id:sgtin:1.1.1'])
+        self.assertIs(event._env, templating.get_environment())
+        document = template_events.EPCISEventListDocument([event])
+        self.assertIs(document._env, templating.get_environment())
+        self.assertIn('urn:epc:id:sgtin:1.1.1', document.render())
+
+    def test_bytecode_cache_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(
+                    QUARTET_OUTPUT_BYTECODE_CACHE_DIR=directory):
+                templating.reset_environment()
+                templating.get_environment().get_template(
+                    'epcis/object_event.xml')
+                self.assertEqual(len(os.listdir(directory)), 1)
+
+    @override_settings(QUARTET_OUTPUT_BYTECODE_CACHE=False)
+    def test_bytecode_cache_disabled(self):
+        templating.reset_environment()
+        self.assertIsNone(templating.get_environment().bytecode_cache)
+
+    def test_load_quartet_template(self):
+        Template.objects.create(name='Unit Test Template',
+                                content='{{ value }}')
+        template = templating.load_quartet_template('Unit Test Template')
+        self.assertEqual(template.render(value='test'), 'test')
+        self.assertIs(
+            template,
+            templating.load_quartet_template('Unit Test Template')
+        )
+        Template.objects.filter(name='Unit Test Template').update(
+            content='changed {{ value }}')
+        template = templating.load_quartet_template('Unit Test Template')
+        self.assertEqual(template.render(value='test'), 'changed test')
+
+    def test_load_missing_quartet_template(self):
+        with self.assertRaises(Template.DoesNotExist):
+            templating.load_quartet_template('Missing Template')
+
+    def test_compile_output_templates(self):
+        Template.objects.create(name='Unit Test Template',
+                                content='{{ value }}')
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(
+                    QUARTET_OUTPUT_BYTECODE_CACHE_DIR=directory):
+                templating.reset_environment()
+                out = StringIO()
+                call_command('compile_output_templates', '--all', stdout=out)
+                count = len(templating.list_epcpyyes_templates()) + 1
+                self.assertIn('Compiled %s of %s' % (count, count),
+                              out.getvalue())
+                self.assertEqual(len(os.listdir(directory)), count)